@@ -2,11 +2,27 @@ from django.contrib import admin
 from django.urls import path
 from django.shortcuts import redirect
 from django.urls import reverse
-from .models import Category, Product, ProductImage
+from .models import Category, ImportJob, Product, ProductImage
 from .admin_views import import_products, download_import_template
+from .signals import defer_catalog_updates
 from .widgets import HierarchicalCategorySelect
 
 
+class DeferCatalogUpdatesMixin:
+    """
+    Удаление из админки (в том числе действием над списком) пересчитывает
+    счетчики и меняет версию каталога один раз, а не на каждый объект
+    """
+
+    def delete_model(self, request, obj):
+        with defer_catalog_updates():
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with defer_catalog_updates():
+            super().delete_queryset(request, queryset)
+
+
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
     extra = 1
@@ -14,36 +30,38 @@ class ProductImageInline(admin.TabularInline):
 
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(DeferCatalogUpdatesMixin, admin.ModelAdmin):
     list_display = ['get_hierarchical_name',
                     'parent', 'order', 'is_active', 'created_at']
     list_filter = ['is_active', 'parent']
     search_fields = ['name']
     list_editable = ['order', 'is_active']
-    ordering = ['parent__name', 'name', 'order']
+    list_select_related = ['parent']
+    # Сортировка по материализованному пути выводит дерево в порядке обхода
+    ordering = ['path']
     prepopulated_fields = {'slug': ('name',)}
 
     def get_hierarchical_name(self, obj):
         """Отображает иерархическое название категории"""
-        if obj.parent:
-            return f"{'　' * obj.get_ancestors().count()}{obj.name}"
-        return obj.name
+        return obj.get_hierarchical_name()
     get_hierarchical_name.short_description = 'Название'
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == 'parent':
             kwargs['widget'] = HierarchicalCategorySelect(
                 attrs={'class': 'form-control'})
+            kwargs['queryset'] = Category.objects.order_by('path')
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(DeferCatalogUpdatesMixin, admin.ModelAdmin):
     list_display = ['title', 'article', 'category', 'subcategory',
                     'availability', 'is_active', 'views_count', 'created_at']
     list_filter = ['is_active', 'availability', 'category', 'subcategory']
     search_fields = ['title', 'article', 'description']
     list_editable = ['is_active', 'availability']
+    list_select_related = ['category', 'subcategory']
     ordering = ['-created_at']
     prepopulated_fields = {'slug': ('title',)}
     inlines = [ProductImageInline]
@@ -54,6 +72,7 @@ class ProductAdmin(admin.ModelAdmin):
         if db_field.name in ['category', 'subcategory']:
             kwargs['widget'] = HierarchicalCategorySelect(
                 attrs={'class': 'form-control'})
+            kwargs['queryset'] = Category.objects.order_by('path')
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
     def get_urls(self):
@@ -94,3 +113,26 @@ class ProductImageAdmin(admin.ModelAdmin):
     list_filter = ['product']
     list_editable = ['order']
     ordering = ['order']
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    """Задания импорта только просматриваются: ставятся со страницы импорта"""
+    list_display = ['id', 'status', 'category', 'processed_rows', 'total_rows',
+                    'created_by', 'created_at', 'finished_at']
+    list_filter = ['status']
+    # Файл лежит в закрытом хранилище, ссылка на него не выводится
+    exclude = ['file']
+    readonly_fields = ['file_name', 'category', 'update_existing', 'delete_missing',
+                       'status', 'processed_rows', 'total_rows', 'result',
+                       'created_by', 'created_at', 'started_at', 'finished_at']
+
+    @admin.display(description='Файл')
+    def file_name(self, obj):
+        return obj.file.name or '-'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -1,23 +1,23 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from .forms import ImportForm
-from .utils import ImportProcessor
-
+from .import_jobs import ImportJobConflict, enqueue_import, job_state
+from .models import ImportJob
 
 @staff_member_required
 def import_products(request):
-    """Представление для импорта товаров"""
+    """
+    Представление для импорта товаров.
+
+    Импорт ставится в очередь и выполняется командой run_import_worker:
+    в запросе он упирался бы в timeout воркера gunicorn.
+    """
     if request.method == 'POST':
         form = ImportForm(request.POST, request.FILES)
         if form.is_valid():
-            file = request.FILES['file']
-            category = form.cleaned_data.get('category')
-            update_existing = form.cleaned_data['update_existing']
-            delete_missing = form.cleaned_data['delete_missing']
-
             # Проверяем, является ли это AJAX запросом
             is_ajax = (
                 request.headers.get('X-Requested-With') == 'XMLHttpRequest' or
@@ -25,77 +25,23 @@ def import_products(request):
             )
 
             try:
-                # Создаем процессор импорта
-                category_id = category.id if category else None
-                processor = ImportProcessor(
-                    file, category_id, update_existing, delete_missing)
-
-                # Для AJAX запросов устанавливаем callback для отслеживания прогресса
-                if is_ajax:
-                    def progress_callback(processed, total):
-                        # Callback ничего не делает, так как прогресс хранится в глобальной переменной
-                        pass
-
-                    processor.set_progress_callback(progress_callback)
-
-                # Обрабатываем файл
-                success = processor.process_file()
-
-                result = {
-                    'success': success,
-                    'message': processor.get_result_message(),
-                    'imported': processor.imported_count,
-                    'updated': processor.updated_count,
-                    'skipped': processor.skipped_count,
-                    'errors': processor.errors,
-                    'warnings': processor.warnings
-                }
-
-                if is_ajax:
-                    # Для AJAX запросов возвращаем JSON
-                    return JsonResponse(result)
-                else:
-                    # Для обычных запросов используем Django messages
-                    if success:
-                        messages.success(request, 'Импорт успешно завершен!')
-                        # Форматируем сообщение с результатами
-                        result_lines = processor.get_result_message().split('\n')
-                        for line in result_lines:
-                            if line.startswith('[СОЗДАНО]') or line.startswith('✅'):
-                                messages.success(request, line)
-                            elif line.startswith('[ОБНОВЛЕНО]') or line.startswith('🔄'):
-                                messages.info(request, line)
-                            elif line.startswith('[ПРОПУЩЕНО]') or line.startswith('⏭️'):
-                                messages.warning(request, line)
-                            elif line.startswith('[ПРЕДУПРЕЖДЕНИЕ]') or line.startswith('⚠️'):
-                                messages.warning(request, line)
-                            elif line.startswith('[ОШИБКА]') or line.startswith('❌'):
-                                messages.error(request, line)
-                    else:
-                        messages.error(request, 'Ошибка при импорте товаров')
-                        result_lines = processor.get_result_message().split('\n')
-                        for line in result_lines:
-                            if line.strip():
-                                messages.error(request, line)
-
-                    return redirect('admin:catalog_product_changelist')
-            except Exception as e:
-                error_result = {
-                    'success': False,
-                    'message': f'Ошибка при обработке импорта: {str(e)}',
-                    'errors': [str(e)],
-                    'imported': 0,
-                    'updated': 0,
-                    'skipped': 0,
-                    'warnings': []
-                }
-
+                job = enqueue_import(
+                    request.FILES['file'],
+                    category=form.cleaned_data.get('category'),
+                    update_existing=form.cleaned_data['update_existing'],
+                    delete_missing=form.cleaned_data['delete_missing'],
+                    user=request.user,
+                )
+            except ImportJobConflict as e:
                 if is_ajax:
-                    return JsonResponse(error_result)
-                else:
-                    messages.error(
-                        request, f'Ошибка при обработке импорта: {str(e)}')
-                    return redirect('admin:catalog_product_changelist')
+                    return JsonResponse({'success': False, 'message': str(e)}, status=409)
+                messages.error(request, str(e))
+                return redirect('catalog:import_products')
+
+            if is_ajax:
+                return JsonResponse({'success': True, **job_state(job)}, status=202)
+            messages.info(request, f'Импорт #{job.pk} поставлен в очередь')
+            return redirect('admin:catalog_importjob_change', job.pk)
     else:
         form = ImportForm()
 
@@ -109,6 +55,19 @@ def import_products(request):
     })
 
 
+@staff_member_required
+def import_job_status(request, pk):
+    """
+    Состояние задания импорта.
+
+    Страница импорта опрашивает его каждые 2 с, а пока состояние не
+    меняется - все реже, до 15 с. Каждый запрос короткий; SSE держал бы
+    sync-воркер gunicorn на время всего импорта.
+    """
+    job = get_object_or_404(ImportJob, pk=pk)
+    return JsonResponse(job_state(job))
+
+
 @staff_member_required
 def import_preview(request):
     """Предпросмотр данных перед импортом"""
@@ -0,0 +1,169 @@
+import heapq
+from array import array
+from bisect import bisect_left
+
+from django.core.files.storage import default_storage
+from django.db.models import OuterRef, Subquery
+from django.urls import reverse
+
+from .models import Product, ProductImage
+from .text import normalize_search_text
+from .version import VersionedCopy
+
+SUGGESTIONS_LIMIT = 10
+
+# Запросы из одного слова не длиннее стольких символов обслуживает индекс,
+# остальные - полнотекстовый поиск с ранжированием (search.search_products)
+SHORT_QUERY_LENGTH = 4
+
+# Как часто (в секундах) воркер сверяет версию каталога с общим кэшем
+VERSION_CHECK_INTERVAL = 5
+
+
+def tokenize(text):
+    """Слова текста в нормализованной (латинской) записи, см. normalize_search_text"""
+    return normalize_search_text(text).split()
+
+
+class AutocompleteIndex:
+    """
+    Компактный индекс автодополнения в памяти процесса.
+
+    Строится в мастере gunicorn до запуска воркеров и достается им через
+    fork (см. gunicorn.conf.py). entries - кортежи (id, название, slug,
+    артикул), упорядоченные по популярности: остальное (категория,
+    описание, изображение) читается из БД только для отданных подсказок;
+    tokens/postings - параллельные отсортированные массивы
+    "слово -> номер товара", поиск по префиксу выполняется через bisect.
+    В младшем бите posting хранится признак "слово не из названия":
+    совпадения по названию выводятся раньше совпадений по категории.
+    """
+    __slots__ = ('version', 'entries', 'tokens', 'postings')
+
+    def __init__(self, version, entries, pairs):
+        pairs.sort()
+        self.version = version
+        self.entries = entries
+        self.tokens = [token for token, _ in pairs]
+        self.postings = array('I', (position for _, position in pairs))
+
+    @classmethod
+    def build(cls, version):
+        rows = (
+            Product.objects.active()
+            .order_by('-views_count', '-id')
+            .values_list('id', 'title', 'slug', 'article', 'category__name')
+        )
+
+        entries = []
+        pairs = []
+        for position, (pk, title, slug, article, category_name) in enumerate(
+                rows.iterator(chunk_size=2000)):
+            entries.append((pk, title, slug, article))
+
+            title_words = set(tokenize(title))
+            other_words = set(tokenize(category_name))
+            if article:
+                other_words.update(tokenize(article))
+                # Артикул целиком без разделителей: "SM58-LCE" -> "sm58lce"
+                other_words.add(''.join(tokenize(article)))
+            pairs.extend((word, position << 1) for word in title_words)
+            pairs.extend((word, position << 1 | 1)
+                         for word in other_words - title_words)
+
+        return cls(version, entries, pairs)
+
+    def _prefix_matches(self, prefix):
+        """Номер товара -> 0, если префикс найден в названии, иначе 1"""
+        matches = {}
+        start = bisect_left(self.tokens, prefix)
+        for i in range(start, len(self.tokens)):
+            if not self.tokens[i].startswith(prefix):
+                break
+            posting = self.postings[i]
+            position, other = posting >> 1, posting & 1
+            matches[position] = min(other, matches.get(position, 1))
+        return matches
+
+    def suggest(self, query, limit=SUGGESTIONS_LIMIT):
+        """Товары, у которых каждое слово запроса является началом слова"""
+        words = tokenize(query)
+        if not words:
+            return []
+
+        scores = None
+        for word in sorted(words, key=len, reverse=True):
+            matches = self._prefix_matches(word)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {position: scores[position] + other
+                          for position, other in matches.items()
+                          if position in scores}
+            if not scores:
+                return []
+
+        # Номер в entries совпадает с местом в рейтинге популярности
+        ranked = heapq.nsmallest(
+            limit, scores, key=lambda position: (scores[position], position))
+        return [self.entries[position] for position in ranked]
+
+
+_index = VersionedCopy(AutocompleteIndex.build, 'Autocomplete index',
+                      VERSION_CHECK_INTERVAL)
+
+
+def get_index(wait=False):
+    """
+    Индекс текущего процесса или None, пока его нет. После изменения
+    каталога перестраивается в фоне, до этого отвечает прежний.
+    """
+    return _index.get(wait=wait)
+
+
+def is_short_query(query):
+    """
+    Начало одного слова: ему соответствует слишком много товаров, чтобы
+    ранжировать их полнотекстовым поиском, и подсказки берутся из индекса
+    """
+    words = tokenize(query)
+    return len(words) == 1 and len(words[0]) <= SHORT_QUERY_LENGTH
+
+
+def suggest(query, limit=SUGGESTIONS_LIMIT):
+    """Подсказки по популярности; пустой список, пока индекс не построен"""
+    index = get_index()
+    if index is None:
+        return []
+    entries = index.suggest(query, limit)
+    if not entries:
+        return []
+
+    # Остальные поля подсказок - одним запросом по первичному ключу
+    first_image = ProductImage.objects.filter(
+        product=OuterRef('pk')).order_by('order').values('image')[:1]
+    products = (
+        Product.objects.active()
+        .filter(pk__in=[entry[0] for entry in entries])
+        .annotate(first_image=Subquery(first_image))
+        .values_list('id', 'category__name', 'description', 'preview_image', 'first_image')
+    )
+    details = {row[0]: row[1:] for row in products}
+
+    suggestions = []
+    for pk, title, slug, article in entries:
+        if pk not in details:
+            # Товар скрыт или удален после построения индекса
+            continue
+        category_name, description, preview_image, first_image = details[pk]
+        image = preview_image or first_image
+        suggestions.append({
+            'id': pk,
+            'title': title,
+            'url': reverse('catalog:product', kwargs={'slug': slug}),
+            'category': category_name,
+            'article': article,
+            'description': description[:100] + '...' if len(description) > 100 else description,
+            'image': default_storage.url(image) if image else None,
+        })
+    return suggestions
@@ -0,0 +1,92 @@
+# Валидаторы для условных GET-запросов (ETag / Last-Modified). Считаются
+# без рендеринга страницы: по версии каталога (меняется при любом изменении
+# товаров, категорий и изображений) и updated_at самого объекта из снимка
+# каталога, если он актуален (иначе и для неактивных товаров - одним
+# запросом по индексу slug).
+import datetime
+import hashlib
+
+from .models import Category, Product
+from .snapshot import get_snapshot
+from .version import get_catalog_version
+
+# Как часто воркер сверяет версию каталога с общим кэшем
+VERSION_CHECK_INTERVAL = 1
+
+
+def _version():
+    return get_catalog_version(max_age=VERSION_CHECK_INTERVAL)
+
+
+def _version_datetime(version):
+    return datetime.datetime.fromtimestamp(version / 1000, tz=datetime.timezone.utc)
+
+
+def _object_state(request, model, slug):
+    """(id, updated_at) объекта; запоминается в request для обоих валидаторов"""
+    attr = f'_{model._meta.model_name}_state'
+    if not hasattr(request, attr):
+        # Снимок используется, только если он уже построен и актуален:
+        # ради ETag его не строят и не ждут
+        snapshot = get_snapshot(wait=False)
+        obj = None
+        if snapshot is not None and snapshot.version == _version():
+            if model is Category:
+                obj = snapshot.category_by_slug(slug)
+            else:
+                obj = snapshot.product_by_slug(slug)
+        if obj is not None:
+            state = (obj.id, obj.updated_at)
+        else:
+            # В снимке только товары первых страниц; остальные - одним
+            # запросом по индексу slug
+            state = model.objects.filter(slug=slug).values_list(
+                'id', 'updated_at').first()
+        setattr(request, attr, state)
+    return getattr(request, attr)
+
+
+def product_etag(request, slug):
+    state = _object_state(request, Product, slug)
+    if state is None:
+        return None
+    product_id, updated_at = state
+    # По id просмотр учитывается и при ответе 304
+    request.validated_product_id = product_id
+    return f'p{product_id}-{updated_at.timestamp()}-{_version()}'
+
+
+def product_last_modified(request, slug):
+    state = _object_state(request, Product, slug)
+    if state is None:
+        return None
+    return max(state[1], _version_datetime(_version()))
+
+
+def category_etag(request, slug):
+    state = _object_state(request, Category, slug)
+    if state is None:
+        return None
+    category_id, updated_at = state
+    return f'c{category_id}-{updated_at.timestamp()}-{_version()}'
+
+
+def category_last_modified(request, slug):
+    state = _object_state(request, Category, slug)
+    if state is None:
+        return None
+    return max(state[1], _version_datetime(_version()))
+
+
+def catalog_etag(request, *args, **kwargs):
+    return f'catalog-{_version()}'
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return _version_datetime(_version())
+
+
+def search_etag(request):
+    query = ' '.join(request.GET.get('q', '').lower().split())
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return f's{digest}-{_version()}'
@@ -0,0 +1,93 @@
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest
+
+from .models import Category, Product, tree_path_ids
+
+
+def _aggregate_product_counters(queryset):
+    """Считает счетчики товаров по категориям одним запросом"""
+    rows = queryset.values('category_id').annotate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        in_stock=Count('id', filter=Q(
+            is_active=True, availability='in_stock')),
+        order=Count('id', filter=Q(is_active=True, availability='order')),
+    )
+    return {row['category_id']: row for row in rows}
+
+
+def _save_own_counters(category_id, row):
+    Category.objects.filter(pk=category_id).update(
+        products_count=row.get('total', 0),
+        active_products_count=row.get('active', 0),
+        in_stock_products_count=row.get('in_stock', 0),
+        order_products_count=row.get('order', 0),
+    )
+
+
+def update_category_counters(category_ids=(), tree_deltas=None):
+    """
+    Пересчитывает собственные счетчики указанных категорий и сдвигает
+    счетчики дерева на tree_deltas ({id категории: +-N}).
+
+    Используется сигналами товаров: затрагиваются только категории,
+    в которых реально изменились товары, и предки на их путях.
+    """
+    category_ids = {pk for pk in category_ids if pk}
+    if category_ids:
+        stats = _aggregate_product_counters(
+            Product.objects.filter(category_id__in=category_ids))
+        for category_id in category_ids:
+            _save_own_counters(category_id, stats.get(category_id, {}))
+
+    if tree_deltas:
+        shift_tree_counters(tree_deltas)
+
+
+def tree_move_deltas(old_path, new_path):
+    """
+    Сдвиги счетчиков дерева, когда активный товар переходит со старого
+    tree_path на новый ('' - товар вне счетчиков: новый, удаленный или
+    неактивный). Общие предки путей не меняются.
+    """
+    deltas = Counter(tree_path_ids(new_path))
+    deltas.subtract(tree_path_ids(old_path))
+    return deltas
+
+
+def shift_tree_counters(deltas):
+    """Сдвигает tree_products_count на F() +- N, по UPDATE на каждый размер сдвига"""
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        # Разошедшийся с товарами счетчик не уходит в минус (его
+        # выправит recalculate_category_counters)
+        Category.objects.filter(pk__in=pks).update(
+            tree_products_count=Greatest(F('tree_products_count') + delta, 0))
+
+
+def rebuild_tree_counters():
+    """
+    Полный пересчет количества активных товаров с учетом подкатегорий.
+
+    Считается то же множество, что выводит листинг категории
+    (ProductQuerySet.tree_counts). Один агрегирующий запрос по всем
+    товарам, обновляются только изменившиеся категории.
+    """
+    totals = Product.objects.tree_counts()
+    for pk, tree in Category.objects.values_list('id', 'tree_products_count'):
+        total = totals.get(pk, 0)
+        if total != tree:
+            Category.objects.filter(pk=pk).update(tree_products_count=total)
+
+
+def rebuild_all_counters():
+    """Полный пересчет всех счетчиков (management-команда, миграции)"""
+    stats = _aggregate_product_counters(Product.objects.all())
+    for category_id in Category.objects.values_list('id', flat=True):
+        _save_own_counters(category_id, stats.get(category_id, {}))
+    rebuild_tree_counters()
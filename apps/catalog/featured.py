@@ -0,0 +1,70 @@
+import random
+
+from django.db.models import F, Func, IntegerField, Value, Window
+from django.db.models.functions import Cast, RowNumber
+
+from apps.core.cache import get_or_compute
+from .models import Product
+from .version import get_catalog_version
+
+# Сколько товаров в пуле каждого корневого раздела и сколько из них показывать
+POOL_SIZE = 24
+FEATURED_COUNT = 4
+
+# Пул пересобирается по истечении срока или при изменении каталога
+POOL_TIMEOUT = 15 * 60
+
+
+def _build_pools():
+    """
+    Пулы "корневой раздел -> id товаров" одним запросом: товары всех
+    разделов нумеруются оконной функцией внутри раздела (по популярности
+    за неделю и за все время), в пул попадают первые POOL_SIZE.
+    """
+    # Корень - первый сегмент пути категории: '/1/5/12/' -> 1
+    root = Cast(
+        Func(F('category__path'), Value('/'), Value(2), function='split_part'),
+        output_field=IntegerField(),
+    )
+    ranked = (
+        Product.objects.active()
+        .annotate(
+            root_id=root,
+            position=Window(
+                RowNumber(),
+                partition_by=[root],
+                order_by=[F('weekly_views').desc(), F('views_count').desc(),
+                          F('id').desc()],
+            ),
+        )
+        .filter(position__lte=POOL_SIZE)
+        .values_list('root_id', 'id')
+    )
+    pools = {}
+    for root_id, product_id in ranked:
+        pools.setdefault(root_id, []).append(product_id)
+    return pools
+
+
+def get_featured_pools():
+    return get_or_compute(
+        f'catalog:featured:{get_catalog_version()}', _build_pools, POOL_TIMEOUT)
+
+
+def attach_featured_products(categories, count=FEATURED_COUNT):
+    """
+    Заполняет category.featured_products случайной выборкой из пула
+    раздела. Все выбранные товары загружаются одним запросом.
+    """
+    pools = get_featured_pools()
+    picked = {}
+    for category in categories:
+        pool = pools.get(category.id, [])
+        picked[category.id] = random.sample(pool, min(count, len(pool)))
+
+    product_ids = [pk for ids in picked.values() for pk in ids]
+    products = Product.objects.in_bulk(product_ids) if product_ids else {}
+    for category in categories:
+        category.featured_products = [
+            products[pk] for pk in picked[category.id] if pk in products]
+    return categories
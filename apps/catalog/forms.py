@@ -1,5 +1,6 @@
 from django import forms
 from .models import Product, Category
+from .widgets import HierarchicalCategorySelect
 
 
 class ImportForm(forms.Form):
@@ -13,12 +14,12 @@ class ImportForm(forms.Form):
     )
 
     category = forms.ModelChoiceField(
-        queryset=Category.objects.filter(is_active=True).order_by('name'),
+        queryset=Category.objects.filter(is_active=True).order_by('path'),
         label='Категория для всех товаров',
         required=False,
         empty_label='-- Использовать категорию из файла --',
         help_text='Выберите категорию, в которую будут добавлены все товары. Если не выбрано, будет использована категория из файла.',
-        widget=forms.Select(attrs={
+        widget=HierarchicalCategorySelect(attrs={
             'style': 'width: 100%;'  # Убрали form-control, оставили только width
         })
     )
@@ -0,0 +1,82 @@
+import hashlib
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+# Фрагменты не зависят от версии каталога и не сбрасываются сигналами:
+# ключ меняется вместе с объектом. Все, что выводят карточка и плитка,
+# хранится в полях самого товара (категории), и их сохранение обновляет
+# updated_at; дополнительные изображения (ProductImage) в карточку не
+# попадают. Счетчики категории пишутся через update() без updated_at,
+# поэтому tree_products_count входит в ключ плитки
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+PRODUCT_TAG = 'product'
+CATEGORY_TAG = 'category'
+
+# Счетчик просмотров меняется на каждый сброс просмотров (tracking.py):
+# в кэшированной карточке вместо него заглушка, число подставляется при выдаче
+VIEWS_PLACEHOLDER = '__views_count_placeholder__'
+
+
+@lru_cache(maxsize=None)
+def _template_digest(template_name):
+    """Хэш исходника шаблона: после правки шаблона старые фрагменты не используются"""
+    source = get_template(template_name).template.source
+    return hashlib.md5(source.encode()).hexdigest()[:8]
+
+
+def render_fragments(objects, template_name, context_name, tag, key_func,
+                     context=None):
+    """
+    HTML-фрагменты для списка объектов: все готовые фрагменты читаются
+    одним get_many, рендерятся и сохраняются (set_many) только недостающие.
+    context - общие для всех фрагментов переменные шаблона.
+    """
+    objects = list(objects)
+    if not objects:
+        return []
+
+    prefix = f'fragment:{tag}:{_template_digest(template_name)}'
+    keys = [f'{prefix}:{key_func(obj)}' for obj in objects]
+    cached = cache.get_many(keys)
+
+    fragments = []
+    missing = {}
+    for obj, key in zip(objects, keys):
+        fragment = cached.get(key)
+        if fragment is None:
+            fragment = render_to_string(template_name, {**(context or {}), context_name: obj})
+            missing[key] = fragment
+        fragments.append(fragment)
+
+    if missing:
+        cache.set_many(missing, FRAGMENT_TIMEOUT)
+    return fragments
+
+
+def _product_key(product):
+    return f'{product.pk}:{product.updated_at.timestamp()}'
+
+
+def _category_key(category):
+    # Счетчики обновляются через update() и не меняют updated_at
+    return f'{category.pk}:{category.updated_at.timestamp()}:{category.tree_products_count}'
+
+
+def render_product_cards(products):
+    products = list(products)
+    fragments = render_fragments(
+        products, 'catalog/includes/product_card.html', 'product',
+        PRODUCT_TAG, _product_key, {'views_count': VIEWS_PLACEHOLDER})
+    return mark_safe(''.join(
+        fragment.replace(VIEWS_PLACEHOLDER, str(product.views_count))
+        for product, fragment in zip(products, fragments)))
+
+
+def render_category_tiles(categories):
+    return mark_safe(''.join(render_fragments(
+        categories, 'catalog/includes/category_tile.html', 'category',
+        CATEGORY_TAG, _category_key)))
@@ -0,0 +1,235 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import ImportJob
+from .utils import ImportProcessor
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в секундах) обработчик записывает прогресс задания
+PROGRESS_INTERVAL = 1
+# Как часто отдельный поток отмечает задание живым. Прогресс пишется
+# только по строкам, а загрузка изображений или пересчет похожих товаров
+# могут идти дольше IMPORT_JOB_STALE_AFTER
+HEARTBEAT_INTERVAL = 30
+
+
+class ImportJobConflict(Exception):
+    """В категорию уже выполняется или ожидает импорт"""
+
+
+def enqueue_import(file, category=None, update_existing=False,
+                   delete_missing=False, user=None):
+    """
+    Ставит импорт в очередь и сразу возвращает задание; сам импорт
+    выполняет команда run_import_worker.
+    """
+    active = ImportJob.objects.filter(
+        category=category, status__in=ImportJob.ACTIVE_STATUSES)
+    if active.exists():
+        raise ImportJobConflict("Импорт в эту категорию уже выполняется")
+
+    job = ImportJob(category=category, update_existing=update_existing,
+                    delete_missing=delete_missing, created_by=user)
+    try:
+        with transaction.atomic():
+            job.file.save(file.name, file, save=False)
+            job.save()
+    except IntegrityError:
+        # Параллельный запрос успел поставить импорт раньше
+        job.file.delete(save=False)
+        raise ImportJobConflict("Импорт в эту категорию уже выполняется")
+    return job
+
+
+def claim_next_job():
+    """
+    Забирает самое старое задание из очереди.
+
+    SELECT ... FOR UPDATE SKIP LOCKED: несколько обработчиков не получат
+    одно и то же задание и не ждут друг друга.
+    """
+    with transaction.atomic():
+        job = (ImportJob.objects.select_for_update(skip_locked=True)
+               .filter(status=ImportJob.STATUS_PENDING)
+               .order_by('created_at').first())
+        if job is None:
+            return None
+        job.status = ImportJob.STATUS_RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at', 'updated_at'])
+    return job
+
+
+def cancel_job(job_id):
+    """
+    Отменяет задание; True, если отмена принята.
+
+    Задание в очереди отменяется сразу, у выполняющегося выставляется
+    cancel_requested - обработчик прервет импорт при записи прогресса.
+    """
+    with transaction.atomic():
+        # Задание, которое прямо сейчас забирает обработчик, пропускается
+        job = (ImportJob.objects.select_for_update(skip_locked=True)
+               .filter(pk=job_id, status=ImportJob.STATUS_PENDING).first())
+        if job is not None:
+            job.status = ImportJob.STATUS_CANCELLED
+            job.finished_at = timezone.now()
+            job.file.delete(save=False)
+            job.save()
+            return True
+    return bool(ImportJob.objects.filter(
+        pk=job_id, status=ImportJob.STATUS_RUNNING,
+    ).update(cancel_requested=True))
+
+
+def fail_stale_jobs():
+    """
+    Завершает задания, брошенные остановленным обработчиком: они
+    давно не обновлялись и иначе навсегда заняли бы категорию.
+    Возвращает число завершенных заданий.
+    """
+    stale_after = getattr(settings, 'IMPORT_JOB_STALE_AFTER', 600)
+    stale = ImportJob.objects.filter(
+        status=ImportJob.STATUS_RUNNING,
+        updated_at__lt=timezone.now() - timedelta(seconds=stale_after),
+    )
+    failed = 0
+    for job_id in stale.values_list('pk', flat=True):
+        with transaction.atomic():
+            # Условие проверяется повторно под блокировкой: задание могло
+            # ожить, пока шел перебор
+            job = stale.select_for_update(skip_locked=True).filter(pk=job_id).first()
+            if job is None:
+                continue
+            job.status = ImportJob.STATUS_FAILED
+            job.finished_at = timezone.now()
+            job.result = {'success': False,
+                          'message': 'Обработчик импорта остановился во время работы',
+                          'errors': [], 'warnings': [],
+                          'imported': 0, 'updated': 0, 'skipped': 0}
+            job.file.delete(save=False)
+            job.save(update_fields=['status', 'finished_at', 'result', 'file',
+                                    'updated_at'])
+            failed += 1
+    return failed
+
+
+def _heartbeat(job_id, stop):
+    """Обновляет updated_at выполняющегося задания, пока не выставлен stop"""
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                ImportJob.objects.filter(
+                    pk=job_id, status=ImportJob.STATUS_RUNNING,
+                ).update(updated_at=timezone.now())
+            except DatabaseError:
+                logger.warning("Failed to record heartbeat of import job %s",
+                               job_id, exc_info=True)
+    finally:
+        connection.close()
+
+
+def run_job(job):
+    """Выполняет задание и сохраняет его итог"""
+    processor = ImportProcessor(job.file, job.category_id,
+                                job.update_existing, job.delete_missing)
+    last_progress = 0
+    last_stage = None
+    cancelled = False
+
+    def progress_callback(processed, total, stage):
+        nonlocal last_progress, last_stage, cancelled
+        # Смена этапа записывается сразу, счетчики - не чаще PROGRESS_INTERVAL
+        if (stage == last_stage
+                and time.monotonic() - last_progress < PROGRESS_INTERVAL):
+            return cancelled
+        last_progress = time.monotonic()
+        last_stage = stage
+        # Запись не проходит, если запрошена отмена: так и прогресс,
+        # и проверка отмены обходятся одним запросом
+        updated = ImportJob.objects.filter(pk=job.pk, cancel_requested=False).update(
+            processed_rows=processed, total_rows=total, stage=stage,
+            updated_at=timezone.now())
+        cancelled = not updated
+        return cancelled
+
+    processor.set_progress_callback(progress_callback)
+
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job.pk, stop_heartbeat),
+                                 daemon=True)
+    heartbeat.start()
+    try:
+        _process(job, processor)
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+
+    job.processed_rows = processor.processed_rows
+    job.total_rows = processor.total_rows
+    job.stage = processor.stage
+    job.finished_at = timezone.now()
+    # Загруженный файл больше не нужен, импорты бывают большими
+    job.file.delete(save=False)
+    # cancel_requested не перезаписывается: его мог выставить админ
+    job.save(update_fields=['status', 'result', 'processed_rows', 'total_rows',
+                            'stage', 'finished_at', 'file', 'updated_at'])
+    return job
+
+
+def _process(job, processor):
+    """Импортирует файл задания и записывает в job статус и итог"""
+    try:
+        with job.file.open('rb'):
+            success = processor.process_file()
+        job.result = {
+            'success': success,
+            'message': processor.get_result_message(),
+            'imported': processor.imported_count,
+            'updated': processor.updated_count,
+            'skipped': processor.skipped_count,
+            'rows_per_second': processor.rows_per_second,
+            'errors': processor.errors,
+            'warnings': processor.warnings,
+        }
+        if processor.cancelled:
+            job.status = ImportJob.STATUS_CANCELLED
+        elif success:
+            job.status = ImportJob.STATUS_DONE
+        else:
+            job.status = ImportJob.STATUS_FAILED
+    except Exception as e:
+        logger.exception("Import job %s failed", job.pk)
+        job.result = {
+            'success': False,
+            'message': f'Ошибка при обработке импорта: {str(e)}',
+            'errors': [str(e)],
+            'imported': processor.imported_count,
+            'updated': processor.updated_count,
+            'skipped': processor.skipped_count,
+            'warnings': processor.warnings,
+        }
+        job.status = ImportJob.STATUS_FAILED
+
+
+def job_state(job):
+    """Состояние задания для страницы импорта"""
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'stage': job.stage,
+        'stage_display': job.get_stage_display(),
+        'cancel_requested': job.cancel_requested,
+        'finished': job.status in ImportJob.FINISHED_STATUSES,
+        'processed': job.processed_rows,
+        'total': job.total_rows,
+        'percentage': job.percentage,
+        'result': job.result,
+    }
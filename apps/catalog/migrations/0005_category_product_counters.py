@@ -0,0 +1,78 @@
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_counters(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+    Product = apps.get_model('catalog', 'Product')
+
+    stats = {
+        row['category_id']: row
+        for row in Product.objects.values('category_id').annotate(
+            total=Count('id'),
+            active=Count('id', filter=Q(is_active=True)),
+            in_stock=Count('id', filter=Q(
+                is_active=True, availability='in_stock')),
+            order=Count('id', filter=Q(
+                is_active=True, availability='order')),
+        )
+    }
+
+    categories = list(Category.objects.all())
+    children = {}
+    for category in categories:
+        row = stats.get(category.id, {})
+        category.products_count = row.get('total', 0)
+        category.active_products_count = row.get('active', 0)
+        category.in_stock_products_count = row.get('in_stock', 0)
+        category.order_products_count = row.get('order', 0)
+        children.setdefault(category.parent_id, []).append(category)
+
+    def subtree_total(category):
+        category.tree_products_count = category.active_products_count + sum(
+            subtree_total(child) for child in children.get(category.id, []))
+        return category.tree_products_count
+
+    for category in children.get(None, []):
+        subtree_total(category)
+
+    Category.objects.bulk_update(categories, [
+        'products_count', 'active_products_count', 'in_stock_products_count',
+        'order_products_count', 'tree_products_count',
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_category_image_alt_product_preview_image_alt'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Всего товаров'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='active_products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных товаров'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='in_stock_products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров в наличии'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='order_products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров под заказ'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='tree_products_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных товаров с подкатегориями'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Category = apps.get_model('catalog', 'Category')
+
+    categories = list(Category.objects.all())
+    children = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    def walk(parent_id, parent_path, depth):
+        for category in children.get(parent_id, []):
+            category.path = f"{parent_path}{category.id}/"
+            category.depth = depth
+            walk(category.id, category.path, depth + 1)
+
+    walk(None, '/', 0)
+    Category.objects.bulk_update(categories, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_category_product_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Уровень вложенности'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='catalog_category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,72 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Вектор товара пересчитывается триггером при изменении текстовых полей,
+# а переименование категории "касается" ее товаров, чтобы обновить вектор.
+CREATE_TRIGGERS = """
+CREATE OR REPLACE FUNCTION catalog_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.article, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(
+            (SELECT name FROM catalog_category WHERE id = NEW.category_id), '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'D');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER catalog_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, article, description, category_id
+    ON catalog_product
+    FOR EACH ROW EXECUTE FUNCTION catalog_product_search_vector_update();
+
+CREATE OR REPLACE FUNCTION catalog_category_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    IF NEW.name IS DISTINCT FROM OLD.name THEN
+        UPDATE catalog_product SET title = title WHERE category_id = NEW.id;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER catalog_category_search_vector_trigger
+    AFTER UPDATE OF name ON catalog_category
+    FOR EACH ROW EXECUTE FUNCTION catalog_category_search_vector_update();
+
+UPDATE catalog_product SET title = title;
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS catalog_category_search_vector_trigger ON catalog_category;
+DROP FUNCTION IF EXISTS catalog_category_search_vector_update();
+DROP TRIGGER IF EXISTS catalog_product_search_vector_trigger ON catalog_product;
+DROP FUNCTION IF EXISTS catalog_product_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_product_listing_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='catalog_prod_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['article'], name='catalog_prod_article_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,60 @@
+import re
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+# Копия text.build_search_key на момент миграции: дальнейшие правки
+# text.py не должны менять то, что делает уже примененная миграция
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+})
+
+
+def _normalize(text):
+    text = str(text).lower().translate(_TRANSLIT)
+    return ' '.join(re.findall(r'[^\W_]+', text))
+
+
+def build_search_key(title, article='', category_name=''):
+    parts = [_normalize(title)]
+    if article:
+        normalized_article = _normalize(article)
+        parts.append(normalized_article)
+        parts.append(normalized_article.replace(' ', ''))
+    if category_name:
+        parts.append(_normalize(category_name))
+    return f" {' '.join(part for part in parts if part)} "
+
+
+def fill_search_keys(apps, schema_editor):
+    Product = apps.get_model('catalog', 'Product')
+    products = list(Product.objects.select_related('category').only(
+        'id', 'title', 'article', 'category__name'))
+    for product in products:
+        product.search_key = build_search_key(
+            product.title, product.article, product.category.name)
+    Product.objects.bulk_update(products, ['search_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_key',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Поисковый ключ'),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_key'], name='catalog_prod_key_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
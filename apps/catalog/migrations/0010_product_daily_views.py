@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_product_search_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailyViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотры')),
+            ],
+            options={
+                'verbose_name': 'Просмотры товара за день',
+                'verbose_name_plural': 'Просмотры товаров по дням',
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Рейтинг роста популярности'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='weekly_views',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Просмотров за неделю'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'is_active', '-trending_score', '-id'], name='catalog_prod_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', '-weekly_views', '-id'], name='catalog_prod_weekly_idx'),
+        ),
+        migrations.AddField(
+            model_name='productdailyviews',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='catalog.product', verbose_name='Товар'),
+        ),
+        migrations.AddIndex(
+            model_name='productdailyviews',
+            index=models.Index(fields=['date'], name='catalog_daily_views_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productdailyviews',
+            constraint=models.UniqueConstraint(fields=('product', 'date'), name='catalog_daily_views_unique'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_product_daily_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Степень сходства')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='catalog.product', verbose_name='Товар')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.product', verbose_name='Похожий товар')),
+            ],
+            options={
+                'verbose_name': 'Похожий товар',
+                'verbose_name_plural': 'Похожие товары',
+                'indexes': [models.Index(fields=['product', '-score'], name='catalog_similar_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'similar'), name='catalog_similar_unique')],
+            },
+        ),
+    ]
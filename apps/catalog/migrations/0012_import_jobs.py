@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_similar_products'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/', verbose_name='Файл')),
+                ('update_existing', models.BooleanField(default=False, verbose_name='Обновлять существующие')),
+                ('delete_missing', models.BooleanField(default=False, verbose_name='Удалять отсутствующие')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('failed', 'Ошибка'), ('cancelled', 'Отменен')], default='pending', max_length=20, verbose_name='Статус')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='Обработано строк')),
+                ('total_rows', models.PositiveIntegerField(default=0, verbose_name='Всего строк')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='Результат')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='catalog.category', verbose_name='Категория')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Запустил')),
+            ],
+            options={
+                'verbose_name': 'Импорт товаров',
+                'verbose_name_plural': 'Импорты товаров',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='catalog_import_queue_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('category',), name='catalog_import_one_active_per_category', nulls_distinct=False)],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_import_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='cancel_requested',
+            field=models.BooleanField(default=False, verbose_name='Запрошена отмена'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='stage',
+            field=models.CharField(blank=True, choices=[('reading', 'Чтение файла'), ('rows', 'Обработка товаров'), ('cleanup', 'Удаление отсутствующих товаров'), ('similar', 'Пересчет похожих товаров')], max_length=20, verbose_name='Этап'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+import apps.catalog.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_import_job_progress'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='file',
+            field=models.FileField(storage=apps.catalog.models.import_upload_storage, upload_to='imports/', verbose_name='Файл'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Подкатегория учитывается, если лежит внутри категории товара
+# (models.product_tree_path). Проверки внешнего ключа выполняются сразу:
+# с отложенными PostgreSQL не даст создать индексы в той же транзакции
+FILL_TREE_PATHS = """
+SET CONSTRAINTS ALL IMMEDIATE;
+UPDATE catalog_product p SET tree_path = COALESCE(
+    (SELECT s.path FROM catalog_category s, catalog_category c
+      WHERE s.id = p.subcategory_id AND c.id = p.category_id
+        AND starts_with(s.path, c.path)),
+    (SELECT c.path FROM catalog_category c WHERE c.id = p.category_id),
+    '');
+UPDATE catalog_product SET tree_root_id = split_part(tree_path, '/', 2)::integer
+ WHERE tree_path <> '';
+SET CONSTRAINTS ALL DEFERRED;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_import_job_private_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='tree_path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Путь в дереве'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='tree_root',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='catalog.category', verbose_name='Корневая категория'),
+        ),
+        migrations.RunSQL(FILL_TREE_PATHS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['tree_root', 'is_active', '-created_at', '-id'], name='catalog_prod_tree_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['tree_root', 'is_active', 'title', 'id'], name='catalog_prod_tree_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['tree_root', 'is_active', '-views_count', '-id'], name='catalog_prod_tree_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['tree_root', 'is_active', 'availability', '-created_at', '-id'], name='catalog_prod_tree_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['tree_root', 'is_active', '-trending_score', '-id'], name='catalog_prod_tree_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['tree_path'], name='catalog_prod_tree_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='catalog_prod_newest_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='catalog_prod_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='catalog_prod_popular_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='catalog_prod_in_stock_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='catalog_prod_trending_idx',
+        ),
+    ]
@@ -0,0 +1,30 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def rebuild_tree_counters(apps, schema_editor):
+    """Счетчики поддерева по tree_path (как counters.rebuild_tree_counters)"""
+    Category = apps.get_model('catalog', 'Category')
+    Product = apps.get_model('catalog', 'Product')
+    totals = defaultdict(int)
+    rows = (Product.objects.filter(is_active=True).order_by().values('tree_path')
+            .annotate(count=Count('id')).values_list('tree_path', 'count'))
+    for tree_path, count in rows:
+        for pk in tree_path.split('/'):
+            if pk:
+                totals[int(pk)] += count
+    for pk in Category.objects.values_list('id', flat=True):
+        Category.objects.filter(pk=pk).update(tree_products_count=totals.get(pk, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0015_product_tree_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_tree_counters, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,25 @@
+from collections import Counter
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
 from django.db import models
+from django.db.models import Case, Count, F, Func, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Concat, Substr
+from django.db.models.lookups import StartsWith
 from django.urls import reverse
 from django.utils.text import slugify
 
+from .text import build_search_key
+
+# Счетчики категории: их пишут только counters.py и сигналы
+CATEGORY_COUNTER_FIELDS = {
+    'products_count', 'active_products_count', 'in_stock_products_count',
+    'order_products_count', 'tree_products_count',
+}
+
 
 class Category(models.Model):
     """Модель категории товаров"""
@@ -32,6 +50,27 @@ class Category(models.Model):
     order = models.PositiveIntegerField(
         default=0, verbose_name="Порядок сортировки")
     is_active = models.BooleanField(default=True, verbose_name="Активна")
+
+    # Материализованный путь "/<id корня>/.../<id>/", поддерживается в save()
+    path = models.CharField(
+        max_length=255, blank=True, default='', editable=False,
+        verbose_name="Путь в дереве")
+    depth = models.PositiveSmallIntegerField(
+        default=0, editable=False, verbose_name="Уровень вложенности")
+
+    # Денормализованные счетчики товаров, поддерживаются сигналами (signals.py)
+    products_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Всего товаров")
+    active_products_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Активных товаров")
+    in_stock_products_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Товаров в наличии")
+    order_products_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Товаров под заказ")
+    tree_products_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name="Активных товаров с подкатегориями")
+
     created_at = models.DateTimeField(
         auto_now_add=True, verbose_name="Создано")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
@@ -40,6 +79,10 @@ class Category(models.Model):
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
         ordering = ['order', 'name']
+        indexes = [
+            models.Index(fields=['path'], name='catalog_category_path_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return self.name
@@ -47,18 +90,89 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('catalog:category', kwargs={'slug': self.slug})
 
+    def clean(self):
+        super().clean()
+        if self.path and self.parent_id and self.parent.path.startswith(self.path):
+            raise ValidationError({
+                'parent': 'Категорию нельзя вложить в саму себя или в ее подкатегорию'
+            })
+
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'parent' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'path', 'depth'}
+        elif update_fields is None and not self._state.adding:
+            # Значения счетчиков в экземпляре могли устареть, пока он был
+            # загружен: сохранение категории их не перезаписывает
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in CATEGORY_COUNTER_FIELDS]
+
+        if self.pk:
+            self._set_path()
+            if old_path and old_path != self.path:
+                # До сохранения: post_save (пересчет счетчиков дерева)
+                # должен видеть уже перенесенные пути категорий и товаров
+                self._move_subtree(old_path)
+        super().save(*args, **kwargs)
+
+        if not self.path.endswith(f"/{self.pk}/"):
+            # Новая категория: путь содержит собственный id
+            self._set_path()
+            Category.objects.filter(pk=self.pk).update(
+                path=self.path, depth=self.depth)
+
+    def _set_path(self):
+        if self.parent_id:
+            self.path = f"{self.parent.path}{self.pk}/"
+            self.depth = self.parent.depth + 1
+        else:
+            self.path = f"/{self.pk}/"
+            self.depth = 0
+
+    def _move_subtree(self, old_path):
+        """Переносит все поддерево (с самой категорией) одним UPDATE после смены родителя"""
+        depth_delta = self.depth - (old_path.count('/') - 2)
+        Category.objects.filter(path__startswith=old_path).update(
+            path=Concat(Value(self.path), Substr('path', len(old_path) + 1),
+                        output_field=models.CharField()),
+            depth=F('depth') + depth_delta,
+        )
+        # Пути товаров поддерева (и подкатегория могла выйти из категории)
+        subtree = Category.objects.filter(path__startswith=self.path).values('pk')
+        products = Product.objects.filter(Q(category__in=subtree) | Q(subcategory__in=subtree))
+        before = products.tree_counts()
+        products.refresh_tree_paths()
+        # Сдвиг счетчиков дерева у старых и новых предков применит post_save
+        self._tree_deltas = products.tree_counts()
+        self._tree_deltas.subtract(before)
+
+    def get_ancestor_ids(self):
+        """Идентификаторы предков от корня, извлеченные из пути"""
+        return [int(pk) for pk in self.path.strip('/').split('/')[:-1]] if self.path else []
+
     def get_ancestors(self):
-        """Получить всех предков категории"""
-        ancestors = []
-        current = self.parent
-        while current:
-            ancestors.append(current)
-            current = current.parent
-        return ancestors
+        """Получить всех предков категории (от корня, одним запросом)"""
+        return Category.objects.filter(
+            pk__in=self.get_ancestor_ids()).order_by('depth')
+
+    def get_descendants(self, include_self=False):
+        """Получить все подкатегории любого уровня (один запрос по индексу пути)"""
+        if not self.path:
+            return Category.objects.none()
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def get_breadcrumbs(self):
+        """Цепочка категорий от корня до текущей включительно"""
+        return [*self.get_ancestors(), self]
 
     def get_hierarchical_name(self):
         """Получить иерархическое название с отступами"""
-        indent = '　' * self.get_ancestors().count()
+        indent = '　' * self.depth
         return f"{indent}{self.name}"
 
     def get_image_alt_text(self):
@@ -69,6 +183,90 @@ class Category(models.Model):
         return f"Категория: {self.name}"
 
 
+# Поля, из которых строится Product.search_key
+SEARCH_KEY_FIELDS = {'title', 'article', 'category', 'category_id'}
+
+# Поля, от которых зависит место товара в дереве (Product.tree_path)
+TREE_PATH_FIELDS = {'category', 'category_id', 'subcategory', 'subcategory_id'}
+
+
+def product_tree_path(category_path, subcategory_path):
+    """
+    Путь, по которому товар входит в дерево категорий: подкатегория, если
+    она лежит внутри категории товара, иначе сама категория. Товар
+    относится к категории и всем ее предкам по этому пути.
+    """
+    if subcategory_path and subcategory_path.startswith(category_path):
+        return subcategory_path
+    return category_path
+
+
+def tree_root_id(path):
+    """ID корневой категории по материализованному пути"""
+    return int(path.split('/')[1]) if path else None
+
+
+def tree_path_ids(path):
+    """ID категорий материализованного пути, от корня"""
+    return [int(pk) for pk in path.split('/') if pk]
+
+
+class ProductQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(is_active=True)
+
+    def in_category_tree(self, category):
+        """
+        Товары категории и всех ее подкатегорий любого уровня (по обеим
+        связям, см. product_tree_path).
+
+        Отбор идет по денормализованным tree_root и tree_path: для корня
+        это равенство, и составные индексы листинга отдают страницу уже
+        отсортированной; для вложенной категории к нему добавляется
+        префикс пути. category может быть и узлом снимка каталога.
+        """
+        if not category.path:
+            return self.none()
+        products = self.filter(tree_root_id=tree_root_id(category.path))
+        if category.parent_id:
+            products = products.filter(tree_path__startswith=category.path)
+        return products
+
+    def refresh_tree_paths(self):
+        """
+        Пересчитывает tree_path и tree_root одним UPDATE - после переноса
+        или удаления категорий, когда save() товаров не вызывается.
+        """
+        def category_path(field):
+            return Subquery(Category.objects.filter(
+                pk=OuterRef(field)).values('path')[:1])
+
+        category, subcategory = category_path('category_id'), category_path('subcategory_id')
+        # То же правило, что в product_tree_path, но на стороне БД
+        path = Case(
+            When(StartsWith(subcategory, category), then=subcategory),
+            default=category,
+            output_field=models.CharField(),
+        )
+        root = Cast(Func(path, Value('/'), Value(2), function='split_part'),
+                    models.IntegerField())
+        return self.update(tree_path=path, tree_root_id=root)
+
+    def tree_counts(self):
+        """
+        Активные товары по категориям дерева: {id категории: число}.
+        Товар учитывается у каждой категории своего tree_path - то же
+        множество, что выводит in_category_tree.
+        """
+        counts = Counter()
+        rows = (self.active().order_by().values('tree_path')
+                .annotate(count=Count('id')).values_list('tree_path', 'count'))
+        for path, count in rows:
+            for pk in tree_path_ids(path):
+                counts[pk] += count
+        return counts
+
+
 class Product(models.Model):
     """Модель товара"""
     AVAILABILITY_CHOICES = [
@@ -119,14 +317,74 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True, verbose_name="Активен")
     views_count = models.PositiveIntegerField(
         default=0, verbose_name="Счетчик просмотров")
+    # Рейтинги по дневной статистике ProductDailyViews, пересчитываются
+    # командой update_product_rankings
+    weekly_views = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Просмотров за неделю")
+    trending_score = models.FloatField(
+        default=0, editable=False, verbose_name="Рейтинг роста популярности")
     created_at = models.DateTimeField(
         auto_now_add=True, verbose_name="Создано")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
 
+    # Полнотекстовый индекс (русская морфология, веса: название/артикул - A,
+    # категория - B, описание - D). Заполняется триггером в PostgreSQL,
+    # см. миграцию 0008_product_search_vector.
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name="Поисковый вектор")
+    # Место товара в дереве категорий: путь category или subcategory (см.
+    # product_tree_path) и его корень. Заполняются в save(), при переносе
+    # категорий - refresh_tree_paths(); на них построены индексы листинга
+    tree_path = models.CharField(
+        max_length=255, blank=True, default='', editable=False,
+        verbose_name="Путь в дереве")
+    tree_root = models.ForeignKey(
+        Category,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,
+        related_name='+',
+        verbose_name="Корневая категория"
+    )
+    # Нормализованный ключ (латиница, без пунктуации) для поиска с любой
+    # раскладкой, см. text.build_search_key; заполняется в save()
+    search_key = models.TextField(
+        blank=True, default='', editable=False, verbose_name="Поисковый ключ")
+
+    objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ['-created_at']
+        # Составные индексы под режимы сортировки листинга поддерева
+        # (pagination.SORT_MODES, ProductQuerySet.in_category_tree): корень
+        # отбирается равенством, поэтому страница читается уже упорядоченной
+        indexes = [
+            models.Index(fields=['tree_root', 'is_active', '-created_at', '-id'],
+                         name='catalog_prod_tree_newest_idx'),
+            models.Index(fields=['tree_root', 'is_active', 'title', 'id'],
+                         name='catalog_prod_tree_name_idx'),
+            models.Index(fields=['tree_root', 'is_active', '-views_count', '-id'],
+                         name='catalog_prod_tree_popular_idx'),
+            models.Index(fields=['tree_root', 'is_active', 'availability', '-created_at', '-id'],
+                         name='catalog_prod_tree_in_stock_idx'),
+            models.Index(fields=['tree_root', 'is_active', '-trending_score', '-id'],
+                         name='catalog_prod_tree_trending_idx'),
+            # Небольшие вложенные поддеревья: отбор по префиксу пути
+            models.Index(fields=['tree_path'], name='catalog_prod_tree_path_idx',
+                         opclasses=['varchar_pattern_ops']),
+            # Блок "Популярное за неделю" на главной
+            models.Index(fields=['is_active', '-weekly_views', '-id'],
+                         name='catalog_prod_weekly_idx'),
+            GinIndex(fields=['search_vector'], name='catalog_prod_search_idx'),
+            GinIndex(fields=['article'], name='catalog_prod_article_trgm_idx',
+                     opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['search_key'], name='catalog_prod_key_trgm_idx',
+                     opclasses=['gin_trgm_ops']),
+        ]
 
     def __str__(self):
         return self.title
@@ -137,8 +395,29 @@ class Product(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or SEARCH_KEY_FIELDS & set(update_fields):
+            self.refresh_search_key()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'search_key'}
+        if update_fields is None or TREE_PATH_FIELDS & set(update_fields):
+            self.refresh_tree_path()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'tree_path', 'tree_root'}
         super().save(*args, **kwargs)
 
+    def refresh_search_key(self):
+        """Пересчитывает нормализованный поисковый ключ (без сохранения)"""
+        self.search_key = build_search_key(
+            self.title, self.article, self.category.name if self.category_id else '')
+
+    def refresh_tree_path(self):
+        """Пересчитывает tree_path и tree_root (без сохранения)"""
+        self.tree_path = product_tree_path(
+            self.category.path if self.category_id else '',
+            self.subcategory.path if self.subcategory_id else '')
+        self.tree_root_id = tree_root_id(self.tree_path)
+
     def get_preview_image_alt_text(self):
         """Возвращает alt-текст для превью-изображения товара"""
         if self.preview_image_alt:
@@ -188,3 +467,162 @@ class ProductImage(models.Model):
                 self.product.images.order_by('order')).index(self) + 1
             return f"{self.product.title} - изображение {image_index}"
         return self.product.title
+
+
+class ProductDailyViews(models.Model):
+    """Просмотры товара за день (заполняется пачками из tracking.flush_views)"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='daily_views',
+        verbose_name="Товар"
+    )
+    date = models.DateField(verbose_name="Дата")
+    views = models.PositiveIntegerField(default=0, verbose_name="Просмотры")
+
+    class Meta:
+        verbose_name = "Просмотры товара за день"
+        verbose_name_plural = "Просмотры товаров по дням"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'],
+                                    name='catalog_daily_views_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='catalog_daily_views_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} - {self.date}: {self.views}"
+
+
+class SimilarProduct(models.Model):
+    """Похожий товар (заранее посчитан в similarity.update_similar_products)"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='similar_links',
+        verbose_name="Товар"
+    )
+    similar = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name="Похожий товар"
+    )
+    score = models.FloatField(verbose_name="Степень сходства")
+
+    class Meta:
+        verbose_name = "Похожий товар"
+        verbose_name_plural = "Похожие товары"
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'similar'],
+                                    name='catalog_similar_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'],
+                         name='catalog_similar_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product} ~ {self.similar}"
+
+
+def import_upload_storage():
+    """Хранилище файлов импорта вне MEDIA_ROOT, без публичного URL"""
+    return FileSystemStorage(location=settings.IMPORT_UPLOAD_ROOT)
+
+
+class ImportJob(models.Model):
+    """Задание на импорт товаров; выполняется командой run_import_worker"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Завершен'),
+        (STATUS_FAILED, 'Ошибка'),
+        (STATUS_CANCELLED, 'Отменен'),
+    ]
+    ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+    FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+    STAGE_CHOICES = [
+        ('reading', 'Чтение файла'),
+        ('rows', 'Обработка товаров'),
+        ('cleanup', 'Удаление отсутствующих товаров'),
+        ('similar', 'Пересчет похожих товаров'),
+    ]
+
+    # Удаляется при любом завершении задания (см. import_jobs)
+    file = models.FileField(upload_to='imports/', storage=import_upload_storage,
+                            verbose_name="Файл")
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='import_jobs',
+        verbose_name="Категория"
+    )
+    update_existing = models.BooleanField(
+        default=False, verbose_name="Обновлять существующие")
+    delete_missing = models.BooleanField(
+        default=False, verbose_name="Удалять отсутствующие")
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING,
+        verbose_name="Статус")
+    stage = models.CharField(
+        max_length=20, choices=STAGE_CHOICES, blank=True, verbose_name="Этап")
+    # Отмену выполняющегося импорта обработчик замечает при записи прогресса
+    cancel_requested = models.BooleanField(
+        default=False, verbose_name="Запрошена отмена")
+    processed_rows = models.PositiveIntegerField(
+        default=0, verbose_name="Обработано строк")
+    total_rows = models.PositiveIntegerField(
+        default=0, verbose_name="Всего строк")
+    # Итог импорта в том же виде, что отдавал синхронный импорт
+    result = models.JSONField(default=dict, blank=True, verbose_name="Результат")
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Запустил"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начато")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+    # Обновляется обработчиком во время импорта: по нему находятся
+    # задания, брошенные упавшим обработчиком
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Импорт товаров"
+        verbose_name_plural = "Импорты товаров"
+        ordering = ['-created_at']
+        constraints = [
+            # Одновременно не больше одного незавершенного импорта в
+            # категорию (включая импорт без категории)
+            models.UniqueConstraint(
+                fields=['category'],
+                condition=Q(status__in=['pending', 'running']),
+                nulls_distinct=False,
+                name='catalog_import_one_active_per_category'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='catalog_import_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Импорт #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def percentage(self):
+        if not self.total_rows:
+            return 0
+        return max(0, min(100, int(self.processed_rows * 100 / self.total_rows)))
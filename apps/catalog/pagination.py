@@ -0,0 +1,127 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db import models
+from django.db.models import Q
+
+# Режимы сортировки: поля упорядочивания, последним всегда идет уникальный id.
+# Для каждого режима в Product.Meta.indexes есть соответствующий составной индекс.
+SORT_MODES = {
+    'newest': ('-created_at', '-id'),
+    'name': ('title', 'id'),
+    'popular': ('-views_count', '-id'),
+    'trending': ('-trending_score', '-id'),
+    'in_stock': ('availability', '-created_at', '-id'),
+}
+
+SORT_CHOICES = [
+    ('newest', 'Сначала новые'),
+    ('name', 'По названию'),
+    ('popular', 'Популярные'),
+    ('trending', 'Набирают популярность'),
+    ('in_stock', 'Сначала в наличии'),
+]
+
+DEFAULT_SORT = 'newest'
+PAGE_SIZE = 24
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """Страница keyset-пагинации: товары и курсор на следующую страницу"""
+
+    def __init__(self, object_list, next_cursor, sort):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.sort = sort
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def get_sort(value):
+    """Возвращает допустимый режим сортировки"""
+    return value if value in SORT_MODES else DEFAULT_SORT
+
+
+def encode_cursor(obj, ordering):
+    values = []
+    for field in ordering:
+        value = getattr(obj, field.lstrip('-'))
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        values.append(value)
+    raw = json.dumps(values, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, ordering, model):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("Некорректный курсор")
+
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise InvalidCursor("Курсор не соответствует сортировке")
+
+    decoded = []
+    for field, value in zip(ordering, values):
+        model_field = model._meta.get_field(field.lstrip('-'))
+        try:
+            if isinstance(model_field, models.DateTimeField):
+                value = datetime.fromisoformat(value)
+            else:
+                value = model_field.to_python(value)
+        except Exception:
+            raise InvalidCursor("Некорректное значение в курсоре")
+        decoded.append(value)
+    return decoded
+
+
+def _keyset_filter(ordering, values):
+    """
+    Условие "строго после курсора" для составной сортировки:
+    (a > x) OR (a = x AND b > y) OR ... с учетом направления каждого поля.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def paginate_keyset(queryset, sort=DEFAULT_SORT, cursor=None, per_page=PAGE_SIZE):
+    """
+    Keyset-пагинация: вместо OFFSET фильтруем по значениям последней строки
+    предыдущей страницы, поэтому стоимость страницы не зависит от ее номера.
+    """
+    sort = get_sort(sort)
+    ordering = SORT_MODES[sort]
+    queryset = queryset.order_by(*ordering)
+
+    if cursor:
+        values = decode_cursor(cursor, ordering, queryset.model)
+        queryset = queryset.filter(_keyset_filter(ordering, values))
+
+    items = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1], ordering)
+
+    return KeysetPage(items, next_cursor, sort)
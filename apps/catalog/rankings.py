@@ -0,0 +1,61 @@
+import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Product, ProductDailyViews
+
+# Окно для рейтинга "Популярное за неделю"
+WEEK_DAYS = 7
+
+# Рейтинг роста: просмотры с экспоненциальным затуханием, вес дня
+# уменьшается вдвое каждые TRENDING_HALF_LIFE дней
+TRENDING_HALF_LIFE = 2
+TRENDING_WINDOW_DAYS = 14
+
+# Сколько дней хранится дневная статистика
+RETENTION_DAYS = 90
+
+_UPDATE_RANKINGS_SQL = """
+WITH stats AS (
+    SELECT product_id,
+           SUM(views) FILTER (WHERE date > %(week_start)s) AS weekly,
+           SUM(views * power(0.5, (%(today)s - date) / %(half_life)s::float)) AS trending
+    FROM {daily} WHERE date > %(window_start)s
+    GROUP BY product_id
+), new AS (
+    SELECT p.id, COALESCE(s.weekly, 0) AS weekly, COALESCE(s.trending, 0) AS trending
+    FROM {product} p LEFT JOIN stats s ON s.product_id = p.id
+    WHERE s.product_id IS NOT NULL OR p.weekly_views > 0 OR p.trending_score > 0
+)
+UPDATE {product} p
+SET weekly_views = new.weekly, trending_score = new.trending
+FROM new
+WHERE p.id = new.id
+  AND (p.weekly_views, p.trending_score) IS DISTINCT FROM (new.weekly, new.trending)
+"""
+
+
+def update_product_rankings(today=None):
+    """
+    Пересчитывает Product.weekly_views и Product.trending_score по дневной
+    статистике одним UPDATE (меняются только строки с новыми значениями)
+    и удаляет устаревшую статистику.
+
+    Возвращает число обновленных товаров.
+    """
+    today = today or timezone.localdate()
+    sql = _UPDATE_RANKINGS_SQL.format(
+        daily=ProductDailyViews._meta.db_table, product=Product._meta.db_table)
+    params = {
+        'today': today,
+        'week_start': today - datetime.timedelta(days=WEEK_DAYS),
+        'window_start': today - datetime.timedelta(days=TRENDING_WINDOW_DAYS),
+        'half_life': TRENDING_HALF_LIFE,
+    }
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        updated = cursor.rowcount
+        ProductDailyViews.objects.filter(
+            date__lte=today - datetime.timedelta(days=RETENTION_DAYS)).delete()
+    return updated
@@ -0,0 +1,82 @@
+import hashlib
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, Q
+
+from .models import Product
+from .text import normalize_search_text
+
+SEARCH_CONFIG = 'russian'
+RESULTS_LIMIT = 10
+
+# Ключ кэша содержит версию каталога, поэтому срок жизни нужен только
+# для вытеснения редких запросов
+CACHE_TIMEOUT = 60 * 60
+
+
+def build_prefix_query(query):
+    """
+    Префиксный tsquery по каждому слову запроса: 'проек:* & shure:*'.
+
+    Позволяет находить товары по началу слова, пока пользователь печатает.
+    """
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    return SearchQuery(
+        ' & '.join(f'{word}:*' for word in words),
+        search_type='raw',
+        config=SEARCH_CONFIG,
+    )
+
+
+def cache_key(query, version):
+    """
+    Ключ кэша ответа: запрос без учета регистра и лишних пробелов
+    (все ветки поиска к ним нечувствительны) плюс версия каталога.
+    """
+    normalized = ' '.join(query.lower().split())
+    digest = hashlib.md5(normalized.encode()).hexdigest()
+    return f'search:{version}:{digest}'
+
+
+def search_products(query, limit=RESULTS_LIMIT):
+    """
+    Ранжированный поиск активных товаров.
+
+    Основной путь - полнотекстовый поиск по GIN-индексу search_vector.
+    Если он ничего не нашел (запрос в другой раскладке вроде "proektor"
+    или смесь "микрофон shure"), ищем по нормализованному search_key
+    через триграммный индекс. Последний шанс - похожие артикулы.
+    """
+    products = Product.objects.active().select_related(
+        'category').prefetch_related('images')
+
+    ts_query = build_prefix_query(query)
+    if ts_query is not None:
+        results = list(
+            products.filter(search_vector=ts_query)
+            .annotate(rank=SearchRank(F('search_vector'), ts_query))
+            .order_by('-rank', '-views_count')[:limit]
+        )
+        if results:
+            return results
+
+    words = normalize_search_text(query).split()
+    if words:
+        # ' ' + слово - совпадение с началом слова ключа
+        key_filter = Q()
+        for word in words:
+            key_filter &= Q(search_key__contains=f' {word}')
+        results = list(
+            products.filter(key_filter).order_by('-views_count', '-id')[:limit])
+        if results:
+            return results
+
+    return list(
+        products.filter(
+            Q(article__icontains=query) | Q(article__trigram_similar=query))
+        .annotate(similarity=TrigramSimilarity('article', query))
+        .order_by('-similarity', '-views_count')[:limit]
+    )
@@ -0,0 +1,233 @@
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from itertools import zip_longest
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from apps.core.purge import purge_catalog_pages
+
+from .counters import tree_move_deltas, update_category_counters
+from .models import Category, Product, ProductImage
+from .text import build_search_key
+from .version import bump_catalog_version
+
+# Поля товара, от которых зависят счетчики категорий (подкатегория -
+# счетчик поддерева, см. ProductQuerySet.tree_counts)
+COUNTER_FIELDS = {'category', 'category_id', 'subcategory', 'subcategory_id',
+                  'is_active', 'availability'}
+
+# Служебные поля: их изменение не считается изменением каталога
+TRACKING_FIELDS = {'views_count', 'weekly_views', 'trending_score'}
+
+_state = threading.local()
+
+
+@contextmanager
+def defer_catalog_updates():
+    """
+    Откладывает пересчет счетчиков и смену версии каталога до конца
+    пакетной операции.
+
+    Используется импортом: вместо пересчета на каждый сохраненный товар
+    затронутые категории собираются и пересчитываются один раз в конце,
+    и версия каталога меняется тоже один раз.
+    """
+    depth = getattr(_state, 'depth', 0)
+    if depth == 0:
+        _state.dirty_categories = set()
+        _state.tree_deltas = Counter()
+        _state.version_dirty = False
+        _state.purge_product_urls = set()
+        _state.purge_category_ids = set()
+        _state.purge_product_ids = set()
+    _state.depth = depth + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+        if _state.depth == 0:
+            dirty_categories = _state.dirty_categories
+            tree_deltas = _state.tree_deltas
+            version_dirty = _state.version_dirty
+            purge_product_urls = _state.purge_product_urls
+            purge_category_ids = _state.purge_category_ids
+            purge_product_ids = _state.purge_product_ids
+            _state.dirty_categories = set()
+            _state.tree_deltas = Counter()
+            _state.version_dirty = False
+            _state.purge_product_urls = set()
+            _state.purge_category_ids = set()
+            _state.purge_product_ids = set()
+            if dirty_categories or tree_deltas:
+                update_category_counters(dirty_categories, tree_deltas)
+            if version_dirty:
+                bump_catalog_version()
+                purge_catalog_pages(purge_product_urls, purge_category_ids,
+                                    purge_product_ids)
+
+
+def _mark_dirty(category_ids=(), counters=True, tree_deltas=None):
+    """
+    Помечает каталог измененным (сразу или в конце пакета).
+
+    counters=False - изменение не затрагивает счетчики категорий.
+    tree_deltas - сдвиги счетчиков дерева (counters.tree_move_deltas),
+    в пакете они суммируются.
+    Кэш фрагментов (fragments.py) не сбрасывается: их ключи меняются
+    вместе с updated_at и счетчиками объекта.
+    """
+    if getattr(_state, 'depth', 0):
+        if counters:
+            _state.dirty_categories.update(category_ids)
+            if tree_deltas:
+                _state.tree_deltas.update(tree_deltas)
+        _state.version_dirty = True
+    else:
+        if counters:
+            update_category_counters(category_ids, tree_deltas)
+        bump_catalog_version()
+
+
+def _mark_pages(product_urls=(), category_ids=(), product_ids=()):
+    """Страницы, которые нужно обновить в кэше nginx (сразу или в конце пакета)"""
+    if getattr(_state, 'depth', 0):
+        _state.purge_product_urls.update(product_urls)
+        _state.purge_category_ids.update(category_ids)
+        _state.purge_product_ids.update(product_ids)
+    else:
+        purge_catalog_pages(product_urls, category_ids, product_ids)
+
+
+def products_bulk_saved(products, old_category_ids=(), old_tree_paths=()):
+    """
+    То же, что post_save, для товаров, записанных bulk_create/bulk_update
+    (сигналы модели при этом не отправляются). old_category_ids - прежние
+    категории измененных товаров, old_tree_paths - их прежние tree_path в
+    том же порядке, что products ('' у новых и бывших неактивными).
+    """
+    if not products:
+        return
+    category_ids = {product.category_id for product in products}
+    category_ids.update(old_category_ids)
+    category_ids.discard(None)
+    tree_deltas = Counter()
+    for product, old_path in zip_longest(products, old_tree_paths, fillvalue=''):
+        tree_deltas.update(tree_move_deltas(old_path, _counted_path(product)))
+    _mark_dirty(category_ids, tree_deltas=tree_deltas)
+    page_category_ids = category_ids | {product.subcategory_id for product in products}
+    page_category_ids.discard(None)
+    _mark_pages([product.get_absolute_url() for product in products], page_category_ids)
+
+
+def similar_products_changed(product_ids):
+    """Списки похожих товаров пересчитаны: страницы этих товаров изменились"""
+    _mark_dirty(counters=False)
+    _mark_pages(product_ids=product_ids)
+
+
+def _affects_counters(update_fields):
+    return update_fields is None or bool(COUNTER_FIELDS & set(update_fields))
+
+
+def _counted_path(product):
+    """Путь, по которому товар входит в счетчики дерева ('' - не входит)"""
+    return product.tree_path if product.is_active else ''
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, update_fields=None, **kwargs):
+    """Запоминает исходную категорию и место в дереве, чтобы пересчитать и их"""
+    instance._old_category_id = None
+    instance._old_tree_state = ('', False)
+    if instance.pk and _affects_counters(update_fields):
+        row = sender.objects.filter(pk=instance.pk).values_list(
+            'category_id', 'tree_path', 'is_active').first()
+        if row:
+            instance._old_category_id, *instance._old_tree_state = row
+
+
+def _product_tree_deltas(product, update_fields):
+    old_path, old_active = getattr(product, '_old_tree_state', ('', False))
+    # Поля вне update_fields не записаны: в БД остались прежние значения
+    saved = set(update_fields) if update_fields is not None else None
+    path = product.tree_path if saved is None or 'tree_path' in saved else old_path
+    active = product.is_active if saved is None or 'is_active' in saved else old_active
+    return tree_move_deltas(old_path if old_active else '', path if active else '')
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= TRACKING_FIELDS:
+        return
+    old_category_id = getattr(instance, '_old_category_id', None)
+    if not _affects_counters(update_fields):
+        _mark_dirty(counters=False)
+    else:
+        _mark_dirty({instance.category_id, old_category_id},
+                    tree_deltas=_product_tree_deltas(instance, update_fields))
+    _mark_product_pages(instance, old_category_id)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    _mark_dirty({instance.category_id},
+                tree_deltas=tree_move_deltas(_counted_path(instance), ''))
+    _mark_product_pages(instance)
+
+
+def _mark_product_pages(product, *extra_category_ids):
+    category_ids = {product.category_id, product.subcategory_id, *extra_category_ids}
+    category_ids.discard(None)
+    _mark_pages([product.get_absolute_url()], category_ids)
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_name(sender, instance, **kwargs):
+    """Запоминает исходное название: от него зависят поисковые ключи товаров"""
+    instance._old_name = None
+    if instance.pk:
+        instance._old_name = sender.objects.filter(
+            pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_search_keys(sender, instance, created, **kwargs):
+    """После переименования категории пересчитывает ключи ее товаров"""
+    if created or getattr(instance, '_old_name', None) in (None, instance.name):
+        return
+    products = list(Product.objects.filter(category=instance).only(
+        'id', 'title', 'article'))
+    for product in products:
+        product.search_key = build_search_key(
+            product.title, product.article, instance.name)
+    Product.objects.bulk_update(products, ['search_key'], batch_size=1000)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    """Товары, у которых удаленная категория была подкатегорией, остаются в категории"""
+    if instance.path:
+        products = Product.objects.filter(pk__in=list(Product.objects.filter(
+            tree_path__startswith=instance.path).values_list('pk', flat=True)))
+        before = products.tree_counts()
+        products.refresh_tree_paths()
+        instance._tree_deltas = products.tree_counts()
+        instance._tree_deltas.subtract(before)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # Перемещение (Category._move_subtree) или удаление категории
+    # (category_deleted, подключен раньше) сдвигает счетчики дерева
+    _mark_dirty(tree_deltas=instance.__dict__.pop('_tree_deltas', None))
+    _mark_pages(category_ids=[instance.pk, instance.parent_id])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    _mark_dirty(counters=False)
+    _mark_pages(product_ids=[instance.product_id])
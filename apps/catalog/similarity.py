@@ -0,0 +1,154 @@
+import heapq
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Category, Product, SimilarProduct
+from .signals import similar_products_changed
+from .text import normalize_search_text
+
+# Сколько похожих товаров хранится для каждого товара
+SIMILAR_LIMIT = 8
+
+# Веса составляющих сходства
+TITLE_WEIGHT = 2.0
+DETAILS_WEIGHT = 1.5
+SAME_CATEGORY_WEIGHT = 1.0
+SIBLING_CATEGORY_WEIGHT = 0.5
+
+# Признак, который есть у слишком многих товаров, не используется для
+# отбора кандидатов (но учитывается в оценке), иначе перебор квадратичный
+MAX_POSTING = 2000
+
+
+class _Item:
+    """Признаки товара для расчета сходства"""
+    __slots__ = ('id', 'category_id', 'parent_id', 'root', 'views',
+                 'tokens', 'details')
+
+    def __init__(self, product, categories):
+        self.id = product.id
+        self.category_id = product.subcategory_id or product.category_id
+        self.parent_id, path = categories[self.category_id]
+        # Кандидаты ищутся только внутри корневого раздела каталога
+        self.root = path.split('/')[1]
+        self.views = product.views_count
+        self.tokens = frozenset(
+            word for word in normalize_search_text(product.title).split()
+            if len(word) > 1)
+        details = product.details if isinstance(product.details, dict) else {}
+        self.details = frozenset(
+            (normalize_search_text(key), normalize_search_text(value))
+            for key, value in details.items())
+
+    def features(self):
+        yield 'c', self.category_id
+        for word in self.tokens:
+            yield 't', word
+        for pair in self.details:
+            yield 'd', pair
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+
+def _score(item, other):
+    score = (TITLE_WEIGHT * _jaccard(item.tokens, other.tokens)
+             + DETAILS_WEIGHT * _jaccard(item.details, other.details))
+    if item.category_id == other.category_id:
+        score += SAME_CATEGORY_WEIGHT
+    elif item.parent_id is not None and item.parent_id == other.parent_id:
+        score += SIBLING_CATEGORY_WEIGHT
+    return score
+
+
+class _Catalog:
+    """Активные товары и обратный индекс "признак -> товары" по разделам"""
+
+    def __init__(self):
+        categories = {
+            category_id: (parent_id, path)
+            for category_id, parent_id, path in
+            Category.objects.values_list('id', 'parent_id', 'path')
+        }
+        products = Product.objects.active().only(
+            'id', 'title', 'details', 'category_id', 'subcategory_id',
+            'views_count')
+        self.items = {
+            product.id: _Item(product, categories)
+            for product in products.iterator(chunk_size=2000)
+        }
+        self.postings = defaultdict(list)
+        for item in self.items.values():
+            for feature in item.features():
+                self.postings[item.root, feature].append(item.id)
+
+    def candidates(self, item):
+        found = set()
+        for feature in item.features():
+            posting = self.postings[item.root, feature]
+            if len(posting) <= MAX_POSTING:
+                found.update(posting)
+        found.discard(item.id)
+        return found
+
+    def top_similar(self, item, limit=SIMILAR_LIMIT):
+        scored = []
+        for candidate_id in self.candidates(item):
+            other = self.items[candidate_id]
+            scored.append((_score(item, other), other.views, -other.id))
+        return [(-negative_id, score) for score, _, negative_id
+                in heapq.nlargest(limit, scored)]
+
+
+def update_similar_products(product_ids=None):
+    """
+    Пересчитывает таблицу похожих товаров.
+
+    Без аргументов - полностью. С product_ids (товары, измененные
+    импортом) - только для них и для товаров, чей список мог из-за них
+    измениться: имеющих общие признаки или ссылающихся на них сейчас.
+
+    Возвращает число товаров, для которых список пересчитан.
+    """
+    catalog = _Catalog()
+
+    if product_ids is None:
+        targets = set(catalog.items)
+        stale = SimilarProduct.objects.all()
+    else:
+        changed = set(product_ids)
+        targets = set(changed)
+        for product_id in changed:
+            if product_id in catalog.items:
+                targets |= catalog.candidates(catalog.items[product_id])
+        targets |= set(SimilarProduct.objects.filter(
+            similar_id__in=changed).values_list('product_id', flat=True))
+        stale = SimilarProduct.objects.filter(product_id__in=targets)
+        targets &= catalog.items.keys()
+
+    rows = [
+        SimilarProduct(product_id=product_id, similar_id=similar_id, score=score)
+        for product_id in targets
+        for similar_id, score in catalog.top_similar(catalog.items[product_id])
+    ]
+    # Страницы обновляются только у товаров, чей список действительно изменился
+    old_lists = defaultdict(dict)
+    for product_id, similar_id, score in stale.values_list('product_id', 'similar_id', 'score'):
+        old_lists[product_id][similar_id] = score
+    new_lists = defaultdict(dict)
+    for row in rows:
+        new_lists[row.product_id][row.similar_id] = row.score
+    changed_pages = {product_id for product_id in old_lists.keys() | new_lists.keys()
+                     if old_lists.get(product_id) != new_lists.get(product_id)}
+
+    with transaction.atomic():
+        stale.delete()
+        SimilarProduct.objects.bulk_create(rows, batch_size=2000)
+        if changed_pages:
+            similar_products_changed(changed_pages)
+    return len(targets)
@@ -0,0 +1,54 @@
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+
+class SlugAllocator:
+    """
+    Выдает уникальные slug для пакета объектов без запроса на каждый.
+
+    load(bases) одним запросом загружает занятые slug вида base и base-N,
+    allocate(base) выдает первый свободный из них в памяти и сразу
+    помечает его занятым. Окончательная проверка - уникальный индекс:
+    если параллельная запись заняла выданный slug, его отмечают через
+    mark_taken и выдают новый.
+    """
+
+    def __init__(self, model, field='slug'):
+        self.model = model
+        self.field = field
+        self.taken = set()
+        self.loaded = set()
+        # Номер, с которого продолжать перебор для основы (меньшие заняты)
+        self.next_number = {}
+
+    def load(self, bases):
+        """Загружает занятые slug для еще не загруженных основ"""
+        bases = set(bases) - self.loaded
+        if not bases:
+            return
+        # Префиксный поиск идет по индексу *_like (varchar_pattern_ops),
+        # который Django создает для уникальных CharField в PostgreSQL
+        condition = reduce(or_, (Q(**{f'{self.field}__startswith': f'{base}-'})
+                                 for base in bases), Q(**{f'{self.field}__in': bases}))
+        self.taken.update(
+            self.model.objects.filter(condition).values_list(self.field, flat=True))
+        self.loaded |= bases
+
+    def allocate(self, base):
+        """Первый свободный slug: base, base-1, base-2, ..."""
+        self.load([base])
+        if base not in self.taken:
+            self.taken.add(base)
+            return base
+        number = self.next_number.get(base, 1)
+        while f'{base}-{number}' in self.taken:
+            number += 1
+        slug = f'{base}-{number}'
+        self.taken.add(slug)
+        self.next_number[base] = number + 1
+        return slug
+
+    def mark_taken(self, slugs):
+        self.taken.update(slugs)
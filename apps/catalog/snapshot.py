@@ -0,0 +1,214 @@
+from array import array
+
+from django.db.models.fields.files import ImageFieldFile
+from django.urls import reverse
+
+from .models import Category, Product
+from .pagination import DEFAULT_SORT, PAGE_SIZE, SORT_MODES, KeysetPage, encode_cursor
+from .version import VersionedCopy
+
+# Как часто (в секундах) воркер сверяет версию каталога с общим кэшем.
+# Страницы, которым важна свежесть (ETag, conditional.py), сами сверяют
+# версию снимка с текущей
+VERSION_CHECK_INTERVAL = 5
+
+# В карточке описание обрезается до 25 слов (truncatewords:25); хранится
+# на слово больше, чтобы фильтр по-прежнему добавлял многоточие
+CARD_DESCRIPTION_WORDS = 26
+
+_AVAILABILITY_LABELS = dict(Product.AVAILABILITY_CHOICES)
+
+
+def _image(model, field_name, name):
+    """FieldFile для шаблонов (.url), без экземпляра модели"""
+    if not name:
+        return None
+    return ImageFieldFile(None, model._meta.get_field(field_name), name)
+
+
+class CategoryNode:
+    """Категория в снимке: поля, которые нужны страницам каталога"""
+    __slots__ = ('id', 'parent_id', 'name', 'slug', 'description', 'image_name',
+                 'image_alt', 'order', 'is_active', 'path', 'depth',
+                 'tree_products_count', 'updated_at', 'url', 'children')
+
+    def __init__(self, row):
+        (self.id, self.parent_id, self.name, self.slug, self.description,
+         self.image_name, self.image_alt, self.order, self.is_active, self.path,
+         self.depth, self.tree_products_count, self.updated_at) = row
+        self.url = reverse('catalog:category', kwargs={'slug': self.slug})
+        self.children = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def image(self):
+        return _image(Category, 'image', self.image_name)
+
+    def get_absolute_url(self):
+        return self.url
+
+    def get_image_alt_text(self):
+        return Category.get_image_alt_text(self)
+
+
+class ProductCard:
+    """Товар в снимке: поля карточки в списках товаров"""
+    __slots__ = ('id', 'title', 'slug', 'article', 'description', 'image_name',
+                 'preview_image_alt', 'availability', 'views_count', 'created_at',
+                 'updated_at', 'url')
+
+    def __init__(self, row):
+        (self.id, self.title, self.slug, self.article, description, self.image_name,
+         self.preview_image_alt, self.availability, self.views_count,
+         self.created_at, self.updated_at) = row
+        self.description = ' '.join(description.split()[:CARD_DESCRIPTION_WORDS])
+        self.url = reverse('catalog:product', kwargs={'slug': self.slug})
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def preview_image(self):
+        return _image(Product, 'preview_image', self.image_name)
+
+    def get_absolute_url(self):
+        return self.url
+
+    def get_availability_display(self):
+        return _AVAILABILITY_LABELS.get(self.availability, self.availability)
+
+    def get_preview_image_alt_text(self):
+        return Product.get_preview_image_alt_text(self)
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога в памяти процесса.
+
+    Строится в мастере gunicorn до fork (см. gunicorn.conf.py) и делится
+    воркерами copy-on-write. categories - дерево категорий по id,
+    products - карточки первых страниц (без повторов), category_products -
+    номера карточек первой страницы каждой категории в сортировке по
+    умолчанию, на одну больше PAGE_SIZE, чтобы знать о следующей
+    (array вместо списков: меньше объектов и страниц памяти).
+
+    Товары хранятся не все, а только первые страницы: объем снимка
+    ограничен числом непустых категорий, а не размером каталога -
+    порядка (PAGE_SIZE + 1) карточек по ~1 КБ на категорию, то есть
+    около 25 МБ на 1000 категорий. Первый снимок воркеры делят с
+    мастером, но перестроенный после изменения каталога каждый воркер
+    держит свой: это и есть цена снимка на воркер.
+    """
+    __slots__ = ('version', 'categories', 'category_slugs', 'roots',
+                 'products', 'product_slugs', 'category_products')
+
+    def __init__(self, version, categories, first_pages):
+        self.version = version
+        self.categories = {node.id: node for node in categories}
+        self.category_slugs = {node.slug: node.id for node in categories}
+
+        children = {}
+        for node in sorted(categories, key=lambda node: (node.order, node.name)):
+            children.setdefault(node.parent_id, []).append(node.id)
+        for node in categories:
+            node.children = tuple(children.get(node.id, ()))
+        self.roots = tuple(children.get(None, ()))
+
+        # Товар на первых страницах нескольких категорий (своей и предков)
+        # хранится одной карточкой
+        positions = {}
+        products = []
+        category_products = {}
+        for category_id, cards in first_pages.items():
+            page = array('I')
+            for card in cards:
+                if card.id not in positions:
+                    positions[card.id] = len(products)
+                    products.append(card)
+                page.append(positions[card.id])
+            category_products[category_id] = page
+        self.products = tuple(products)
+        self.product_slugs = {card.slug: position
+                              for position, card in enumerate(self.products)}
+        self.category_products = category_products
+
+    @classmethod
+    def build(cls, version):
+        categories = [CategoryNode(row) for row in Category.objects.values_list(
+            'id', 'parent_id', 'name', 'slug', 'description', 'image', 'image_alt',
+            'order', 'is_active', 'path', 'depth', 'tree_products_count', 'updated_at')]
+        cards = {}
+        first_pages = {}
+        # По запросу на непустую категорию: это та же выборка по индексам
+        # листинга, что и у страницы категории (in_category_tree)
+        for node in categories:
+            if not node.tree_products_count:
+                continue
+            rows = (
+                Product.objects.active().in_category_tree(node)
+                .order_by(*SORT_MODES[DEFAULT_SORT])
+                .values_list('id', 'title', 'slug', 'article', 'description',
+                             'preview_image', 'preview_image_alt', 'availability',
+                             'views_count', 'created_at', 'updated_at')[:PAGE_SIZE + 1]
+            )
+            page = []
+            for row in rows:
+                if row[0] not in cards:
+                    cards[row[0]] = ProductCard(row)
+                page.append(cards[row[0]])
+            first_pages[node.id] = page
+        return cls(version, categories, first_pages)
+
+    def category_by_slug(self, slug):
+        category_id = self.category_slugs.get(slug)
+        return self.categories[category_id] if category_id is not None else None
+
+    def product_by_slug(self, slug):
+        """Карточка товара с первой страницы какой-либо категории или None"""
+        position = self.product_slugs.get(slug)
+        return self.products[position] if position is not None else None
+
+    def root_categories(self):
+        """Активные корневые категории в порядке order"""
+        return [self.categories[pk] for pk in self.roots if self.categories[pk].is_active]
+
+    def children(self, category):
+        return [self.categories[pk] for pk in category.children]
+
+    def ancestors(self, category):
+        """Предки категории от корня"""
+        return [self.categories[int(pk)] for pk in category.path.split('/')[1:-2]]
+
+    def first_page(self, category):
+        """Первая страница товаров поддерева категории в сортировке по умолчанию"""
+        positions = self.category_products.get(category.id, ())
+        cards = [self.products[position] for position in positions[:PAGE_SIZE]]
+        next_cursor = None
+        if len(positions) > PAGE_SIZE:
+            next_cursor = encode_cursor(cards[-1], SORT_MODES[DEFAULT_SORT])
+        return KeysetPage(cards, next_cursor, DEFAULT_SORT)
+
+    @property
+    def products_count(self):
+        """Активные товары каталога: у каждого ровно один корень в tree_path"""
+        return sum(self.categories[pk].tree_products_count for pk in self.roots)
+
+    @property
+    def active_categories_count(self):
+        return sum(1 for node in self.categories.values() if node.is_active)
+
+
+_snapshot = VersionedCopy(CatalogSnapshot.build, 'Catalog snapshot', VERSION_CHECK_INTERVAL)
+
+
+def get_snapshot(wait=True):
+    """
+    Снимок текущего процесса. После изменения каталога перестраивается в
+    фоне, до этого отдается прежний. Первый снимок строится в мастере
+    gunicorn (wait=True); без wait, пока снимка нет, возвращается None.
+    """
+    return _snapshot.get(wait=wait)
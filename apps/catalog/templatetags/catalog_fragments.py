@@ -0,0 +1,17 @@
+from django import template
+
+from apps.catalog.fragments import render_category_tiles, render_product_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_cards(products):
+    """Карточки товаров из кэша фрагментов"""
+    return render_product_cards(products)
+
+
+@register.simple_tag
+def category_tiles(categories):
+    """Плитки категорий из кэша фрагментов"""
+    return render_category_tiles(categories)
@@ -1,3 +1,955 @@
-from django.test import TestCase
+import codecs
+import json
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (autocomplete, conditional, featured, fragments, rankings, search,
+               similarity, tracking, views)
+from .counters import rebuild_all_counters
+from .import_jobs import cancel_job, claim_next_job
+from .models import Category, ImportJob, Product, ProductDailyViews, SimilarProduct
+from .pagination import PAGE_SIZE, SORT_MODES, InvalidCursor, paginate_keyset
+from .signals import defer_catalog_updates
+from .slugs import SlugAllocator
+from .snapshot import CatalogSnapshot
+from .text import build_search_key, normalize_search_text
+from . import utils
+from .utils import ImportProcessor, detect_csv_encoding
+from .version import bump_catalog_version, get_catalog_version
+
+
+def create_product(category, title, **kwargs):
+    kwargs.setdefault('slug', f'product-{Product.objects.count()}')
+    kwargs.setdefault('description', 'Описание')
+    return Product.objects.create(title=title, category=category, **kwargs)
+
+
+class CategoryTreeTests(TestCase):
+    """Материализованные пути категорий и товаров"""
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Корень', slug='root')
+        self.child = Category.objects.create(name='Раздел', slug='child', parent=self.root)
+        self.leaf = Category.objects.create(name='Лист', slug='leaf', parent=self.child)
+        self.other = Category.objects.create(name='Другой', slug='other')
+
+    def test_paths_on_create(self):
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f'/{self.root.pk}/{self.child.pk}/{self.leaf.pk}/')
+        self.assertEqual(self.leaf.depth, 2)
+
+    def test_reparent_rewrites_subtree(self):
+        product = create_product(self.leaf, 'Товар')
+        self.child.parent = self.other
+        self.child.save()
+
+        self.leaf.refresh_from_db()
+        product.refresh_from_db()
+        self.assertEqual(self.leaf.path, f'/{self.other.pk}/{self.child.pk}/{self.leaf.pk}/')
+        self.assertEqual(self.leaf.depth, 2)
+        self.assertEqual(product.tree_path, self.leaf.path)
+        self.assertEqual(product.tree_root_id, self.other.pk)
+
+    def test_move_to_root(self):
+        self.child.parent = None
+        self.child.save()
+
+        self.leaf.refresh_from_db()
+        self.assertEqual(self.leaf.path, f'/{self.child.pk}/{self.leaf.pk}/')
+        self.assertEqual(self.leaf.depth, 1)
+
+    def test_in_category_tree(self):
+        own = create_product(self.child, 'Свой')
+        nested = create_product(self.leaf, 'Вложенный')
+        linked = create_product(self.other, 'По подкатегории', subcategory=self.leaf)
+        create_product(self.other, 'Чужой')
+
+        def titles(category):
+            category.refresh_from_db()
+            return set(Product.objects.in_category_tree(category)
+                       .values_list('title', flat=True))
+
+        self.assertEqual(titles(self.child), {own.title, nested.title})
+        self.assertEqual(titles(self.leaf), {nested.title})
+        self.assertNotIn(linked.title, titles(self.root))
+
+    def test_subcategory_delete_keeps_product_in_category(self):
+        product = create_product(self.root, 'Товар', subcategory=self.leaf)
+        self.assertEqual(product.tree_path, self.leaf.path)
+
+        self.leaf.delete()
+        product.refresh_from_db()
+        self.assertIsNone(product.subcategory_id)
+        self.assertEqual(product.tree_path, f'/{self.root.pk}/')
+
+
+class CategoryCounterTests(TestCase):
+    """Счетчики товаров категорий, поддерживаемые сигналами"""
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Корень', slug='root')
+        self.child = Category.objects.create(name='Раздел', slug='child', parent=self.root)
+        self.other = Category.objects.create(name='Другой', slug='other')
+
+    def assertCounters(self, category, total, active, in_stock, order, tree):
+        category.refresh_from_db()
+        self.assertEqual(
+            (category.products_count, category.active_products_count,
+             category.in_stock_products_count, category.order_products_count,
+             category.tree_products_count),
+            (total, active, in_stock, order, tree))
+
+    def test_save(self):
+        create_product(self.child, 'В наличии')
+        create_product(self.child, 'Под заказ', availability='order')
+        create_product(self.child, 'Скрытый', is_active=False)
+
+        self.assertCounters(self.child, 3, 2, 1, 1, 2)
+        self.assertCounters(self.root, 0, 0, 0, 0, 2)
+
+    def test_update_fields(self):
+        product = create_product(self.child, 'Товар')
+        product.is_active = False
+        product.save(update_fields=['is_active'])
+
+        self.assertCounters(self.child, 1, 0, 0, 0, 0)
+        self.assertCounters(self.root, 0, 0, 0, 0, 0)
+
+    def test_move_between_categories(self):
+        product = create_product(self.child, 'Товар')
+        product.category = self.other
+        product.save()
+
+        self.assertCounters(self.child, 0, 0, 0, 0, 0)
+        self.assertCounters(self.root, 0, 0, 0, 0, 0)
+        self.assertCounters(self.other, 1, 1, 1, 0, 1)
+
+    def test_subcategory_counts_in_tree(self):
+        product = create_product(self.root, 'Товар')
+        product.subcategory = self.child
+        product.save(update_fields=['subcategory'])
+
+        self.assertCounters(self.root, 1, 1, 1, 0, 1)
+        self.assertCounters(self.child, 0, 0, 0, 0, 1)
+
+    def test_delete(self):
+        product = create_product(self.child, 'Товар')
+        product.delete()
+
+        self.assertCounters(self.child, 0, 0, 0, 0, 0)
+        self.assertCounters(self.root, 0, 0, 0, 0, 0)
+
+    def test_category_move(self):
+        create_product(self.child, 'Товар')
+        self.child.parent = self.other
+        self.child.save()
+
+        self.assertCounters(self.root, 0, 0, 0, 0, 0)
+        self.assertCounters(self.other, 0, 0, 0, 0, 1)
+        self.assertCounters(self.child, 1, 1, 1, 0, 1)
+
+    def test_subcategory_deleted(self):
+        product = create_product(self.other, 'Товар', subcategory=self.child)
+        self.child.delete()
+
+        product.refresh_from_db()
+        self.assertEqual(product.tree_path, self.other.path)
+        self.assertCounters(self.root, 0, 0, 0, 0, 0)
+        self.assertCounters(self.other, 1, 1, 1, 0, 1)
+
+    def test_deferred(self):
+        with defer_catalog_updates():
+            first = create_product(self.child, 'Первый')
+            create_product(self.child, 'Второй')
+            first.category = self.other
+            first.save()
+            self.assertCounters(self.root, 0, 0, 0, 0, 0)
+
+        self.assertCounters(self.root, 0, 0, 0, 0, 1)
+        self.assertCounters(self.child, 1, 1, 1, 0, 1)
+        self.assertCounters(self.other, 1, 1, 1, 0, 1)
+
+    def test_only_affected_categories_updated(self):
+        # Счетчик вне путей товара не пересчитывается, его выправляет
+        # только полный пересчет
+        Category.objects.filter(pk=self.other.pk).update(tree_products_count=5)
+        create_product(self.child, 'Товар')
+        self.assertCounters(self.other, 0, 0, 0, 0, 5)
+
+        rebuild_all_counters()
+        self.assertCounters(self.other, 0, 0, 0, 0, 0)
+        self.assertCounters(self.root, 0, 0, 0, 0, 1)
+
+
+class KeysetPaginationTests(TestCase):
+    """Обход страниц по курсору совпадает с полной сортировкой"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Категория', slug='category')
+        created = timezone.now()
+        # Повторяющиеся значения во всех полях сортировки: порядок внутри
+        # группы определяет только id
+        for i in range(7):
+            product = create_product(
+                self.category, f'Товар {i % 3}',
+                availability='order' if i % 2 else 'in_stock')
+            Product.objects.filter(pk=product.pk).update(
+                created_at=created - timedelta(minutes=i % 2),
+                views_count=i % 3, trending_score=(i % 2) / 2)
+
+    def walk(self, sort, per_page):
+        ids, cursor = [], None
+        while True:
+            page = paginate_keyset(Product.objects.all(), sort, cursor, per_page)
+            ids.extend(product.pk for product in page)
+            if not page.has_next:
+                return ids
+            cursor = page.next_cursor
+
+    def test_round_trip(self):
+        for sort, ordering in SORT_MODES.items():
+            expected = list(Product.objects.order_by(*ordering).values_list('pk', flat=True))
+            for per_page in (1, 2, 3, 7):
+                with self.subTest(sort=sort, per_page=per_page):
+                    self.assertEqual(self.walk(sort, per_page), expected)
+
+    def test_unknown_sort_falls_back(self):
+        page = paginate_keyset(Product.objects.all(), 'nope', per_page=2)
+        self.assertEqual(page.sort, 'newest')
+
+    def test_invalid_cursor(self):
+        for cursor in ('not base64!', 'W10', 'WyJ4Il0'):
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                paginate_keyset(Product.objects.all(), 'newest', cursor)
+
+
+class ImportProcessorTests(TestCase):
+    """Пакетный импорт: создание, обновление, дубликаты, конфликты slug"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Категория', slug='category')
+
+    def run_import(self, rows, **kwargs):
+        file = ContentFile(json.dumps(rows).encode(), name='products.json')
+        processor = ImportProcessor(file, self.category.pk, **kwargs)
+        self.assertTrue(processor.process_file(), processor.errors)
+        return processor
+
+    def test_create(self):
+        processor = self.run_import([
+            {'title': 'Насос', 'article': 'NS-1', 'availability': 'под заказ'},
+            {'title': 'Клапан'},
+            {'title': ''},
+        ])
+        self.assertEqual((processor.imported_count, processor.skipped_count), (2, 1))
+        pump = Product.objects.get(title='Насос')
+        self.assertEqual((pump.slug, pump.availability), ('ns-1', 'order'))
+        self.assertEqual(pump.tree_path, self.category.path)
+        self.category.refresh_from_db()
+        self.assertEqual(
+            (self.category.products_count, self.category.tree_products_count), (2, 2))
+
+    def test_existing_skipped_without_update(self):
+        create_product(self.category, 'Насос', slug='pump')
+        processor = self.run_import([{'title': 'Насос', 'description': 'Новое'}])
+
+        self.assertEqual((processor.imported_count, processor.skipped_count), (0, 1))
+        self.assertEqual(Product.objects.get(slug='pump').description, 'Описание')
+
+    def test_update(self):
+        other = Category.objects.create(name='Другая', slug='other')
+        create_product(other, 'Насос', slug='pump')
+        processor = self.run_import(
+            [{'title': 'Насос', 'description': 'Новое'}], update_existing=True)
+
+        self.assertEqual((processor.imported_count, processor.updated_count), (0, 1))
+        product = Product.objects.get(slug='pump')
+        self.assertEqual((product.description, product.category_id),
+                         ('Новое', self.category.pk))
+        self.assertEqual(product.tree_path, self.category.path)
+        other.refresh_from_db()
+        self.assertEqual((other.products_count, other.tree_products_count), (0, 0))
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.tree_products_count, 1)
+
+    def test_repeated_row_in_batch(self):
+        processor = self.run_import([
+            {'title': 'Насос', 'description': 'Первое'},
+            {'title': 'Насос', 'description': 'Второе'},
+        ], update_existing=True)
+
+        self.assertEqual((processor.imported_count, processor.updated_count), (1, 1))
+        self.assertEqual(Product.objects.get(title='Насос').description, 'Второе')
+
+    def test_duplicate_titles_in_db(self):
+        create_product(self.category, 'Насос', slug='pump-1')
+        create_product(self.category, 'Насос', slug='pump-2')
+        processor = self.run_import([{'title': 'Насос'}], update_existing=True)
+
+        self.assertEqual(processor.updated_count, 0)
+        self.assertIn('Найдено несколько товаров', processor.errors[0])
+
+    def test_slug_taken(self):
+        create_product(self.category, 'Другой товар', slug='ns-1')
+        self.run_import([{'title': 'Насос', 'article': 'NS-1'},
+                         {'title': 'Клапан', 'article': 'NS-1'}])
+
+        self.assertEqual(Product.objects.get(title='Насос').slug, 'ns-1-1')
+        self.assertEqual(Product.objects.get(title='Клапан').slug, 'ns-1-2')
+
+    def test_slug_taken_concurrently(self):
+        create_product(self.category, 'Другой товар', slug='ns-1')
+        # Занятые slug не загружены: так выглядит slug, который успел
+        # занять параллельный импорт
+        with mock.patch.object(SlugAllocator, 'load'):
+            processor = self.run_import([{'title': 'Насос', 'article': 'NS-1'}])
+
+        self.assertEqual((processor.imported_count, processor.errors), (1, []))
+        self.assertEqual(Product.objects.get(title='Насос').slug, 'ns-1-1')
+
+
+class ImportJobQueueTests(TestCase):
+    """Очередь заданий импорта"""
+
+    def create_job(self, status=ImportJob.STATUS_PENDING, minutes_ago=0):
+        category = Category.objects.create(
+            name='Категория', slug=f'category-{Category.objects.count()}')
+        job = ImportJob.objects.create(file='imports/products.csv',
+                                       category=category, status=status)
+        ImportJob.objects.filter(pk=job.pk).update(
+            created_at=timezone.now() - timedelta(minutes=minutes_ago))
+        return job
+
+    def test_claim_oldest_first(self):
+        newer = self.create_job(minutes_ago=1)
+        older = self.create_job(minutes_ago=2)
+        self.create_job(status=ImportJob.STATUS_DONE, minutes_ago=3)
+
+        job = claim_next_job()
+        self.assertEqual(job.pk, older.pk)
+        self.assertEqual(job.status, ImportJob.STATUS_RUNNING)
+        self.assertIsNotNone(job.started_at)
+        self.assertEqual(claim_next_job().pk, newer.pk)
+        self.assertIsNone(claim_next_job())
+
+    def test_cancel_pending(self):
+        job = self.create_job()
+
+        self.assertTrue(cancel_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_CANCELLED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(claim_next_job())
+
+    def test_cancel_running(self):
+        job = self.create_job(status=ImportJob.STATUS_RUNNING)
+
+        self.assertTrue(cancel_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_RUNNING)
+        self.assertTrue(job.cancel_requested)
+
+    def test_cancel_finished(self):
+        job = self.create_job(status=ImportJob.STATUS_DONE)
+
+        self.assertFalse(cancel_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_DONE)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'fragment-tests'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+              'LOCATION': 'fragment-tests-state'},
+})
+class FragmentCacheTests(TestCase):
+    """Кэш HTML-карточек товаров"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Категория', slug='category')
+        self.product = create_product(self.category, 'Микрофон')
+
+    def render(self, products):
+        with mock.patch('apps.catalog.fragments.render_to_string',
+                        wraps=fragments.render_to_string) as render:
+            html = fragments.render_product_cards(products)
+        return html, render.call_count
+
+    def test_card_rendered_once(self):
+        self.assertEqual(self.render([self.product])[1], 1)
+        html, rendered = self.render([self.product])
+        self.assertEqual(rendered, 0)
+        self.assertIn('Микрофон', html)
+
+    def test_saved_product_rerendered(self):
+        self.render([self.product])
+        self.product.title = 'Радиомикрофон'
+        self.product.save()
+
+        html, rendered = self.render([self.product])
+        self.assertEqual(rendered, 1)
+        self.assertIn('Радиомикрофон', html)
+
+    def test_views_count_filled_in(self):
+        self.render([self.product])
+        Product.objects.filter(pk=self.product.pk).update(views_count=42)
+        self.product.refresh_from_db()
+
+        html, rendered = self.render([self.product])
+        self.assertEqual(rendered, 0)
+        self.assertIn('42', html)
+        self.assertNotIn(fragments.VIEWS_PLACEHOLDER, html)
+
+    def test_home_and_product_pages_use_cards(self):
+        other = create_product(self.category, 'Пульт')
+        Product.objects.filter(pk=other.pk).update(weekly_views=3)
+
+        with mock.patch('apps.catalog.templatetags.catalog_fragments.render_product_cards',
+                        wraps=fragments.render_product_cards) as render:
+            self.assertEqual(self.client.get('/').status_code, 200)
+            # Популярное и новинки
+            self.assertEqual(render.call_count, 2)
+            response = self.client.get(self.product.get_absolute_url())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(render.call_count, 3)
+        self.assertContains(response, other.get_absolute_url())
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                'LOCATION': 'django_cache', 'OPTIONS': {'MAX_ENTRIES': 20}},
+    'state': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+              'LOCATION': 'django_cache_state', 'TIMEOUT': None},
+})
+class CatalogVersionTests(TestCase):
+    """Версия каталога не вытесняется из переполненного кэша"""
+
+    def test_version_survives_cull(self):
+        version = bump_catalog_version()
+        for i in range(100):
+            cache.set(f'page:{i}', i)
+
+        self.assertLess(len(cache.get_many(f'page:{i}' for i in range(100))), 100)
+        self.assertEqual(get_catalog_version(), version)
+
+
+class AutocompleteTests(TestCase):
+    """Подсказки по началу слова из индекса в памяти"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Микрофоны', slug='mics')
+        self.popular = create_product(
+            self.category, 'Shure Beta', article='SM58-LCE', views_count=10)
+        self.title_match = create_product(self.category, 'Микшер', views_count=1)
+        self.hidden = create_product(self.category, 'Микрофон скрытый', is_active=False)
+        self.index = autocomplete.AutocompleteIndex.build('v1')
+        patcher = mock.patch.object(autocomplete, 'get_index', return_value=self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compact_entries(self):
+        self.assertEqual(
+            self.index.entries[0],
+            (self.popular.pk, 'Shure Beta', self.popular.slug, 'SM58-LCE'))
+        self.assertEqual(len(self.index.entries), 2)
+
+    def test_title_match_before_category(self):
+        # "мик" - начало названия "Микшер" и категории обоих товаров
+        ids = [entry['id'] for entry in autocomplete.suggest('мик')]
+        self.assertEqual(ids, [self.title_match.pk, self.popular.pk])
+
+    def test_article_without_separators(self):
+        suggestions = autocomplete.suggest('sm58l')
+        self.assertEqual(len(suggestions), 1)
+        self.assertEqual(suggestions[0], {
+            'id': self.popular.pk,
+            'title': 'Shure Beta',
+            'url': self.popular.get_absolute_url(),
+            'category': 'Микрофоны',
+            'article': 'SM58-LCE',
+            'description': 'Описание',
+            'image': None,
+        })
+
+    def test_hidden_after_build_skipped(self):
+        Product.objects.filter(pk=self.title_match.pk).update(is_active=False)
+        ids = [entry['id'] for entry in autocomplete.suggest('мик')]
+        self.assertEqual(ids, [self.popular.pk])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(autocomplete.suggest('shure мик')[0]['id'], self.popular.pk)
+        self.assertEqual(autocomplete.suggest('shure кабель'), [])
+
+
+class CatalogSnapshotTests(TestCase):
+    """Снимок каталога: дерево и первые страницы категорий"""
+
+    def setUp(self):
+        self.root = Category.objects.create(name='Корень', slug='root')
+        self.child = Category.objects.create(name='Раздел', slug='child', parent=self.root)
+        self.empty = Category.objects.create(name='Пустая', slug='empty')
+        self.products = [create_product(self.child, f'Товар {i}')
+                         for i in range(PAGE_SIZE + 2)]
+        create_product(self.child, 'Скрытый', is_active=False)
+
+    def build(self):
+        for category in (self.root, self.child):
+            category.refresh_from_db()
+        return CatalogSnapshot.build('v1')
+
+    def test_first_page_matches_listing(self):
+        snapshot = self.build()
+        page = snapshot.first_page(snapshot.category_by_slug('root'))
+        expected = paginate_keyset(
+            Product.objects.active().in_category_tree(self.root), 'newest')
+
+        self.assertEqual([card.id for card in page.object_list],
+                         [product.id for product in expected.object_list])
+        self.assertEqual(page.next_cursor, expected.next_cursor)
+        self.assertEqual(snapshot.first_page(snapshot.category_by_slug('empty')).object_list, [])
+
+    def test_only_first_pages_stored(self):
+        snapshot = self.build()
+        # Корень и раздел показывают одни и те же карточки
+        self.assertEqual(len(snapshot.products), PAGE_SIZE + 1)
+        self.assertIsNotNone(snapshot.product_by_slug(self.products[-1].slug))
+        self.assertIsNone(snapshot.product_by_slug(self.products[0].slug))
+        self.assertEqual(snapshot.products_count, PAGE_SIZE + 2)
+
+    def test_tree(self):
+        snapshot = self.build()
+        child = snapshot.category_by_slug('child')
+
+        self.assertEqual([node.slug for node in snapshot.root_categories()], ['root', 'empty'])
+        self.assertEqual([node.slug for node in snapshot.ancestors(child)], ['root'])
+        self.assertEqual(snapshot.children(snapshot.category_by_slug('root')), [child])
+
+
+class SearchTests(TestCase):
+    """Ранжированный поиск товаров (search.search_products)"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Видеотехника', slug='video')
+        self.projector = create_product(self.category, 'Проектор Epson', article='EB-X06')
+        self.screen = create_product(
+            self.category, 'Экран', description='Экран для проектора', views_count=100)
+
+    def search(self, query):
+        return [product.id for product in search.search_products(query)]
+
+    def skip_without_trigram(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest('нет расширения pg_trgm')
+
+    def test_title_ranked_above_description(self):
+        # Популярность только после релевантности
+        self.assertEqual(self.search('проектор'), [self.projector.pk, self.screen.pk])
+
+    def test_word_prefix(self):
+        self.assertEqual(self.search('прое eps'), [self.projector.pk])
+
+    def test_category_name(self):
+        self.assertCountEqual(self.search('видеотехника'),
+                              [self.projector.pk, self.screen.pk])
+
+    def test_inactive_excluded(self):
+        hidden = create_product(self.category, 'Проектор скрытый', is_active=False)
+        self.assertNotIn(hidden.pk, self.search('проектор'))
+
+    def test_article_similarity_fallback(self):
+        self.skip_without_trigram()
+        self.assertEqual(self.search('EB-X60'), [self.projector.pk])
+
+
+class SearchKeyTests(TestCase):
+    """Нормализованный ключ поиска: раскладка и транслитерация"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Микрофоны', slug='mics')
+        self.product = create_product(self.category, 'Микрофон Shure', article='SM58-LCE')
+
+    def test_normalize(self):
+        self.assertEqual(normalize_search_text('Микрофон  SHURE_Beta-58!'),
+                         'mikrofon shure beta 58')
+        self.assertEqual(build_search_key('Проектор', 'EB-X06', 'Видео'),
+                         ' proektor eb x06 ebx06 video ')
+
+    def test_saved_with_product(self):
+        self.assertEqual(self.product.search_key,
+                         ' mikrofon shure sm58 lce sm58lce mikrofony ')
+
+    def test_other_layout_and_mixed_query(self):
+        for query in ('mikrofon', 'микрофон shure', 'sm58lce'):
+            with self.subTest(query):
+                self.assertEqual([product.id for product in search.search_products(query)],
+                                 [self.product.pk])
+
+    def test_category_rename(self):
+        self.category.name = 'Радиосистемы'
+        self.category.save()
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.search_key.endswith(' radiosistemy '))
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'search-cache-tests'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+              'LOCATION': 'search-cache-tests-state'},
+})
+class SearchCacheTests(TestCase):
+    """Ответ поиска общий для всех воркеров, пока не изменился каталог"""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Видеотехника', slug='video')
+        self.product = create_product(category, 'Проектор Epson')
+        patcher = mock.patch.object(search, 'search_products', wraps=search.search_products)
+        self.search = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, query):
+        response = self.client.get(reverse('catalog:search_products'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.json()['products']]
+
+    def test_cached_case_insensitive(self):
+        self.assertEqual(self.get('проектор'), [self.product.pk])
+        self.assertEqual(self.get('  ПРОЕКТОР '), [self.product.pk])
+        self.assertEqual(self.search.call_count, 1)
+
+    def test_recomputed_after_catalog_change(self):
+        self.get('проектор')
+        bump_catalog_version()
+        self.get('проектор')
+        self.assertEqual(self.search.call_count, 2)
+
+
+class ViewTrackingTests(TestCase):
+    """Буфер просмотров товаров и его запись в БД"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        self.first = create_product(category, 'Первый')
+        self.second = create_product(category, 'Второй')
+        # Фоновый поток записи не запускается, буфер у теста свой
+        patcher = mock.patch.object(tracking, '_start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tracking._pending.clear()
+        self.addCleanup(tracking._pending.clear)
+        tracking._last_flush = time.monotonic()
+
+    def views(self):
+        today = timezone.localdate()
+        return {product.pk: (product.views_count,
+                             ProductDailyViews.objects.filter(product=product, date=today)
+                             .values_list('views', flat=True).first())
+                for product in Product.objects.filter(pk__in=[self.first.pk, self.second.pk])}
+
+    def test_buffered_until_flush(self):
+        for product in (self.first, self.first, self.first, self.second):
+            tracking.record_view(product.pk)
+        self.assertEqual(self.views(), {self.first.pk: (0, None), self.second.pk: (0, None)})
+
+        tracking.flush_views()
+        self.assertEqual(self.views(), {self.first.pk: (3, 3), self.second.pk: (1, 1)})
+        tracking.record_view(self.first.pk)
+        tracking.flush_views()
+        self.assertEqual(self.views()[self.first.pk], (4, 4))
+
+    def test_flush_when_buffer_full(self):
+        with mock.patch.object(tracking, 'MAX_PENDING', 2):
+            tracking.record_view(self.first.pk)
+            tracking.record_view(self.second.pk)
+        self.assertEqual(self.views(), {self.first.pk: (1, 1), self.second.pk: (1, 1)})
+
+    def test_failed_flush_kept_in_buffer(self):
+        tracking.record_view(self.first.pk)
+        with mock.patch.object(tracking, '_add_daily_views', side_effect=RuntimeError), \
+                self.assertLogs(tracking.logger, 'ERROR'):
+            tracking.flush_views()
+        self.assertEqual(self.views()[self.first.pk], (0, None))
+
+        tracking.flush_views()
+        self.assertEqual(self.views()[self.first.pk], (1, 1))
+
+    def test_deleted_product_skipped(self):
+        tracking.record_view(self.first.pk)
+        tracking.record_view(self.second.pk)
+        self.second.delete()
+        tracking.flush_views()
+        self.assertEqual(self.views(), {self.first.pk: (1, 1)})
+
+    def test_static_page_view_endpoint(self):
+        url = reverse('catalog:track_product_view', kwargs={'slug': self.first.slug})
+        self.assertEqual(self.client.post(url).status_code, 204)
+        self.assertEqual(tracking._pending[self.first.pk], 1)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+
+class ProductRankingTests(TestCase):
+    """Рейтинги по дневной статистике просмотров"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Категория', slug='category')
+        self.product = create_product(category, 'Товар')
+        self.forgotten = create_product(category, 'Забытый')
+        Product.objects.filter(pk=self.forgotten.pk).update(weekly_views=5, trending_score=1)
+        self.today = timezone.localdate()
+
+    def add_views(self, product, days_ago, views):
+        ProductDailyViews.objects.create(
+            product=product, date=self.today - timedelta(days=days_ago), views=views)
+
+    def test_weekly_and_trending(self):
+        self.add_views(self.product, 0, 4)
+        # Вес дня вдвое меньше каждые TRENDING_HALF_LIFE дней
+        self.add_views(self.product, rankings.TRENDING_HALF_LIFE, 8)
+        # Вне недели, но внутри окна роста: 16 * 0.5 ** 5
+        self.add_views(self.product, 10, 16)
+        self.add_views(self.product, rankings.TRENDING_WINDOW_DAYS, 100)
+
+        self.assertEqual(rankings.update_product_rankings(self.today), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.weekly_views, 12)
+        self.assertAlmostEqual(self.product.trending_score, 8.5)
+
+    def test_rankings_reset_without_views(self):
+        rankings.update_product_rankings(self.today)
+        self.forgotten.refresh_from_db()
+        self.assertEqual((self.forgotten.weekly_views, self.forgotten.trending_score), (0, 0))
+        # Без изменений строки не переписываются
+        self.assertEqual(rankings.update_product_rankings(self.today), 0)
+
+    def test_old_stats_deleted(self):
+        self.add_views(self.product, rankings.RETENTION_DAYS, 1)
+        self.add_views(self.product, rankings.RETENTION_DAYS - 1, 1)
+        rankings.update_product_rankings(self.today)
+        self.assertEqual(ProductDailyViews.objects.count(), 1)
+
+
+class SimilarProductsTests(TestCase):
+    """Заранее посчитанная таблица похожих товаров"""
+
+    def setUp(self):
+        root = Category.objects.create(name='Звук', slug='sound')
+        self.mics = Category.objects.create(name='Микрофоны', slug='mics', parent=root)
+        self.stands = Category.objects.create(name='Стойки', slug='stands', parent=root)
+        other_root = Category.objects.create(name='Свет', slug='light')
+        self.sm58 = create_product(self.mics, 'Микрофон Shure SM58')
+        self.beta = create_product(self.mics, 'Микрофон Shure Beta')
+        self.stand = create_product(self.stands, 'Стойка для микрофон Shure')
+        self.cable = create_product(self.mics, 'Кабель XLR')
+        self.lamp = create_product(other_root, 'Микрофон Shure SM58 подсветка')
+
+    def similar(self, product):
+        return list(SimilarProduct.objects.filter(product=product)
+                    .order_by('-score').values_list('similar_id', flat=True))
+
+    def test_full_rebuild(self):
+        self.assertEqual(similarity.update_similar_products(), 5)
+        # Название и категория важнее соседней категории; другой корневой
+        # раздел не рассматривается
+        self.assertEqual(self.similar(self.sm58),
+                         [self.beta.pk, self.stand.pk, self.cable.pk])
+
+    def test_incremental_update(self):
+        similarity.update_similar_products()
+        Product.objects.filter(pk=self.cable.pk).update(title='Микрофон Shure SM58 Pro')
+
+        with mock.patch.object(similarity, 'similar_products_changed') as changed:
+            similarity.update_similar_products([self.cable.pk])
+        self.assertEqual(self.similar(self.sm58)[0], self.cable.pk)
+        self.assertIn(self.sm58.pk, changed.call_args.args[0])
+
+    def test_unchanged_lists_not_reported(self):
+        similarity.update_similar_products()
+        with mock.patch.object(similarity, 'similar_products_changed') as changed:
+            similarity.update_similar_products()
+        changed.assert_not_called()
+
+    def test_hidden_product_dropped(self):
+        similarity.update_similar_products()
+        self.beta.is_active = False
+        self.beta.save()
+        similarity.update_similar_products([self.beta.pk])
+
+        self.assertNotIn(self.beta.pk, self.similar(self.sm58))
+        self.assertEqual(self.similar(self.beta), [])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'featured-tests'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+              'LOCATION': 'featured-tests-state'},
+})
+class FeaturedProductsTests(TestCase):
+    """Пулы популярных товаров корневых разделов для главной"""
+
+    def setUp(self):
+        cache.clear()
+        self.root = Category.objects.create(name='Звук', slug='sound')
+        child = Category.objects.create(name='Микрофоны', slug='mics', parent=self.root)
+        self.empty = Category.objects.create(name='Пустой', slug='empty')
+        self.weekly = create_product(child, 'За неделю', weekly_views=5)
+        self.popular = create_product(self.root, 'За все время', views_count=100)
+        create_product(self.root, 'Обычный')
+        create_product(child, 'Скрытый', weekly_views=50, is_active=False)
+
+    def test_pool_per_root(self):
+        with mock.patch.object(featured, 'POOL_SIZE', 2):
+            pools = featured.get_featured_pools()
+        # Порядок внутри пула не важен: из него берется случайная выборка
+        self.assertEqual(list(pools), [self.root.pk])
+        self.assertCountEqual(pools[self.root.pk], [self.weekly.pk, self.popular.pk])
+
+    def test_pool_cached_until_catalog_change(self):
+        featured.get_featured_pools()
+        with self.assertNumQueries(0):
+            featured.get_featured_pools()
+        bump_catalog_version()
+        with self.assertNumQueries(1):
+            featured.get_featured_pools()
+
+    def test_attach(self):
+        categories = featured.attach_featured_products([self.root, self.empty], count=2)
+
+        picked = categories[0].featured_products
+        self.assertEqual(len(picked), 2)
+        self.assertTrue(all(product.is_active for product in picked))
+        self.assertEqual(categories[1].featured_products, [])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'conditional-tests'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+              'LOCATION': 'conditional-tests-state'},
+})
+class ConditionalGetTests(TestCase):
+    """Ответ 304 по ETag / Last-Modified без рендеринга страницы"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.category = Category.objects.create(name='Категория', slug='category')
+        self.product = create_product(self.category, 'Товар')
+        self.snapshot = CatalogSnapshot.build(get_catalog_version())
+        for target in (views, conditional):
+            patcher = mock.patch.object(target, 'get_snapshot', return_value=self.snapshot)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(tracking, 'record_view')
+        self.record_view = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, view, path='/', headers=None, **kwargs):
+        request = self.factory.get(path, headers=headers)
+        request.user = AnonymousUser()
+        return view(request, **kwargs)
+
+    def get_product(self, headers=None):
+        return self.get(views.ProductDetailView.as_view(), headers=headers,
+                        slug=self.product.slug)
+
+    def test_product_not_modified(self):
+        etag = self.get_product()['ETag']
+        response = self.get_product({'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+        # Просмотр учитывается и без тела ответа
+        self.assertEqual(self.record_view.call_count, 2)
+
+    def test_product_changed(self):
+        etag = self.get_product()['ETag']
+        self.product.title = 'Новое название'
+        self.product.save()
+        self.assertEqual(self.get_product({'If-None-Match': etag}).status_code, 200)
+
+    def test_category_if_modified_since(self):
+        view = views.CategoryDetailView.as_view()
+        last_modified = self.get(view, slug='category')['Last-Modified']
+        response = self.get(view, headers={'If-Modified-Since': last_modified},
+                            slug='category')
+        self.assertEqual(response.status_code, 304)
+
+    def test_search_not_modified(self):
+        response = self.get(views.search_products, '/?q=товар')
+        self.assertEqual(response.status_code, 200)
+        response = self.get(views.search_products, '/?q=ТОВАР',
+                            headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+
+class CsvImportTests(TestCase):
+    """Потоковый импорт CSV: кодировки и чтение файла по пакетам"""
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Категория', slug='category')
+
+    def csv_file(self, rows, encoding='utf-8', bom=b''):
+        lines = ['title,article,description'] + [','.join(row) for row in rows]
+        return ContentFile(bom + '\r\n'.join(lines).encode(encoding), name='products.csv')
+
+    def run_import(self, file):
+        processor = ImportProcessor(file, self.category.pk)
+        self.assertTrue(processor.process_file(), processor.errors)
+        return processor
+
+    def test_encodings(self):
+        cases = {
+            'utf-8 bom': ('utf-8', codecs.BOM_UTF8),
+            'utf-16': ('utf-16', b''),
+            'cp1251': ('cp1251', b''),
+            'utf-8': ('utf-8', b''),
+        }
+        for name, (encoding, bom) in cases.items():
+            with self.subTest(name):
+                title = f'Насос {name}'
+                self.run_import(self.csv_file([(title, 'NS', 'Описание')], encoding, bom))
+                # Заголовок первой колонки без BOM: название прочитано
+                self.assertTrue(Product.objects.filter(title=title).exists())
+
+    def test_detect_encoding(self):
+        text = 'Насос'.encode()
+        # Символ, обрезанный на границе выборки, не делает файл cp1251
+        self.assertEqual(detect_csv_encoding(text[:-1]), 'utf-8')
+        self.assertEqual(detect_csv_encoding('Насос'.encode('cp1251')), 'cp1251')
+        self.assertEqual(detect_csv_encoding(codecs.BOM_UTF32_LE + b'x'), 'utf-32')
+
+    def test_read_in_batches(self):
+        # Длинные строки: файл заметно больше буфера чтения
+        rows = [(f'Товар {i}', f'A{i}', 'x' * 20000) for i in range(5)]
+        file = self.csv_file(rows)
+        offsets = []
+        process_batch = ImportProcessor._process_batch
+
+        def record_offset(processor, batch):
+            offsets.append((len(batch), file.tell()))
+            return process_batch(processor, batch)
+
+        with mock.patch.object(utils, 'IMPORT_BATCH_SIZE', 2), \
+                mock.patch.object(ImportProcessor, '_process_batch', record_offset):
+            processor = self.run_import(file)
+
+        self.assertEqual([size for size, _ in offsets], [2, 2, 1])
+        # Первый пакет разобран, когда файл прочитан не до конца
+        self.assertLess(offsets[0][1], file.size)
+        self.assertEqual((processor.imported_count, processor.total_rows), (5, 5))
+        # Файл остается открытым для вызывающего кода
+        self.assertFalse(file.closed)
@@ -0,0 +1,48 @@
+import re
+
+# Таблица транслитерации русских символов (используется для slug и поиска)
+TRANSLIT_TABLE = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+}
+
+_TRANSLIT = str.maketrans(TRANSLIT_TABLE)
+
+
+def transliterate(text):
+    """Транслитерация кириллицы в латиницу (регистр не меняется)"""
+    return text.translate(_TRANSLIT)
+
+
+def normalize_search_text(text):
+    """
+    Нормализованная форма текста для поиска: нижний регистр, латиница,
+    только буквы и цифры, слова через один пробел.
+
+    И текст товара, и запрос приводятся к одной (латинской) записи, поэтому
+    "проектор", "proektor" и "микрофон shure" совпадают независимо от того,
+    на какой раскладке их набрали.
+    """
+    text = transliterate(str(text).lower())
+    return ' '.join(re.findall(r'[^\W_]+', text))
+
+
+def build_search_key(title, article='', category_name=''):
+    """
+    Ключ поиска товара: нормализованные слова названия, артикула и категории
+    плюс артикул целиком без разделителей ("SM58-LCE" -> "sm58lce").
+
+    Слова обрамлены пробелами, чтобы условие contains(' ' + слово)
+    означало совпадение с началом слова.
+    """
+    parts = [normalize_search_text(title)]
+    if article:
+        normalized_article = normalize_search_text(article)
+        parts.append(normalized_article)
+        parts.append(normalized_article.replace(' ', ''))
+    if category_name:
+        parts.append(normalize_search_text(category_name))
+    return f" {' '.join(part for part in parts if part)} "
@@ -0,0 +1,134 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Product, ProductDailyViews
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в секундах) накопленные просмотры записываются в БД
+FLUSH_INTERVAL = 10
+
+# Сколько разных товаров можно накопить до досрочной записи
+MAX_PENDING = 500
+
+DAILY_VIEWS_TABLE = ProductDailyViews._meta.db_table
+PRODUCT_TABLE = Product._meta.db_table
+
+_pending = Counter()
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+# Процесс, в котором запущен поток записи (после fork его нет)
+_flusher_pid = None
+
+
+def record_view(product_id):
+    """
+    Учитывает просмотр товара в буфере процесса.
+
+    Просмотры не пишутся в БД на каждый запрос: раз в FLUSH_INTERVAL
+    секунд они сбрасываются пачкой атомарных UPDATE, см. flush_views.
+    Запись делает очередной просмотр, а если их больше нет - фоновый
+    поток процесса, поэтому тихий воркер тоже не держит счетчики у себя.
+    """
+    _start_flusher()
+    with _lock:
+        _pending[product_id] += 1
+        due = (len(_pending) >= MAX_PENDING
+               or time.monotonic() - _last_flush >= FLUSH_INTERVAL)
+    if due:
+        flush_views()
+
+
+def flush_views():
+    """
+    Записывает накопленные просмотры в БД.
+
+    Товары группируются по числу просмотров: на каждую группу один
+    UPDATE ... SET views_count = views_count + n, без чтения строки
+    и без гонок между воркерами. Те же просмотры добавляются к дневной
+    статистике ProductDailyViews.
+    """
+    global _last_flush
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+
+    by_count = defaultdict(list)
+    for product_id, count in pending.items():
+        by_count[count].append(product_id)
+
+    try:
+        # Счетчики и дневная статистика пишутся вместе: при повторе
+        # после ошибки просмотры не задвоятся ни там, ни там
+        with transaction.atomic():
+            _add_daily_views(pending)
+            for count in sorted(by_count):
+                # Одинаковый порядок блокировок строк во всех воркерах
+                Product.objects.filter(pk__in=sorted(by_count[count])).update(
+                    views_count=F('views_count') + count)
+    except Exception:
+        logger.exception("Failed to flush product views")
+        # Незаписанные просмотры возвращаются в буфер до следующей попытки
+        with _lock:
+            _pending.update(pending)
+
+
+def _start_flusher():
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_periodically, name='views-flusher',
+                     daemon=True).start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        if _pending and time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+            try:
+                flush_views()
+            finally:
+                # Соединение потока не закрывает обработка запроса
+                connection.close()
+
+
+def _add_daily_views(pending):
+    """
+    Добавляет просмотры к дневной статистике одним INSERT ... ON CONFLICT.
+
+    Товары, удаленные после просмотра, пропускаются.
+    """
+    product_ids = sorted(pending)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {DAILY_VIEWS_TABLE} (product_id, date, views)
+            SELECT v.product_id, %s, v.views
+            FROM unnest(%s::bigint[], %s::integer[]) AS v(product_id, views)
+            WHERE EXISTS (
+                SELECT 1 FROM {PRODUCT_TABLE} p WHERE p.id = v.product_id)
+            ON CONFLICT (product_id, date)
+            DO UPDATE SET views = {DAILY_VIEWS_TABLE}.views + EXCLUDED.views
+            """,
+            [timezone.localdate(), product_ids,
+             [pending[product_id] for product_id in product_ids]],
+        )
+
+
+# Остаток буфера записывается при остановке процесса
+atexit.register(flush_views)
@@ -1,6 +1,8 @@
 from django.urls import path, re_path
 from . import views
-from .admin_views import import_products, import_preview, download_import_template
+from .admin_views import (
+    download_import_template, import_job_status, import_preview,
+    import_products)
 
 app_name = 'catalog'
 
@@ -8,8 +10,12 @@ urlpatterns = [
     path('', views.CategoryListView.as_view(), name='category_list'),
     re_path(r'^category/(?P<slug>[-a-zA-Z0-9_а-яёА-ЯЁ]+)/$',
             views.CategoryDetailView.as_view(), name='category'),
+    re_path(r'^category/(?P<slug>[-a-zA-Z0-9_а-яёА-ЯЁ]+)/products/$',
+            views.category_products, name='category_products'),
     re_path(r'^product/(?P<slug>[-a-zA-Z0-9_а-яёА-ЯЁ]+)/$',
             views.ProductDetailView.as_view(), name='product'),
+    re_path(r'^product/(?P<slug>[-a-zA-Z0-9_а-яёА-ЯЁ]+)/view/$',
+            views.track_product_view, name='track_product_view'),
     path('api/search/', views.search_products, name='search_products'),
 
     # Import URLs
@@ -17,6 +23,6 @@ urlpatterns = [
     path('import/preview/', import_preview, name='import_preview'),
     path('import/template/', download_import_template,
          name='download_import_template'),
-    path('import/progress/', views.import_progress, name='import_progress'),
+    path('import/jobs/<int:pk>/', import_job_status, name='import_job_status'),
     path('import/cancel/', views.cancel_import, name='cancel_import'),
 ]
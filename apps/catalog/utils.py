@@ -1,3 +1,4 @@
+import codecs
 import csv
 import json
 import pandas as pd
@@ -5,11 +6,19 @@ import re
 import requests
 import io
 import os
-from io import BytesIO, StringIO
+import time
+from io import BytesIO, TextIOWrapper
+from itertools import islice
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from django.utils.text import slugify
 from urllib.parse import urlparse
 from .models import Product, Category, ProductImage
+from .signals import defer_catalog_updates, products_bulk_saved
+from .similarity import update_similar_products
+from .slugs import SlugAllocator
+from .text import transliterate
 
 # Создаем сессию для повторного использования TCP-соединений
 SESSION = requests.Session()
@@ -22,14 +31,44 @@ adapter = requests.adapters.HTTPAdapter(
 SESSION.mount('http://', adapter)
 SESSION.mount('https://', adapter)
 
-
-# Глобальная переменная для хранения прогресса импорта
-IMPORT_PROGRESS = {
-    'processed': 0,
-    'total': 0,
-    'percentage': 0,
-    'cancelled': False
-}
+# Сколько строк импорта разбирается и записывается за одну транзакцию
+IMPORT_BATCH_SIZE = 500
+
+# Сколько раз повторить запись пакета, если его slug заняли параллельно
+SLUG_CONFLICT_RETRIES = 3
+
+# Кодировка CSV без BOM определяется по началу файла; не UTF-8 -
+# значит, файл сохранен Excel в Windows
+CSV_ENCODING_SAMPLE = 64 * 1024
+CSV_FALLBACK_ENCODING = 'cp1251'
+
+# UTF-32 проверяется раньше UTF-16: BOM UTF-32 LE начинается с BOM UTF-16 LE
+CSV_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def detect_csv_encoding(head):
+    """Кодировка CSV по BOM или по первым байтам файла"""
+    for bom, encoding in CSV_BOMS:
+        if head.startswith(bom):
+            return encoding
+    try:
+        # Инкрементальный декодер не спотыкается о символ, обрезанный
+        # на границе выборки
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return CSV_FALLBACK_ENCODING
+
+# Поля, которые импорт меняет у существующего товара
+IMPORT_UPDATE_FIELDS = ['article', 'description', 'details', 'category',
+                        'availability', 'is_active', 'preview_image',
+                        'search_key', 'tree_path', 'tree_root', 'updated_at']
 
 
 class ImportProcessor:
@@ -46,54 +85,104 @@ class ImportProcessor:
         self.total_rows = 0
         self.processed_rows = 0
         self.downloaded_images = 0
-        self.total_images = 0
         self.progress_callback = None
-
-        # Сброс прогресса при начале нового импорта
-        global IMPORT_PROGRESS
-        IMPORT_PROGRESS = {
-            'processed': 0,
-            'total': 0,
-            'percentage': 0,
-            'cancelled': False
-        }
+        # Этап импорта (ImportJob.STAGE_CHOICES) и признак отмены
+        self.stage = ''
+        self.cancelled = False
+        # Созданные и обновленные товары: для них пересчитываются похожие
+        self.changed_product_ids = set()
+        # Скорость обработки строк, считается по завершении импорта
+        self.rows_per_second = 0
+        # Категории по ID и по названию, загружаются один раз на импорт
+        self._category = None
+        self._categories_by_name = None
+        # Slug новых товаров выдаются в памяти, см. SlugAllocator
+        self._slugs = SlugAllocator(Product)
 
     def set_progress_callback(self, callback):
-        """Установка callback функции для отслеживания прогресса"""
+        """
+        Установка callback функции для отслеживания прогресса:
+        callback(processed, total, stage) возвращает True, если импорт
+        нужно прервать.
+        """
         self.progress_callback = callback
 
+    def _report_progress(self):
+        """Сообщает прогресс и узнает, не отменен ли импорт"""
+        if self.progress_callback and self.progress_callback(
+                self.processed_rows, self.total_rows, self.stage):
+            self.cancelled = True
+        return self.cancelled
+
+    def _set_stage(self, stage):
+        self.stage = stage
+        self._report_progress()
+
     def process_file(self):
         """Определяет формат файла и запускает соответствующий обработчик"""
         file_extension = self.file.name.split('.')[-1].lower()
 
-        if file_extension == 'csv':
-            return self._process_csv()
-        elif file_extension in ['xlsx', 'xls']:
-            return self._process_excel()
-        elif file_extension == 'json':
-            return self._process_json()
-        else:
-            self.errors.append(
-                f"Неподдерживаемый формат файла: {file_extension}")
-            return False
+        # Счетчики категорий пересчитываются один раз после всего импорта
+        with defer_catalog_updates():
+            self._set_stage('reading')
+            if file_extension == 'csv':
+                result = self._process_csv()
+            elif file_extension in ['xlsx', 'xls']:
+                result = self._process_excel()
+            elif file_extension == 'json':
+                result = self._process_json()
+            else:
+                self.errors.append(
+                    f"Неподдерживаемый формат файла: {file_extension}")
+                return False
+
+            # Внутри блока: версия каталога сменится уже после пересчета,
+            # и кэш страниц не сохранит старые списки похожих товаров
+            if self.changed_product_ids:
+                self._set_stage('similar')
+                try:
+                    update_similar_products(self.changed_product_ids)
+                except Exception as e:
+                    self.warnings.append(
+                        f"Не удалось пересчитать похожие товары: {str(e)}")
+        return result
 
     def _process_csv(self):
-        """Обработка CSV файла"""
+        """
+        Обработка CSV файла потоком: файл читается по мере обработки
+        пакетов и целиком в память не загружается. Общее число строк
+        оценивается по доле прочитанных байт.
+        """
+        if not hasattr(self.file, 'read'):
+            try:
+                return self._process_data_rows(csv.DictReader(self.file))
+            except Exception as e:
+                self.errors.append(f"Ошибка при чтении CSV файла: {str(e)}")
+                return False
+
+        text = None
         try:
-            # Читаем файл в текстовом режиме
-            if hasattr(self.file, 'read'):
-                content = self.file.read()
-                if isinstance(content, bytes):
-                    content = content.decode('utf-8')
-                csv_file = StringIO(content)
-            else:
-                csv_file = self.file
+            self.file.seek(0)
+            encoding = detect_csv_encoding(self.file.read(CSV_ENCODING_SAMPLE))
+            self.file.seek(0)
+            text = TextIOWrapper(self.file, encoding=encoding, newline='')
+            reader = csv.DictReader(text)
+
+            # Размер известен у файлов Django (загрузка, FieldFile)
+            size = getattr(self.file, 'size', None)
 
-            reader = csv.DictReader(csv_file)
-            return self._process_data_rows(reader)
+            def estimate_total(processed):
+                offset = self.file.tell()
+                return int(processed * size / offset) if offset else processed
+
+            return self._process_data_rows(reader, estimate_total if size else None)
         except Exception as e:
             self.errors.append(f"Ошибка при чтении CSV файла: {str(e)}")
             return False
+        finally:
+            if text is not None:
+                # Иначе обертка закроет файл, которым владеет вызывающий код
+                text.detach()
 
     def _process_excel(self):
         """Обработка Excel файла"""
@@ -142,59 +231,55 @@ class ImportProcessor:
             self.errors.append(f"Ошибка при чтении JSON файла: {str(e)}")
             return False
 
-    def _process_data_rows(self, rows):
-        """Обработка строк данных"""
-        # Преобразуем rows в список, если это необходимо, чтобы получить общее количество
-        rows_list = list(rows) if not isinstance(rows, list) else rows
-        self.total_rows = len(rows_list)
-
-        # Подсчитываем общее количество изображений для более точного прогресса
-        self.total_images = 0
-        for row in rows_list:
-            if row.get('images'):
-                images = row.get('images', [])
-                if isinstance(images, str):
-                    images = [images.strip()] if images.strip() else []
-                self.total_images += len(images)
+    def _process_data_rows(self, rows, estimate_total=None):
+        """
+        Обработка строк данных пакетами по IMPORT_BATCH_SIZE.
+
+        rows - список или итератор строк; для итератора (потоковый CSV)
+        общее число строк неизвестно и estimate_total(processed) оценивает
+        его после каждого пакета.
+        """
+        if isinstance(rows, list):
+            self.total_rows = len(rows)
+        self._set_stage('rows')
 
+        started = time.monotonic()
         try:
-            # Сохраняем список существующих названий для проверки
-            existing_titles = set(
-                Product.objects.values_list('title', flat=True))
-            processed_titles = set()
+            # Товары категории до импорта: отсутствующие в файле удаляются
+            existing_ids = set()
+            if self.delete_missing and self.category_id:
+                existing_ids = set(Product.objects.filter(
+                    category_id=self.category_id).values_list('id', flat=True))
+            processed_ids = set()
+            self._load_categories()
 
-            # Итерируемся по списку строк
-            for row_num, row in enumerate(rows_list, start=2):
+            numbered_rows = enumerate(rows, start=2)
+            while True:
                 # Проверяем, не был ли отменен импорт
-                if IMPORT_PROGRESS.get('cancelled', False):
+                if self._report_progress():
                     self.warnings.append("Импорт был отменен пользователем")
                     return True  # Возвращаем True, так как отмена - это не ошибка
 
-                # Увеличиваем счетчик обработанных строк
-                self.processed_rows = row_num - 1
-
-                # Обновляем прогресс
-                self._update_progress()
-
-                try:
-                    result = self._process_single_row(row, row_num)
-                    if result and row.get('title'):
-                        processed_titles.add(str(row['title']).strip())
-                except InterruptedError:
-                    # Прерываем выполнение если импорт был отменен
-                    self.warnings.append("Импорт был отменен пользователем")
-                    return True  # Возвращаем True, так как отмена - это не ошибка
-                except Exception as e:
-                    self.errors.append(f"Строка {row_num}: {str(e)}")
-                    continue
+                batch = list(islice(numbered_rows, IMPORT_BATCH_SIZE))
+                if not batch:
+                    break
+                processed_ids.update(self._process_batch(batch))
+                self.processed_rows = batch[-1][0] - 1
+                if estimate_total is not None:
+                    self.total_rows = max(estimate_total(self.processed_rows),
+                                          self.processed_rows)
+            self.total_rows = self.processed_rows
 
             # Удаляем отсутствующие товары если нужно
             if self.delete_missing and self.category_id:
-                missing_titles = existing_titles - processed_titles
-                deleted_count = Product.objects.filter(
-                    title__in=missing_titles,
-                    category_id=self.category_id
-                ).delete()[0]
+                self._set_stage('cleanup')
+                missing_ids = list(existing_ids - processed_ids)
+                deleted_count = 0
+                for start in range(0, len(missing_ids), IMPORT_BATCH_SIZE):
+                    deleted_count += Product.objects.filter(
+                        id__in=missing_ids[start:start + IMPORT_BATCH_SIZE],
+                        category_id=self.category_id
+                    ).delete()[0]
                 if deleted_count > 0:
                     self.warnings.append(
                         f"Удалено {deleted_count} отсутствующих товаров")
@@ -204,6 +289,10 @@ class ImportProcessor:
         except Exception as e:
             self.errors.append(f"Ошибка при обработке данных: {str(e)}")
             return False
+        finally:
+            elapsed = time.monotonic() - started
+            if elapsed > 0:
+                self.rows_per_second = round(self.processed_rows / elapsed, 1)
 
     # def _process_single_row(self, row, row_num):
     #     """Обработка одной строки данных"""
@@ -318,45 +407,100 @@ class ImportProcessor:
     #         self._process_additional_images(product, row['url'])
 
     #     return True
-    def _process_single_row(self, row, row_num):
-        """Обработка одной строки данных"""
+    def _process_batch(self, batch):
+        """
+        Обработка пакета строк [(row_num, row)].
+
+        Категории и существующие товары берутся из словарей, загруженных
+        одним запросом на пакет, новые и измененные товары записываются
+        bulk_create/bulk_update (см. _write_entries). Возвращает ID
+        товаров, которые есть в файле (для delete_missing).
+        """
+        items = []
+        for row_num, row in batch:
+            try:
+                item = self._parse_row(row, row_num)
+            except Exception as e:
+                self.errors.append(f"Строка {row_num}: {str(e)}")
+                continue
+            if item is not None:
+                items.append(item)
+
+        known, duplicates = self._load_products({item['title'] for item in items})
+        # Занятые slug для новых товаров пакета - одним запросом
+        self._slugs.load(self._slug_base(item['title'], item['article'])
+                         for item in items if item['title'] not in known)
+        processed_ids = set()
+        pending = {}
+
+        for item in items:
+            title = item['title']
+            if title in duplicates:
+                self.errors.append(
+                    f"Строка {item['row_num']}: Найдено несколько товаров "
+                    f"с названием '{title}'")
+                continue
+            if title in pending:
+                # Товар уже встречался в этом пакете: строки применяются
+                # по порядку, поэтому сначала записываем предыдущие
+                for entry in self._write_entries(list(pending.values())):
+                    known[entry['product'].title] = entry['product']
+                    processed_ids.add(entry['product'].id)
+                pending = {}
+
+            product = known.get(title)
+            if product is not None and not self.update_existing:
+                self.warnings.append(
+                    f"Строка {item['row_num']}: Товар '{title}' уже существует, пропущен")
+                self.skipped_count += 1
+                processed_ids.add(product.id)
+                continue
+            pending[title] = self._plan_product(item, product)
+
+        for entry in self._write_entries(list(pending.values())):
+            processed_ids.add(entry['product'].id)
+        return processed_ids
+
+    def _parse_row(self, row, row_num):
+        """Разбор строки данных; None - строка пропущена"""
         # Валидация обязательных полей
         title = str(row.get('title', '')).strip()
         if not title:
             self.warnings.append(
                 f"Строка {row_num}: Пропущена (отсутствует название товара)")
             self.skipped_count += 1
-            return False
+            return None
 
         # Получаем артикул (может быть пустым)
         article = str(row.get('article', '')).strip(
         ) if row.get('article') else ''
 
         # Получаем категорию
-        category = None
         if self.category_id:
             # Используем выбранную категорию из формы
-            try:
-                category = Category.objects.get(id=self.category_id)
-            except Category.DoesNotExist:
+            category = self._category
+            if category is None:
                 self.errors.append(
                     f"Строка {row_num}: Категория с ID {self.category_id} не найдена")
                 self.skipped_count += 1
-                return False
+                return None
         elif row.get('category'):
             # Используем категорию из CSV
             category_name = str(row['category']).strip()
-            try:
-                category = Category.objects.get(name=category_name)
-            except Category.DoesNotExist:
+            categories = self._categories_by_name.get(category_name, [])
+            if not categories:
                 self.warnings.append(
                     f"Строка {row_num}: Категория '{category_name}' не найдена. Выберите категорию в форме импорта.")
                 self.skipped_count += 1
-                return False
+                return None
+            if len(categories) > 1:
+                raise ValueError(
+                    f"Найдено несколько категорий с названием '{category_name}'")
+            category = categories[0]
         else:
             self.warnings.append(f"Строка {row_num}: Не указана категория")
             self.skipped_count += 1
-            return False
+            return None
 
         # Обрабатываем описание
         description = str(row.get('description', '')).strip()
@@ -364,70 +508,167 @@ class ImportProcessor:
         if description.startswith('Описание '):
             description = description[9:].strip()
 
-        # Обрабатываем характеристики (details)
-        details = self._parse_details(row.get('details', ''))
-
-        # Обрабатываем availability
-        availability = self._parse_availability(row.get('availability', ''))
-
-        # Генерируем slug
-        slug = self._generate_unique_slug(title, article)
-
         # Получаем список изображений из JSON
         image_urls = row.get('images', [])
         if isinstance(image_urls, str):
             image_urls = [image_urls.strip()] if image_urls.strip() else []
 
-        # Проверяем существование товара по НАЗВАНИЮ (title)
-        product = None
-        try:
-            product = Product.objects.get(title=title)
-
-            if self.update_existing:
-                # Обновляем существующий товар
-                product.article = article
-                product.description = description
-                product.details = details
-                product.category = category
-                product.availability = availability
-                product.is_active = True
-
-                # Сбрасываем изображения при обновлении
-                if self.update_existing:
-                    product.preview_image.delete(save=False)
-                    product.images.all().delete()
-
-                product.save()
-                self.updated_count += 1
-            else:
-                self.warnings.append(
-                    f"Строка {row_num}: Товар '{title}' уже существует, пропущен")
-                self.skipped_count += 1
-                return True
-
-        except Product.DoesNotExist:
-            product = None
+        return {
+            'row_num': row_num,
+            'title': title,
+            'article': article,
+            'category': category,
+            'description': description,
+            # Обрабатываем характеристики (details)
+            'details': self._parse_details(row.get('details', '')),
+            # Обрабатываем availability
+            'availability': self._parse_availability(row.get('availability', '')),
+            'image_urls': image_urls,
+        }
 
-        # Если товара нет - создаем новый
-        if not product:
+    def _load_categories(self):
+        """Категории для строк импорта: выбранная в форме или все по названию"""
+        if self.category_id:
+            self._category = Category.objects.filter(id=self.category_id).first()
+        else:
+            self._categories_by_name = {}
+            for category in Category.objects.all():
+                self._categories_by_name.setdefault(category.name, []).append(category)
+
+    def _load_products(self, titles):
+        """
+        Существующие товары с указанными названиями одним запросом:
+        (название -> товар, названия, под которыми найдено несколько товаров)
+        """
+        products = {}
+        duplicates = set()
+        # Подкатегория нужна для tree_path (refresh_tree_path)
+        for product in Product.objects.filter(title__in=titles).select_related('subcategory'):
+            if product.title in products:
+                duplicates.add(product.title)
+            products[product.title] = product
+        return products, duplicates
+
+    def _plan_product(self, item, product):
+        """Новый или измененный (еще не записанный) товар по строке"""
+        created = product is None
+        old_category_id = None
+        old_tree_path = ''
+        old_preview = None
+        if created:
             product = Product(
-                title=title,
-                article=article,
-                slug=slug,
-                description=description,
-                details=details,
-                category=category,
-                availability=availability,
-                is_active=True
+                title=item['title'],
+                slug=self._generate_unique_slug(item['title'], item['article']),
             )
-            # Мы сохраним изображения позже, после создания объекта
-            product.save()
-            self.imported_count += 1
+        else:
+            old_category_id = product.category_id
+            # Путь, по которому товар был учтен в счетчиках дерева
+            if product.is_active:
+                old_tree_path = product.tree_path
+            # Сбрасываем изображения при обновлении: файл превью удаляется
+            # после записи товара, дополнительные изображения - вместе с ней
+            if product.preview_image:
+                old_preview = product.preview_image
+            product.preview_image = None
+            product.updated_at = timezone.now()
+
+        product.article = item['article']
+        product.description = item['description']
+        product.details = item['details']
+        product.category = item['category']
+        product.availability = item['availability']
+        product.is_active = True
+        # save() не вызывается, поисковый ключ и место в дереве считаем сами
+        product.refresh_search_key()
+        product.refresh_tree_path()
+        return {
+            'row_num': item['row_num'],
+            'product': product,
+            'created': created,
+            'old_category_id': old_category_id,
+            'old_tree_path': old_tree_path,
+            'old_preview': old_preview,
+            'image_urls': item['image_urls'],
+        }
 
-        # Обработка изображений
-        self._download_and_save_images(product, image_urls)
+    def _write_entries(self, entries):
+        """
+        Записывает товары пакета одной транзакцией и скачивает их
+        изображения. Если пакет не записался (например, из-за слишком
+        длинного значения в одной строке), товары записываются по одному,
+        чтобы ошибка досталась только своей строке.
+
+        Возвращает записанные товары.
+        """
+        if not entries:
+            return []
+        try:
+            self._write_with_slug_retry(entries)
+            written = entries
+        except Exception:
+            written = []
+            for entry in entries:
+                try:
+                    self._write_with_slug_retry([entry])
+                    written.append(entry)
+                except Exception as e:
+                    self.errors.append(f"Строка {entry['row_num']}: {str(e)}")
+
+        # bulk_create/bulk_update не отправляют сигналы модели: счетчики,
+        # кэш и версию каталога помечаем сами
+        products_bulk_saved([entry['product'] for entry in written],
+                            [entry['old_category_id'] for entry in written],
+                            [entry['old_tree_path'] for entry in written])
+        for entry in written:
+            if entry['created']:
+                self.imported_count += 1
+            else:
+                self.updated_count += 1
+                if entry['old_preview']:
+                    entry['old_preview'].delete(save=False)
+            self.changed_product_ids.add(entry['product'].id)
 
-        return True
+        # Обработка изображений
+        for entry in written:
+            self.processed_rows = entry['row_num'] - 1
+            self._download_and_save_images(entry['product'], entry['image_urls'])
+        return written
+
+    def _write_with_slug_retry(self, entries):
+        """
+        Запись пакета; если выданный slug успел занять кто-то другой
+        (параллельный импорт, админка), товарам выдаются новые slug.
+        """
+        for attempt in range(SLUG_CONFLICT_RETRIES + 1):
+            try:
+                return self._write(entries)
+            except IntegrityError:
+                created = {entry['product'].slug: entry for entry in entries
+                           if entry['created']}
+                conflicts = set(Product.objects.filter(
+                    slug__in=created).values_list('slug', flat=True))
+                if not conflicts or attempt == SLUG_CONFLICT_RETRIES:
+                    raise
+                self._slugs.mark_taken(conflicts)
+                for slug in conflicts:
+                    product = created[slug]['product']
+                    product.slug = self._generate_unique_slug(product.title, product.article)
+
+    def _write(self, entries):
+        created = [entry['product'] for entry in entries if entry['created']]
+        updated = [entry['product'] for entry in entries if not entry['created']]
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(created)
+                if updated:
+                    ProductImage.objects.filter(product__in=updated).delete()
+                    Product.objects.bulk_update(updated, IMPORT_UPDATE_FIELDS)
+        except Exception:
+            # Транзакция откатилась: выданные id недействительны
+            for product in created:
+                product.pk = None
+                product._state.adding = True
+            raise
 
     def _download_and_save_images(self, product, image_urls):
         """Скачивание и сохранение изображений для товара"""
@@ -435,7 +676,7 @@ class ImportProcessor:
             return
 
         # Проверяем, не был ли отменен импорт перед скачиванием изображений
-        if IMPORT_PROGRESS.get('cancelled', False):
+        if self._report_progress():
             return
 
         first_image_url = image_urls[0]
@@ -444,7 +685,7 @@ class ImportProcessor:
         # Скачиваем и сохраняем preview_image
         try:
             # Проверяем отмену перед каждым скачиванием
-            if IMPORT_PROGRESS.get('cancelled', False):
+            if self._report_progress():
                 return
 
             preview_img_file = self._download_image_file(first_image_url)
@@ -458,7 +699,7 @@ class ImportProcessor:
         # Скачиваем и сохраняем остальные изображения
         for idx, img_url in enumerate(other_image_urls):
             # Проверяем отмену перед каждым скачиванием
-            if IMPORT_PROGRESS.get('cancelled', False):
+            if self._report_progress():
                 return
 
             try:
@@ -568,61 +809,23 @@ class ImportProcessor:
 
         return 'in_stock'
 
-    def _generate_unique_slug(self, title, article=''):
-        """Генерация уникального slug"""
-        # Транслитерация для русских символов
-        translit_dict = {
-            'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
-            'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
-            'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
-            'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
-            'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
-        }
-
+    def _slug_base(self, title, article=''):
+        """Основа slug: артикул или транслитерированное название"""
         # Если есть артикул - используем его
         if article:
             base_slug = article.lower()
         else:
             # Транслитерация названия
-            title_lower = title.lower()
-            base_slug = ''.join(translit_dict.get(c, c) for c in title_lower)
+            base_slug = transliterate(title.lower())
 
         # Очищаем от недопустимых символов
         base_slug = re.sub(r'[^\w\s-]', '', base_slug)
         base_slug = re.sub(r'[-\s]+', '-', base_slug).strip('-')
+        return base_slug or 'product'
 
-        # Проверяем уникальность
-        slug = base_slug
-        counter = 1
-        while Product.objects.filter(slug=slug).exists():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-
-        return slug
-
-    def _update_progress(self):
-        """Обновление прогресса импорта"""
-        global IMPORT_PROGRESS
-
-        # Проверяем, не был ли отменен импорт
-        if IMPORT_PROGRESS.get('cancelled', False):
-            raise InterruptedError("Импорт был отменен пользователем")
-
-        # Рассчитываем прогресс только по количеству обработанных товаров
-        if self.total_rows > 0:
-            percentage = int((self.processed_rows / self.total_rows) * 100)
-            # Ограничиваем процент от 0 до 100
-            percentage = max(0, min(100, percentage))
-        else:
-            percentage = 0
-
-        IMPORT_PROGRESS['processed'] = self.processed_rows
-        IMPORT_PROGRESS['total'] = self.total_rows
-        IMPORT_PROGRESS['percentage'] = percentage
-
-        # Вызываем callback функцию для обновления прогресса, если установлена
-        if self.progress_callback:
-            self.progress_callback(self.processed_rows, self.total_rows)
+    def _generate_unique_slug(self, title, article=''):
+        """Генерация уникального slug (среди товаров в БД и выданных импортом)"""
+        return self._slugs.allocate(self._slug_base(title, article))
 
     def _process_additional_images(self, product, url_str):
         """Обработка дополнительных изображений из поля url"""
@@ -666,6 +869,10 @@ class ImportProcessor:
             messages.append(
                 f"[ПРОПУЩЕНО] Пропущено: {self.skipped_count} товаров")
 
+        if self.rows_per_second:
+            messages.append(
+                f"[СКОРОСТЬ] {self.rows_per_second} строк/с")
+
         if self.warnings:
             messages.append(
                 f"\n[ПРЕДУПРЕЖДЕНИЕ] Предупреждения ({len(self.warnings)}):")
@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+# Отдельный кэш без вытеснения, см. CACHES в settings
+STATE_CACHE = 'state'
+
+# Последняя прочитанная версия в этом процессе: позволяет горячим путям
+# (автодополнение, снимки) не ходить в общий кэш на каждый запрос
+_local = {'version': None, 'checked_at': 0.0}
+
+
+def bump_catalog_version():
+    """
+    Помечает каталог измененным.
+
+    Версия - время изменения в миллисекундах, поэтому она монотонна
+    и годится для Last-Modified.
+    """
+    version = int(time.time() * 1000)
+    caches[STATE_CACHE].set(CATALOG_VERSION_KEY, version, None)
+    _local['version'] = version
+    _local['checked_at'] = time.monotonic()
+    return version
+
+
+def get_catalog_version(max_age=0):
+    """
+    Текущая версия каталога.
+
+    max_age - сколько секунд можно доверять прочитанному ранее значению
+    без обращения к общему кэшу.
+    """
+    now = time.monotonic()
+    if _local['version'] is not None and now - _local['checked_at'] < max_age:
+        return _local['version']
+
+    state = caches[STATE_CACHE]
+    version = state.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Кэш пуст (первый запуск или очистка): начинаем новую версию
+        state.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = state.get(CATALOG_VERSION_KEY)
+
+    _local['version'] = version
+    _local['checked_at'] = now
+    return version
+
+
+class VersionedCopy:
+    """
+    Построенная по каталогу структура в памяти процесса (снимок каталога,
+    индекс автодополнения), у которой есть атрибут version.
+
+    После смены версии каталога новая копия строится в фоновом потоке,
+    а до ее готовности отдается прежняя: посетитель не ждет перестройки.
+    Синхронно (get(wait=True)) строится только самая первая копия.
+    """
+
+    def __init__(self, build, name, max_age):
+        self.build = build
+        self.name = name
+        self.max_age = max_age
+        self.value = None
+        self.building = threading.Lock()
+        # Поток сборки в дочерний процесс не переходит, а захваченная
+        # им блокировка перешла бы
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def get(self, wait=False):
+        """Текущая копия; без wait может вернуть устаревшую или None"""
+        version = get_catalog_version(max_age=self.max_age)
+        value = self.value
+        if value is not None and value.version == version:
+            return value
+        if value is None and wait:
+            with self.building:
+                if self.value is None:
+                    self._build(version)
+            return self.value
+        self._build_in_background(version)
+        return value
+
+    def _build(self, version):
+        started = time.monotonic()
+        self.value = self.build(version)
+        logger.info("%s built in %.1f s, version %s",
+                    self.name, time.monotonic() - started, version)
+
+    def _build_in_background(self, version):
+        if not self.building.acquire(blocking=False):
+            # Уже строится; следующую версию подхватит следующий запрос
+            return
+
+        def run():
+            try:
+                self._build(version)
+            except Exception:
+                logger.exception("Failed to build %s", self.name)
+            finally:
+                self.building.release()
+                connections.close_all()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _reset_after_fork(self):
+        self.building = threading.Lock()
@@ -1,83 +1,187 @@
+import json
+from functools import wraps
+
 from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
 from django.views.generic import ListView, DetailView
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse
 from django.contrib.admin.views.decorators import staff_member_required
-from .models import Category, Product
-
-
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
+from apps.core.cache import get_or_compute
+from . import autocomplete, conditional, import_jobs, search, tracking
+from .models import Category, Product, SimilarProduct
+from .pagination import DEFAULT_SORT, SORT_CHOICES, InvalidCursor, get_sort, paginate_keyset
+from .snapshot import get_snapshot
+from .version import get_catalog_version
+
+
+@method_decorator(condition(etag_func=conditional.catalog_etag,
+                            last_modified_func=conditional.catalog_last_modified),
+                  name='dispatch')
 class CategoryListView(ListView):
-    model = Category
     template_name = 'catalog/category_list.html'
     context_object_name = 'categories'
 
     def get_queryset(self):
-        return Category.objects.filter(parent=None, is_active=True).order_by('order').prefetch_related('children', 'products')
+        # Дерево категорий читается из снимка в памяти, без запросов к БД
+        return get_snapshot().root_categories()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        snapshot = get_snapshot()
         # Добавляем статистику
-        context['total_categories'] = Category.objects.filter(
-            is_active=True).count()
-        context['total_products'] = Product.objects.filter(
-            is_active=True).count()
+        context['total_categories'] = snapshot.active_categories_count
+        context['total_products'] = snapshot.products_count
         return context
 
 
+@method_decorator(condition(etag_func=conditional.category_etag,
+                            last_modified_func=conditional.category_last_modified),
+                  name='dispatch')
 class CategoryDetailView(DetailView):
-    model = Category
     template_name = 'catalog/category_detail.html'
     context_object_name = 'category'
-    slug_url_kwarg = 'slug'
+
+    def get_object(self, queryset=None):
+        category = get_snapshot().category_by_slug(self.kwargs['slug'])
+        if category is None:
+            raise Http404("Категория не найдена")
+        return category
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        category = self.get_object()
-
-        # Получаем товары из этой категории и подкатегорий
-        products = Product.objects.filter(
-            category=category,
-            is_active=True
-        ).select_related('category').prefetch_related('images')
-
-        context['products'] = products
+        category = self.object
+        snapshot = get_snapshot()
+
+        sort = get_sort(self.request.GET.get('sort'))
+        cursor = self.request.GET.get('cursor')
+        if sort == DEFAULT_SORT and not cursor:
+            # Первая страница в сортировке по умолчанию - самая частая,
+            # она собирается из снимка
+            page = snapshot.first_page(category)
+        else:
+            # Товары из этой категории и всех подкатегорий одним запросом
+            products = Product.objects.active().in_category_tree(
+                category).select_related('category')
+            try:
+                page = paginate_keyset(products, sort, cursor)
+            except InvalidCursor:
+                page = paginate_keyset(products, sort)
+
+        context['products'] = page.object_list
+        context['page'] = page
+        context['sort'] = page.sort
+        context['sort_choices'] = SORT_CHOICES
+        # Вид (сетка/список) переключается на клиенте, здесь только начальный
+        context['view_mode'] = 'list' if self.request.GET.get(
+            'view') == 'list' else 'grid'
+        context['ancestors'] = snapshot.ancestors(category)
+        context['subcategories'] = snapshot.children(category)
         return context
 
 
+def category_products(request, slug):
+    """
+    API эндпоинт для подгрузки следующей страницы товаров категории
+    """
+    category = get_object_or_404(Category, slug=slug)
+    products = Product.objects.active().in_category_tree(
+        category).select_related('category')
+
+    try:
+        page = paginate_keyset(
+            products, request.GET.get('sort'), request.GET.get('cursor'))
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'html': render_to_string(
+            'catalog/includes/product_cards.html',
+            {'products': page.object_list}, request=request),
+        'next_cursor': page.next_cursor,
+        'has_next': page.has_next,
+    })
+
+
+def _record_view_on_not_modified(view):
+    """Ответ 304 на страницу товара - тоже просмотр"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        product_id = getattr(request, 'validated_product_id', None)
+        if response.status_code == 304 and product_id:
+            tracking.record_view(product_id)
+        return response
+    return wrapper
+
+
+@method_decorator(_record_view_on_not_modified, name='dispatch')
+@method_decorator(condition(etag_func=conditional.product_etag,
+                            last_modified_func=conditional.product_last_modified),
+                  name='dispatch')
 class ProductDetailView(DetailView):
     model = Product
+    queryset = Product.objects.select_related('category', 'subcategory')
     template_name = 'catalog/product_detail.html'
     context_object_name = 'product'
     slug_url_kwarg = 'slug'
 
-    def get_object(self):
-        product = super().get_object()
-        # Увеличиваем счетчик просмотров
-        product.views_count += 1
-        product.save(update_fields=['views_count'])
+    def get_object(self, queryset=None):
+        product = super().get_object(queryset)
+        # Просмотр учитывается в буфере и записывается в БД пачкой;
+        # фоновый пересчет страницы кэшем (prerender) просмотром не считается
+        if not getattr(self.request, 'prerender', False):
+            tracking.record_view(product.pk)
         return product
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product = self.get_object()
-
-        # Получаем похожие товары из той же подкатегории
-        if product.subcategory:
-            similar_products = Product.objects.filter(
-                subcategory=product.subcategory,
-                is_active=True
-            ).exclude(id=product.id)[:4]
-        else:
-            similar_products = Product.objects.filter(
-                category=product.category,
-                is_active=True
-            ).exclude(id=product.id)[:4]
+        product = self.object
+
+        # Похожие товары заранее посчитаны командой compute_similar_products
+        similar_products = [
+            link.similar for link in
+            SimilarProduct.objects.filter(product=product, similar__is_active=True)
+            .select_related('similar').order_by('-score')[:4]
+        ]
+        if not similar_products:
+            # Пока расчета нет - товары из той же подкатегории
+            fallback = Product.objects.active().exclude(id=product.id)
+            if product.subcategory:
+                fallback = fallback.filter(subcategory=product.subcategory)
+            else:
+                fallback = fallback.filter(category=product.category)
+            similar_products = fallback[:4]
 
         context['similar_products'] = similar_products
+        # Хлебные крошки строятся по пути самой глубокой категории товара
+        context['breadcrumbs'] = (
+            product.subcategory or product.category).get_breadcrumbs()
         context['images'] = product.images.all().order_by('order')
         return context
 
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        # Страничный кэш учитывает по нему просмотры страниц, отданных из кэша
+        response.tracked_product_id = self.object.pk
+        return response
 
+
+@csrf_exempt
+@require_POST
+def track_product_view(request, slug):
+    """Просмотр статической копии страницы товара (см. prerender_catalog)"""
+    product_id = Product.objects.active().filter(slug=slug).values_list(
+        'id', flat=True).first()
+    if product_id is None:
+        return HttpResponse(status=404)
+    tracking.record_view(product_id)
+    return HttpResponse(status=204)
+
+
+@condition(etag_func=conditional.search_etag)
 def search_products(request):
     """
     API эндпоинт для поиска товаров
@@ -87,18 +191,27 @@ def search_products(request):
     if not query or len(query) < 2:
         return JsonResponse({'products': []})
 
-    # Ищем товары по названию, артикулу и описанию
-    products = Product.objects.filter(
-        Q(title__icontains=query) |
-        Q(article__icontains=query) |
-        Q(description__icontains=query) |
-        Q(category__name__icontains=query),
-        is_active=True
-        # Ограничиваем до 10 результатов
-    ).select_related('category').prefetch_related('images')[:10]
-
+    # Короткое начало слова - подсказки из индекса в памяти воркера и
+    # одного запроса по первичному ключу. Если по префиксу ничего нет
+    # (другая раскладка, опечатка), как и для длинных запросов, ищем в БД
+    if autocomplete.is_short_query(query):
+        suggestions = autocomplete.suggest(query)
+        if suggestions:
+            return JsonResponse({'products': suggestions})
+
+    # Поиск в БД: результат общий для всех воркеров, пока не изменился каталог
+    body = get_or_compute(
+        search.cache_key(query, get_catalog_version()),
+        lambda: _search_response_body(query),
+        search.CACHE_TIMEOUT,
+    )
+    return HttpResponse(body, content_type='application/json')
+
+
+def _search_response_body(query):
+    """Готовое JSON-тело ответа поиска (bytes) - сериализуется один раз"""
     products_data = []
-    for product in products:
+    for product in search.search_products(query):
         product_data = {
             'id': product.id,
             'title': product.title,
@@ -108,32 +221,30 @@ def search_products(request):
             'description': product.description[:100] + '...' if len(product.description) > 100 else product.description,
         }
 
-        # Добавляем изображение если есть
+        # Добавляем изображение если есть (images уже предзагружены)
+        images = product.images.all()
         if product.preview_image:
             product_data['image'] = product.preview_image.url
-        elif product.images.first():
-            product_data['image'] = product.images.first().image.url
+        elif images:
+            product_data['image'] = images[0].image.url
         else:
             product_data['image'] = None
 
         products_data.append(product_data)
 
-    return JsonResponse({'products': products_data})
-
-
-def import_progress(request):
-    """
-    API эндпоинт для получения прогресса импорта
-    """
-    from .utils import IMPORT_PROGRESS
-    return JsonResponse(IMPORT_PROGRESS)
+    return json.dumps({'products': products_data}).encode()
 
 
 @staff_member_required
 def cancel_import(request):
-    """Отмена импорта товаров"""
+    """
+    Отмена импорта товаров: задание в очереди снимается сразу,
+    выполняющееся прерывается обработчиком при записи прогресса
+    """
     if request.method == 'POST':
-        from .utils import IMPORT_PROGRESS
-        IMPORT_PROGRESS['cancelled'] = True
-        return JsonResponse({'status': 'success', 'message': 'Импорт отменен'})
+        job_id = request.POST.get('job_id', '')
+        if job_id.isdigit() and import_jobs.cancel_job(int(job_id)):
+            return JsonResponse({'status': 'success', 'message': 'Отмена импорта запрошена'})
+        return JsonResponse({'status': 'error', 'message': 'Импорт уже завершен'},
+                            status=409)
     return JsonResponse({'status': 'error', 'message': 'Метод не разрешен'}, status=405)
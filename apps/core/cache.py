@@ -0,0 +1,37 @@
+import time
+
+from django.core.cache import cache
+
+
+def get_or_compute(key, compute, timeout, lock_timeout=10, wait_timeout=5,
+                   poll_interval=0.05):
+    """
+    Значение из общего кэша; при промахе вычисляется одним процессом.
+
+    Первый промахнувшийся воркер берет блокировку (cache.add атомарен)
+    и считает значение, остальные ждут его появления в кэше, а не
+    выполняют тот же запрос параллельно. Если держатель блокировки не
+    успел за wait_timeout (упал или завис), ожидающий считает сам.
+
+    compute не должен возвращать None: None означает промах.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return compute()
@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from apps.catalog.models import Category, Product
+from apps.catalog.pagination import SORT_CHOICES, KeysetPage
+
+
+BENCHMARK_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'benchmark-category-render'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время рендеринга страницы категории (без обращений к БД: '
+            'кэш фрагментов на время замера - в памяти процесса)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=48,
+            help='Количество товаров на странице',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Количество повторов рендеринга',
+        )
+
+    def handle(self, *args, **options):
+        # Кэш по умолчанию - DatabaseCache; фрагменты карточек замеряем
+        # с кэшем в памяти, как будто он уже прогрет
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            self._benchmark(options)
+
+    def _benchmark(self, options):
+        count = options['products']
+        iterations = options['iterations']
+
+        # Несохраненные объекты: замер касается только шаблона
+        now = timezone.now()
+        category = Category(pk=0, name='Тестовая категория', slug='benchmark',
+                            description='Описание категории', tree_products_count=count,
+                            updated_at=now)
+        category._prefetched_objects_cache = {
+            'children': Category.objects.none()}
+        products = [
+            Product(
+                pk=i + 1,
+                title=f'Тестовый товар {i}',
+                article=f'ART-{i:05d}',
+                slug=f'benchmark-{i}',
+                category=category,
+                description='Описание товара с детальной информацией ' * 5,
+                availability='in_stock' if i % 2 else 'order',
+                views_count=i,
+                updated_at=now,
+            )
+            for i in range(count)
+        ]
+        page = KeysetPage(products, 'benchmark-cursor', 'newest')
+
+        request = RequestFactory().get('/catalog/category/benchmark/')
+        context = {
+            'category': category,
+            'products': products,
+            'page': page,
+            'sort': page.sort,
+            'sort_choices': SORT_CHOICES,
+            'ancestors': [],
+            'view_mode': 'grid',
+        }
+
+        html = render_to_string(
+            'catalog/category_detail.html', context, request=request)
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            render_to_string(
+                'catalog/category_detail.html', context, request=request)
+        elapsed = (time.perf_counter() - started) / iterations
+
+        self.stdout.write(f"Товаров на странице: {count}")
+        self.stdout.write(f"Среднее время рендеринга: {elapsed * 1000:.2f} мс")
+        self.stdout.write(f"Размер HTML: {len(html.encode('utf-8')) / 1024:.1f} КБ")
+        cards = html.count('href="/catalog/product/')
+        self.stdout.write(f"Карточек в разметке: {cards}")
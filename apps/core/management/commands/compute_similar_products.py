@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.similarity import update_similar_products
+from apps.catalog.version import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = ('Рассчитывает похожие товары по категории, характеристикам '
+            'и словам названия')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--products',
+            type=str,
+            help='ID товаров через запятую: пересчитать только связанные с ними списки')
+
+    def handle(self, *args, **options):
+        product_ids = None
+        if options['products']:
+            product_ids = [int(value) for value in options['products'].split(',') if value.strip()]
+        count = update_similar_products(product_ids)
+        # Списки похожих товаров выводятся на кэшируемых страницах
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Похожие товары рассчитаны для {count} товаров"))
@@ -54,6 +54,8 @@ class Command(BaseCommand):
                         f'Updated: {processor.updated_count} products')
                     self.stdout.write(
                         f'Skipped: {processor.skipped_count} products')
+                    self.stdout.write(
+                        f'Speed: {processor.rows_per_second} rows/s')
 
                     if processor.warnings:
                         self.stdout.write(self.style.WARNING('Warnings:'))
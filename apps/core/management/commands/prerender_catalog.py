@@ -0,0 +1,32 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from apps.core.prerender import build_static_catalog
+
+
+class Command(BaseCommand):
+    help = ('Отрисовывает главную, категории и товары в статические HTML-файлы '
+            '(PRERENDER_ROOT), которые nginx отдает без обращения к Django')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Перерисовать все страницы, а не только измененные')
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Число процессов отрисовки (по умолчанию - число ядер)')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rendered, removed, failed = build_static_catalog(
+            full=options['full'], processes=options['processes'])
+        message = (f"Отрисовано страниц: {rendered}, удалено: {removed}, "
+                   f"за {time.monotonic() - started:.1f} с")
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{message}; с ошибкой: {failed}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
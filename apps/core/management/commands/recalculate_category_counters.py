@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.counters import rebuild_all_counters
+from apps.catalog.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счетчики товаров в категориях'
+
+    def handle(self, *args, **options):
+        rebuild_all_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f"Счетчики пересчитаны для {Category.objects.count()} категорий"))
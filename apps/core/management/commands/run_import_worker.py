@@ -0,0 +1,49 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.catalog.import_jobs import claim_next_job, fail_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = ('Обработчик очереди импорта товаров: выполняет задания, '
+            'поставленные со страницы импорта в админке')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить задания из очереди и завершиться')
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2,
+            help='Пауза между проверками пустой очереди, в секундах')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        # Текущий импорт доводится до конца, новые задания не берутся
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        while not self.stopping:
+            close_old_connections()
+            stale = fail_stale_jobs()
+            if stale:
+                self.stdout.write(self.style.WARNING(
+                    f"Брошенных заданий завершено: {stale}"))
+
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Импорт #{job.pk}: начат")
+            job = run_job(job)
+            self.stdout.write(f"Импорт #{job.pk}: {job.get_status_display()}")
+
+    def _stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.catalog.rankings import update_product_rankings
+from apps.catalog.version import bump_catalog_version
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинги товаров (популярное за неделю, рост '
+            'популярности) по дневной статистике просмотров. Запускается по cron')
+
+    def handle(self, *args, **options):
+        updated = update_product_rankings()
+        if updated:
+            # Рейтинги меняют порядок товаров на главной и в листингах
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Рейтинги обновлены для {updated} товаров"))
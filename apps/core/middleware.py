@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.urls import Resolver404, resolve
+
+from apps.catalog.tracking import record_view
+from apps.catalog.version import get_catalog_version
+
+logger = logging.getLogger(__name__)
+
+# Страницы, которые кэшируются целиком для анонимных посетителей.
+# Устаревшую страницу фоновый поток пересчитывает самодельным WSGIRequest,
+# который проходит только middleware ниже PageCacheMiddleware: сессии,
+# CSRF-проверки и flash-сообщений у него нет, а request.user - аноним.
+# Представления из этого списка не должны от них зависеть; заголовки
+# остальных middleware добавляются при выдаче страницы из кэша
+PAGE_CACHE_URL_NAMES = {
+    'core:home',
+    'catalog:category_list',
+    'catalog:category',
+    'catalog:product',
+}
+
+# Как часто воркер сверяет версию каталога с общим кэшем
+VERSION_CHECK_INTERVAL = 1
+
+# Сколько секунд ждать, пока страницу считает другой воркер
+WAIT_TIMEOUT = 5
+POLL_INTERVAL = 0.05
+
+# Сколько последних удачных страниц воркер держит у себя на случай,
+# если недоступны и БД, и общий кэш (по умолчанию он тоже в PostgreSQL).
+# Сюда попадают и страницы, прочитанные из общего кэша, а не только
+# посчитанные этим воркером
+LOCAL_COPIES = 200
+
+CSRF_PLACEHOLDER = '__csrf_token_placeholder__'
+_CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+class PageCacheMiddleware:
+    """
+    Кэш готовых HTML-ответов для анонимных GET-запросов.
+
+    Запись хранит версию каталога и время создания. Свежая запись (той же
+    версии и моложе PAGE_CACHE_SOFT_TIMEOUT) отдается как есть. Устаревшая
+    тоже отдается сразу, а пересчитывает ее в фоне один воркер - тот, кто
+    взял блокировку; остальные продолжают отдавать старую копию. При полном
+    промахе страницу считает один воркер, остальные ждут ее в кэше.
+    Если пересчет не удался (например, недоступна БД), отдается последняя
+    удачная копия.
+
+    CSRF-токен в сохраненной странице заменяется заглушкой и при выдаче
+    подставляется свежий для текущего посетителя.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+        self.soft_timeout = getattr(settings, 'PAGE_CACHE_SOFT_TIMEOUT', 60)
+        self.local_copies = OrderedDict()
+        self.local_lock = threading.Lock()
+
+    def __call__(self, request):
+        if not self._is_cacheable_request(request):
+            return self.get_response(request)
+
+        key = self._cache_key(request)
+        version = self._safe(get_catalog_version, max_age=VERSION_CHECK_INTERVAL)
+        # Запрос на обновление от nginx (apps.core.purge): старую копию
+        # не отдаем и чужой пересчет не ждем, страница считается заново
+        refresh = bool(request.headers.get('X-Cache-Refresh'))
+        entry = None if refresh else self._safe(cache.get, key)
+
+        if entry is not None:
+            self._remember(key, entry)
+            if self._is_fresh(entry, version):
+                return self._restore(request, entry, 'HIT')
+            if self._safe(cache.add, f'{key}:lock', 1, WAIT_TIMEOUT * 2):
+                self._revalidate_in_background(request, key, version)
+            return self._restore(request, entry, 'STALE')
+
+        # Полный промах: считает только воркер, взявший блокировку
+        if (self._safe(cache.add, f'{key}:lock', 1, WAIT_TIMEOUT * 2) is False
+                and not refresh):
+            entry = self._wait_for_entry(key)
+            if entry is not None:
+                self._remember(key, entry)
+                return self._restore(request, entry, 'HIT')
+
+        try:
+            response = self.get_response(request)
+        finally:
+            self._safe(cache.delete, f'{key}:lock')
+
+        if response.status_code >= 500:
+            stale = self._local_copy(key)
+            if stale is not None:
+                return self._restore(request, stale, 'STALE')
+        elif self._is_cacheable_response(response):
+            self._store(key, self._pack(response, version))
+        return response
+
+    def _is_cacheable_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        # Flash-сообщения показываются один раз и в кэш попасть не должны
+        if 'messages' in request.COOKIES:
+            return False
+        if request.user.is_authenticated:
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        return match.view_name in PAGE_CACHE_URL_NAMES
+
+    def _is_cacheable_response(self, response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+            and 'private' not in response.get('Cache-Control', '')
+        )
+
+    def _is_fresh(self, entry, version):
+        return (entry['version'] == version
+                and time.time() - entry['created'] < self.soft_timeout)
+
+    def _cache_key(self, request):
+        digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        return f'page:{digest}'
+
+    def _safe(self, func, *args, **kwargs):
+        """Обращение к общему кэшу; его недоступность - это промах, а не 500"""
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            logger.warning("Page cache backend is unavailable", exc_info=True)
+            return None
+
+    def _wait_for_entry(self, key):
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = self._safe(cache.get, key)
+            if entry is not None:
+                return entry
+        return None
+
+    def _revalidate_in_background(self, request, key, version):
+        # Отдельный запрос без сессии и пользователя: страница анонимная
+        fresh_request = WSGIRequest(request.environ.copy())
+        fresh_request.user = AnonymousUser()
+        # Фоновый пересчет - не просмотр страницы посетителем
+        fresh_request.prerender = True
+        thread = threading.Thread(
+            target=self._revalidate, args=(fresh_request, key, version),
+            daemon=True)
+        thread.start()
+
+    def _revalidate(self, request, key, version):
+        try:
+            response = self.get_response(request)
+            if self._is_cacheable_response(response):
+                self._store(key, self._pack(response, version))
+            elif response.status_code < 500:
+                # Страница исчезла или стала некэшируемой (404, редирект):
+                # старую копию больше не отдаем
+                self._forget(key)
+            else:
+                logger.warning("Page %s was not revalidated: status %s",
+                               request.path, response.status_code)
+        except Exception:
+            logger.exception("Failed to revalidate page %s", request.path)
+        finally:
+            self._safe(cache.delete, f'{key}:lock')
+            connections.close_all()
+
+    def _store(self, key, entry):
+        self._safe(cache.set, key, entry, self.timeout)
+        self._remember(key, entry)
+
+    def _remember(self, key, entry):
+        """Локальная копия на случай, когда общий кэш недоступен"""
+        with self.local_lock:
+            self.local_copies[key] = entry
+            self.local_copies.move_to_end(key)
+            while len(self.local_copies) > LOCAL_COPIES:
+                self.local_copies.popitem(last=False)
+
+    def _forget(self, key):
+        self._safe(cache.delete, key)
+        with self.local_lock:
+            self.local_copies.pop(key, None)
+
+    def _local_copy(self, key):
+        with self.local_lock:
+            return self.local_copies.get(key)
+
+    def _pack(self, response, version):
+        content = response.content.decode(response.charset)
+        content = _CSRF_INPUT_RE.sub(rf'\g<1>{CSRF_PLACEHOLDER}\g<2>', content)
+        return {
+            'content': content,
+            'content_type': response['Content-Type'],
+            'product_id': getattr(response, 'tracked_product_id', None),
+            # Валидаторы нужны ConditionalGetMiddleware, чтобы отвечать 304
+            'headers': {header: response[header]
+                        for header in ('ETag', 'Last-Modified')
+                        if response.has_header(header)},
+            'version': version,
+            'created': time.time(),
+        }
+
+    def _restore(self, request, entry, state):
+        content = entry['content']
+        if CSRF_PLACEHOLDER in content:
+            # get_token также отмечает, что нужно выставить CSRF-cookie
+            content = content.replace(CSRF_PLACEHOLDER, get_token(request))
+        if entry['product_id']:
+            # Просмотр из кэша учитывается так же, как в ProductDetailView
+            record_view(entry['product_id'])
+        response = HttpResponse(content, content_type=entry['content_type'])
+        for header, value in entry.get('headers', {}).items():
+            response[header] = value
+        response['X-Page-Cache'] = state
+        return response
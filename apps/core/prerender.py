@@ -0,0 +1,235 @@
+import json
+import logging
+import multiprocessing
+import os
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from apps.catalog.models import Category, Product
+from apps.catalog.version import get_catalog_version
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.manifest.json'
+PAGE_FILE = 'index.html'
+
+
+def _category_ids(path):
+    """ID категории и всех ее предков по материализованному пути"""
+    return [int(part) for part in path.split('/') if part]
+
+
+def page_file(root, path):
+    """
+    Файл страницы в статической копии. Путь раскодируется: nginx ищет
+    файл по $uri, а в нем кириллические slug уже раскодированы.
+    """
+    return Path(root) / unquote(path).lstrip('/') / PAGE_FILE
+
+
+def discard_pages(paths):
+    """
+    Удаляет страницы из статической копии после изменения каталога:
+    до следующей сборки nginx отдает их из Django, а сборка нарисует
+    их заново, потому что файлов нет.
+    """
+    root = Path(settings.PRERENDER_ROOT)
+    if not root.is_dir():
+        return
+    for path in paths:
+        _remove(page_file(root, path))
+
+
+def catalog_pages():
+    """
+    Все страницы статической копии: путь -> [вид страницы, ID категорий,
+    от которых она зависит]. Для категории это она сама и предки, для
+    товара - его категория и подкатегория.
+    """
+    pages = {reverse('core:home'): ['page', []],
+             reverse('catalog:category_list'): ['page', []]}
+    for slug, path in Category.objects.filter(is_active=True).values_list('slug', 'path'):
+        pages[reverse('catalog:category', kwargs={'slug': slug})] = [
+            'category', _category_ids(path)]
+    products = Product.objects.active().values_list('slug', 'category_id', 'subcategory_id')
+    for slug, category_id, subcategory_id in products.iterator(chunk_size=2000):
+        pages[reverse('catalog:product', kwargs={'slug': slug})] = [
+            'product', [pk for pk in (category_id, subcategory_id) if pk]]
+    return pages
+
+
+def _pages_to_render(root, pages, manifest, since, version):
+    """
+    Страницы, затронутые изменениями после since: новые, измененные товары
+    и категории, страницы категорий (со счетчиками и списками), в которые
+    товары добавились или из которых ушли, а также страницы, чьи файлы
+    удалены при изменении каталога (discard_pages): так учитываются
+    изображения и похожие товары, не меняющие updated_at товара.
+    """
+    old_pages = manifest['pages']
+    changed = set(pages) - set(old_pages)
+    dirty_categories = set()
+    for path in changed:
+        dirty_categories.update(pages[path][1])
+    for path in set(old_pages) - set(pages):
+        dirty_categories.update(old_pages[path][1])
+
+    changed_products = Product.objects.filter(updated_at__gte=since).values_list('slug', flat=True)
+    for slug in changed_products:
+        path = reverse('catalog:product', kwargs={'slug': slug})
+        for page in (pages.get(path), old_pages.get(path)):
+            if page:
+                dirty_categories.update(page[1])
+        if path in pages:
+            changed.add(path)
+
+    # Переименование категории меняет и хлебные крошки ее товаров
+    changed_categories = set(
+        Category.objects.filter(updated_at__gte=since).values_list('id', flat=True))
+    dirty_categories.update(changed_categories)
+
+    category_paths = dict(Category.objects.values_list('id', 'path'))
+    for category_id in list(dirty_categories):
+        dirty_categories.update(_category_ids(category_paths.get(category_id, '')))
+
+    for path, (kind, category_ids) in pages.items():
+        if kind == 'product' and changed_categories.intersection(category_ids):
+            changed.add(path)
+        elif kind == 'category' and category_ids[-1] in dirty_categories:
+            changed.add(path)
+        elif not page_file(root, path).exists():
+            changed.add(path)
+
+    # Главная и список категорий (рейтинги, счетчики) меняются вместе
+    # с любым изменением каталога
+    if changed or set(old_pages) != set(pages) or manifest['version'] != version:
+        changed.update((reverse('core:home'), reverse('catalog:category_list')))
+    return changed
+
+
+def render_page(path):
+    """
+    Отрисовывает страницу анонимному посетителю и записывает ее в
+    PRERENDER_ROOT. Возвращает код ответа или None при ошибке.
+    """
+    target = page_file(settings.PRERENDER_ROOT, path)
+    try:
+        # reverse() кодирует кириллицу, resolve() ждет раскодированный путь
+        match = resolve(unquote(path))
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+        # Отрисовка - не просмотр страницы посетителем
+        request.prerender = True
+        # Статическая копия сама сообщает о просмотре, см. product_detail.html
+        request.static_render = True
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+    except Exception:
+        logger.exception("Failed to prerender %s", path)
+        _remove(target)
+        return None
+
+    if response.status_code == 200:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f'.{PAGE_FILE}.{os.getpid()}')
+        tmp.write_bytes(response.content)
+        # Подмена файла атомарна: nginx не увидит недописанную страницу
+        os.replace(tmp, target)
+    else:
+        _remove(target)
+    return response.status_code
+
+
+def _render_with_path(path):
+    return path, render_page(path)
+
+
+def _remove(target):
+    try:
+        target.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _load_manifest(root):
+    try:
+        with open(root / MANIFEST_NAME, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save_manifest(root, manifest):
+    tmp = root / f'{MANIFEST_NAME}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, root / MANIFEST_NAME)
+
+
+def build_static_catalog(full=False, processes=None):
+    """
+    Строит (или обновляет) статическую копию главной, категорий и товаров.
+
+    Без full перерисовываются только страницы, затронутые изменениями
+    после прошлой сборки (по updated_at и списку страниц из манифеста).
+    Страницы рисуются параллельно в processes процессах.
+
+    Возвращает (отрисовано, удалено, ошибок).
+    """
+    root = Path(settings.PRERENDER_ROOT)
+    root.mkdir(parents=True, exist_ok=True)
+    started = timezone.now()
+    version = get_catalog_version()
+    manifest = None if full else _load_manifest(root)
+
+    pages = catalog_pages()
+    if manifest is None:
+        to_render = set(pages)
+        old_pages = {}
+    else:
+        to_render = _pages_to_render(
+            root, pages, manifest, datetime.fromisoformat(manifest['built_at']), version)
+        old_pages = manifest['pages']
+
+    removed = set(old_pages) - set(pages)
+    for path in removed:
+        _remove(page_file(root, path))
+
+    failed = set()
+    for path, status in _render_all(sorted(to_render), processes):
+        if status != 200:
+            failed.add(path)
+            if status is not None:
+                logger.warning("Page %s was not prerendered: status %s", path, status)
+
+    # Неудавшиеся страницы не попадают в манифест и будут перерисованы
+    # следующей сборкой как новые
+    _save_manifest(root, {
+        'built_at': started.isoformat(),
+        'version': version,
+        'pages': {path: page for path, page in pages.items() if path not in failed},
+    })
+    return len(to_render) - len(failed), len(removed), len(failed)
+
+
+def _render_all(paths, processes):
+    if processes == 1 or len(paths) < 2:
+        return map(_render_with_path, paths)
+    # Дочерние процессы открывают свои соединения с БД, унаследованные
+    # от родителя использовать нельзя
+    connections.close_all()
+    pool = multiprocessing.get_context('fork').Pool(processes)
+    try:
+        return list(pool.imap_unordered(_render_with_path, paths, chunksize=20))
+    finally:
+        pool.close()
+        pool.join()
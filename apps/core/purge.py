@@ -0,0 +1,113 @@
+import logging
+import threading
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from apps.catalog.models import Category, Product
+from apps.core.prerender import discard_pages
+
+logger = logging.getLogger(__name__)
+
+# При массовых изменениях (импорт) обновляются только общие страницы,
+# остальные устареют сами по истечении срока микрокэша nginx
+MAX_PURGE_PATHS = 200
+
+
+class NginxPurger:
+    """
+    Обновляет страницы в микрокэше nginx (nginx/nginx-microcache.conf).
+
+    В стандартном nginx нет удаления из proxy_cache, поэтому страница
+    запрашивается через служебный сервер с proxy_cache_bypass: nginx
+    получает свежий ответ из Django и перезаписывает им запись кэша.
+    Ключ кэша не зависит от Host, так что один запрос обновляет страницу
+    и для sitera.kz, и для www.sitera.kz; Host нужен только Django
+    (ALLOWED_HOSTS).
+    """
+
+    def __init__(self):
+        self.base_url = settings.PAGE_PURGE_URL.rstrip('/')
+        self.host = settings.PAGE_PURGE_HOST
+        self.timeout = 10
+
+    def purge(self, paths):
+        thread = threading.Thread(target=self._refresh, args=(list(paths),),
+                                  daemon=True)
+        thread.start()
+
+    def _refresh(self, paths):
+        with requests.Session() as session:
+            for path in paths:
+                try:
+                    session.get(f'{self.base_url}{path}', timeout=self.timeout,
+                                headers={'Host': self.host}, allow_redirects=False)
+                except requests.RequestException as e:
+                    logger.warning("Failed to refresh %s in nginx cache: %s", path, e)
+
+
+class LocalPurger:
+    """Заменитель nginx для тестов и разработки: запоминает обновленные пути"""
+
+    def __init__(self):
+        self.purged = []
+
+    def purge(self, paths):
+        self.purged.extend(paths)
+
+
+_purger = None
+
+
+def get_purger():
+    """Настроенный в PAGE_PURGER обработчик или None, если кэша nginx нет"""
+    global _purger
+    if _purger is None and settings.PAGE_PURGER:
+        _purger = import_string(settings.PAGE_PURGER)()
+    return _purger
+
+
+def purge_catalog_pages(product_urls=(), category_ids=(), product_ids=()):
+    """
+    Обновляет в кэше nginx и удаляет из статической копии (prerender)
+    страницы, затронутые изменением товаров и категорий: сами товары, их
+    категории со всеми предками, список категорий и главную. Все это
+    делается после фиксации транзакции.
+    """
+    purger = get_purger()
+    # Статическую копию nginx отдает раньше своего кэша, поэтому ее
+    # файлы удаляются все, а не только первые MAX_PURGE_PATHS
+    prerendered = Path(settings.PRERENDER_ROOT).is_dir()
+    if purger is None and not prerendered:
+        return
+
+    paths = [reverse('core:home'), reverse('catalog:category_list')]
+    detail_paths = set(product_urls)
+    if product_ids:
+        detail_paths.update(
+            product.get_absolute_url() for product in
+            Product.objects.filter(id__in=product_ids).only('id', 'slug'))
+    if category_ids:
+        ancestor_ids = set()
+        for path in Category.objects.filter(id__in=category_ids).values_list(
+                'path', flat=True):
+            # Только что созданная категория еще без path
+            ancestor_ids.update(int(part) for part in path.split('/') if part)
+        detail_paths.update(
+            category.get_absolute_url() for category in
+            Category.objects.filter(id__in=ancestor_ids).only('id', 'slug'))
+    stale_files = paths + sorted(detail_paths)
+    if len(detail_paths) <= MAX_PURGE_PATHS:
+        paths.extend(sorted(detail_paths))
+
+    def send():
+        if prerendered:
+            discard_pages(stale_files)
+        if purger is not None:
+            purger.purge(paths)
+
+    transaction.on_commit(send)
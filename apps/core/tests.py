@@ -1,3 +1,319 @@
-from django.test import TestCase
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from apps.catalog import conditional, views as catalog_views
+from apps.catalog.models import Category, Product
+from apps.catalog.signals import defer_catalog_updates
+from apps.catalog.snapshot import CatalogSnapshot
+from apps.catalog.version import bump_catalog_version, get_catalog_version
+
+from . import prerender, purge
+from .cache import get_or_compute
+from .middleware import CSRF_PLACEHOLDER, PageCacheMiddleware
+
+PAGE = '<form><input type="hidden" name="csrfmiddlewaretoken" value="{}"></form>'
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'page-cache-tests'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+              'LOCATION': 'page-cache-tests-state'},
+})
+class PageCacheMiddlewareTests(TestCase):
+    """Правила кэша страниц: HIT/STALE, обход кэша, подмена CSRF-токена"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.calls = 0
+        self.status = 200
+        self.middleware = PageCacheMiddleware(self.view)
+        # Фоновый пересчет проверяется отдельно
+        patcher = mock.patch.object(PageCacheMiddleware, '_revalidate_in_background')
+        self.revalidate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def view(self, request):
+        self.calls += 1
+        return HttpResponse(PAGE.format(f'token-{self.calls}'), status=self.status)
+
+    def get(self, path='/catalog/', user=None, **kwargs):
+        self.request = self.factory.get(path, **kwargs)
+        self.request.user = user or AnonymousUser()
+        return self.middleware(self.request)
+
+    def post(self):
+        request = self.factory.post('/catalog/')
+        request.user = AnonymousUser()
+        return request
+
+    def test_miss_then_hit(self):
+        first = self.get()
+        self.assertEqual(self.calls, 1)
+        self.assertFalse(first.has_header('X-Page-Cache'))
+
+        second = self.get()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+
+    def test_csrf_token_replaced(self):
+        self.get()
+        response = self.get()
+        content = response.content.decode()
+
+        self.assertNotIn('token-1', content)
+        self.assertNotIn(CSRF_PLACEHOLDER, content)
+        self.assertRegex(content, r'value="[A-Za-z0-9]{64}"')
+        # Токен выдан этому посетителю: CsrfViewMiddleware выставит cookie
+        self.assertTrue(self.request.META.get('CSRF_COOKIE_NEEDS_UPDATE'))
+
+    def test_stale_after_version_change(self):
+        self.get()
+        bump_catalog_version()
+        response = self.get()
+
+        self.assertEqual(response['X-Page-Cache'], 'STALE')
+        self.assertEqual(self.calls, 1)
+        self.revalidate.assert_called_once()
+
+    def test_stale_after_soft_timeout(self):
+        self.get()
+        with mock.patch('time.time', return_value=time.time() + self.middleware.soft_timeout + 1):
+            response = self.get()
+
+        self.assertEqual(response['X-Page-Cache'], 'STALE')
+        self.revalidate.assert_called_once()
+
+    def test_single_revalidation(self):
+        self.get()
+        bump_catalog_version()
+        self.get()
+        self.get()
+
+        self.revalidate.assert_called_once()
+
+    def test_bypass(self):
+        user = User.objects.create_user('staff')
+        cases = {
+            'post': lambda: self.middleware(self.post()),
+            'authenticated': lambda: self.get(user=user),
+            'messages': lambda: self.get(HTTP_COOKIE='messages=x'),
+            'not listed': lambda: self.get('/contacts/'),
+            'unknown url': lambda: self.get('/nope/'),
+        }
+        for name, request in cases.items():
+            with self.subTest(name):
+                calls = self.calls
+                request()
+                request()
+                self.assertEqual(self.calls, calls + 2)
+
+    def test_refresh_header_recomputes(self):
+        self.get()
+        response = self.get(HTTP_X_CACHE_REFRESH='1')
+
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_response_with_cookies_not_cached(self):
+        def view(request):
+            self.calls += 1
+            response = HttpResponse('ok')
+            response.set_cookie('seen', '1')
+            return response
+
+        self.middleware = PageCacheMiddleware(view)
+        self.get()
+        self.get()
+        self.assertEqual(self.calls, 2)
+
+    def test_error_served_from_local_copy(self):
+        self.get()
+        cache.clear()
+        self.status = 500
+
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Page-Cache'], 'STALE')
+
+    def test_error_without_copy(self):
+        self.status = 500
+        self.assertEqual(self.get().status_code, 500)
+        self.status = 200
+        self.get()
+        self.assertEqual(self.calls, 2)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'single-flight-tests'},
+})
+class GetOrComputeTests(TestCase):
+    """Значение из общего кэша, вычисляемое одним процессом"""
+
+    def setUp(self):
+        cache.clear()
+        self.compute = mock.Mock(return_value=b'body')
+
+    def test_computed_once(self):
+        self.assertEqual(get_or_compute('key', self.compute, 60), b'body')
+        self.assertEqual(get_or_compute('key', self.compute, 60), b'body')
+        self.compute.assert_called_once()
+        self.assertIsNone(cache.get('key:lock'))
+
+    def test_waits_for_lock_holder(self):
+        cache.add('key:lock', 1)
+        # Пока ожидающий спит, значение записывает держатель блокировки
+        with mock.patch('time.sleep', side_effect=lambda _: cache.set('key', b'other')):
+            self.assertEqual(get_or_compute('key', self.compute, 60), b'other')
+        self.compute.assert_not_called()
+
+    def test_computes_after_wait_timeout(self):
+        cache.add('key:lock', 1)
+        self.assertEqual(get_or_compute('key', self.compute, 60, wait_timeout=0), b'body')
+        self.compute.assert_called_once()
+
+    def test_lock_released_on_error(self):
+        self.compute.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            get_or_compute('key', self.compute, 60)
+        self.assertIsNone(cache.get('key:lock'))
+
+
+def create_product(category, title, **kwargs):
+    kwargs.setdefault('slug', f'product-{Product.objects.count()}')
+    return Product.objects.create(
+        title=title, category=category, description='Описание', **kwargs)
+
+
+@override_settings(PAGE_PURGER='apps.core.purge.LocalPurger',
+                   PRERENDER_ROOT=str(Path(tempfile.gettempdir()) / 'no-prerendered-pages'))
+class PurgeTests(TestCase):
+    """Обновление страниц в кэше nginx после изменений каталога"""
+
+    def setUp(self):
+        patcher = mock.patch.object(purge, '_purger', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.root = Category.objects.create(name='Корень', slug='root')
+        self.child = Category.objects.create(name='Раздел', slug='child', parent=self.root)
+
+    def purged(self):
+        return purge.get_purger().purged
+
+    def test_product_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = create_product(self.child, 'Товар')
+
+        self.assertEqual(self.purged(), [
+            '/', '/catalog/', '/catalog/category/child/', '/catalog/category/root/',
+            product.get_absolute_url()])
+
+    def test_batch_refreshes_common_pages_only(self):
+        with mock.patch.object(purge, 'MAX_PURGE_PATHS', 2), \
+                self.captureOnCommitCallbacks(execute=True):
+            with defer_catalog_updates():
+                create_product(self.child, 'Первый')
+                create_product(self.child, 'Второй')
+
+        self.assertEqual(self.purged(), ['/', '/catalog/'])
+
+    @override_settings(PAGE_PURGE_URL='http://nginx:8081/', PAGE_PURGE_HOST='sitera.kz')
+    def test_nginx_refresh(self):
+        with mock.patch.object(purge.requests, 'Session') as session_class:
+            session = session_class.return_value.__enter__.return_value
+            session.get.side_effect = [requests.ConnectionError, mock.Mock()]
+            with self.assertLogs(purge.logger, 'WARNING'):
+                purge.NginxPurger()._refresh(['/a/', '/b/'])
+
+        # Ошибка одной страницы не мешает остальным
+        self.assertEqual(session.get.call_args_list, [
+            mock.call(f'http://nginx:8081{path}', timeout=10,
+                      headers={'Host': 'sitera.kz'}, allow_redirects=False)
+            for path in ('/a/', '/b/')])
+
+
+@override_settings(PAGE_PURGER='', CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'prerender-tests'},
+    'state': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+              'LOCATION': 'prerender-tests-state'},
+})
+class PrerenderTests(TestCase):
+    """Статическая копия каталога и ее инкрементальное обновление"""
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name) / 'prerendered'
+        settings = self.settings(PRERENDER_ROOT=str(self.root))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Снимок каталога строится заново для каждой страницы, без фоновой сборки
+        patchers = [
+            mock.patch.object(catalog_views, 'get_snapshot', side_effect=lambda *args, **kwargs:
+                              CatalogSnapshot.build(get_catalog_version())),
+            mock.patch.object(conditional, 'get_snapshot', return_value=None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.category = Category.objects.create(name='Категория', slug='category')
+        self.other = Category.objects.create(name='Другая', slug='other')
+        self.product = create_product(self.category, 'Товар')
+        self.other_product = create_product(self.other, 'Другой товар')
+
+    def build(self):
+        with mock.patch.object(prerender, 'render_page', wraps=prerender.render_page) as render:
+            result = prerender.build_static_catalog(processes=1)
+        self.rendered = {call.args[0] for call in render.call_args_list}
+        return result
+
+    def page(self, path):
+        return prerender.page_file(self.root, path)
+
+    def test_full_build(self):
+        self.assertEqual(self.build(), (6, 0, 0))
+        content = self.page(self.product.get_absolute_url()).read_text()
+        self.assertIn('Товар', content)
+        self.assertTrue(self.page('/').exists())
+
+    def test_only_changed_pages_rendered(self):
+        self.build()
+        self.assertEqual(self.build(), (0, 0, 0))
+
+        self.product.title = 'Новое название'
+        self.product.save()
+        self.build()
+        self.assertEqual(self.rendered, {
+            '/', '/catalog/', self.category.get_absolute_url(),
+            self.product.get_absolute_url()})
+
+    def test_catalog_change_discards_pages(self):
+        self.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        self.assertFalse(self.page(self.product.get_absolute_url()).exists())
+        self.assertFalse(self.page('/').exists())
+        self.assertTrue(self.page(self.other_product.get_absolute_url()).exists())
+
+    def test_hidden_product_removed(self):
+        self.build()
+        self.product.is_active = False
+        self.product.save()
+
+        self.assertEqual(self.build()[1], 1)
+        self.assertFalse(self.page(self.product.get_absolute_url()).exists())
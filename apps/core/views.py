@@ -1,5 +1,6 @@
 from django.shortcuts import render
 from django.views.generic import TemplateView
+from apps.catalog.featured import attach_featured_products
 from apps.catalog.models import Category, Product
 
 
@@ -10,20 +11,22 @@ class HomeView(TemplateView):
         context = super().get_context_data(**kwargs)
 
         # Получаем основные категории для главной страницы
-        main_categories = Category.objects.filter(
+        main_categories = list(Category.objects.filter(
             parent=None,
             is_active=True
-        ).order_by('order')[:3]
+        ).order_by('order')[:3])
 
-        # Для каждой категории получаем несколько товаров
-        for category in main_categories:
-            category.featured_products = Product.objects.filter(
-                category=category,
-                is_active=True
-            ).order_by('?')[:4]  # Случайные 4 товара
+        # Для каждой категории - несколько случайных товаров из заранее
+        # собранного пула раздела
+        attach_featured_products(main_categories)
 
         context['main_categories'] = main_categories
 
+        # Популярное за неделю: рейтинг заранее посчитан update_product_rankings
+        context['popular_products'] = Product.objects.active().filter(
+            weekly_views__gt=0
+        ).order_by('-weekly_views', '-id')[:6]
+
         # Получаем последние добавленные товары
         context['latest_products'] = Product.objects.filter(
             is_active=True
@@ -32,6 +32,7 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 
 THIRD_PARTY_APPS = [
@@ -50,12 +51,14 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.core.middleware.PageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -91,6 +94,56 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# По умолчанию кэш хранится в PostgreSQL, чтобы быть общим для всех воркеров
+# gunicorn (таблицы создаются командой createcachetable).
+# DatabaseCache при переполнении удаляет часть записей (по умолчанию уже
+# после 300): в default лежат страницы, фрагменты и ответы поиска, поэтому
+# лимит большой. Версия каталога (apps.catalog.version) хранится отдельно,
+# в 'state': туда не пишется ничего вытесняемого, и ее потеря не выглядит
+# как изменение каталога
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', default='django_cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=200000, cast=int),
+        },
+    },
+    'state': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache_state',
+        'TIMEOUT': None,
+    },
+}
+
+# Кэш страниц для анонимных посетителей (apps.core.middleware): после
+# PAGE_CACHE_SOFT_TIMEOUT секунд или изменения каталога страница считается
+# устаревшей и пересчитывается в фоне, а до PAGE_CACHE_TIMEOUT отдается
+# старая копия
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=3600, cast=int)
+PAGE_CACHE_SOFT_TIMEOUT = config('PAGE_CACHE_SOFT_TIMEOUT', default=60, cast=int)
+
+# Сброс страниц в микрокэше nginx (nginx/nginx-microcache.conf) после
+# изменения каталога: 'apps.core.purge.NginxPurger' или пусто - без сброса
+PAGE_PURGER = config('PAGE_PURGER', default='')
+PAGE_PURGE_URL = config('PAGE_PURGE_URL', default='http://nginx:8081')
+PAGE_PURGE_HOST = config('PAGE_PURGE_HOST', default='sitera.kz')
+
+# Статическая копия каталога (команда prerender_catalog), которую nginx
+# отдает анонимным посетителям без обращения к Django
+PRERENDER_ROOT = config('PRERENDER_ROOT', default=str(BASE_DIR / 'prerendered'))
+
+# Импорт, не обновлявшийся столько секунд, считается брошенным
+# остановленным обработчиком (run_import_worker)
+IMPORT_JOB_STALE_AFTER = config('IMPORT_JOB_STALE_AFTER', default=600, cast=int)
+
+# Загруженные файлы импорта хранятся вне MEDIA_ROOT: его nginx отдает
+# публично. Каталог общий для web и run_import_worker
+IMPORT_UPLOAD_ROOT = config('IMPORT_UPLOAD_ROOT', default=str(BASE_DIR / 'private'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -19,5 +19,8 @@ python manage.py collectstatic --noinput
 # Apply database migrations
 python manage.py migrate
 
+# Create the shared cache table
+python manage.py createcachetable
+
 # Start the application
 exec "$@"
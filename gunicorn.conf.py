@@ -34,6 +34,37 @@ user = None
 group = None
 tmp_upload_dir = None
 
+
+# Server hooks
+def when_ready(server):
+    # Снимок каталога и индекс автодополнения строятся в мастере до запуска
+    # воркеров: они получают их через fork и делят страницы памяти
+    # (copy-on-write), а первые запросы воркера не упираются в timeout
+    import gc
+    from django.db import connections
+    try:
+        from apps.catalog.snapshot import get_snapshot
+        get_snapshot(wait=True)
+    except Exception:
+        server.log.exception("Failed to build catalog snapshot")
+    try:
+        from apps.catalog.autocomplete import get_index
+        get_index(wait=True)
+    except Exception:
+        server.log.exception("Failed to build autocomplete index")
+    finally:
+        # Соединения с БД не должны достаться воркерам от мастера
+        connections.close_all()
+    # Эти объекты не трогает сборщик мусора, иначе страницы копируются
+    gc.freeze()
+
+
+def worker_exit(server, worker):
+    # Записываем просмотры, накопленные воркером, перед его остановкой
+    from apps.catalog.tracking import flush_views
+    flush_views()
+
+
 # SSL (if needed)
 # keyfile = "/path/to/keyfile"
 # certfile = "/path/to/certfile"
\ No newline at end of file